@@ -1,10 +1,19 @@
+import datetime
+import hashlib
 import logging
 import random
 import re
-import boto3
 import json
+import uuid
 
+from sqlalchemy import and_, or_, text
+
+import ckan.logic.schema as ckan_schema
 import ckan.plugins.toolkit as toolkit
+import ckanext.who_romania.aggregation as aggregation
+import ckanext.who_romania.aws as aws
+import ckanext.who_romania.executors as executors
+from ckanext.who_romania.model import LambdaInvocation
 from ckan.plugins.toolkit import ValidationError, _
 
 
@@ -86,14 +95,18 @@ def package_create(next_action, context, data_dict):
 
 @toolkit.chained_action
 def user_list(next_action, context, data_dict):
-    try:
-        user_from_id = toolkit.get_action('user_show')(
-            context,
-            {'id': data_dict.get('q', '')}
-        )
-        data_dict['q'] = user_from_id.get('name')
-    except toolkit.ObjectNotFound:
-        pass
+    """
+    Allows users to be found by id as well as by name.  An id in ``q`` is
+    swapped for the user's name with a primary key lookup, before core's
+    search (indexed by the pg_trgm indexes on the user's name, fullname and
+    email, where the extension is available).
+    """
+    model = context['model']
+    q = data_dict.get('q')
+    if q:
+        user_name = model.Session.query(model.User.name).filter(model.User.id == q).scalar()
+        if user_name:
+            data_dict['q'] = user_name
     return next_action(context, data_dict)
 
 
@@ -118,50 +131,488 @@ def check_id_is_unique(context, data_dict):
             raise ValidationError(_('That user ID is not available.'))
 
 
+def user_create_batch(context, data_dict):
+    """
+    Creates many users at once, e.g. when onboarding a clinic's staff.
+
+    Ids and names are checked against the existing users, and each other,
+    with a query each for the whole batch, rather than a query per user.
+    Users without a name are given one generated from their email address.
+    The users are created in a single transaction; those that fail
+    validation are skipped and their errors returned.
+
+    :param users: the users to create, each as for user_create, with the
+        name optional
+    :type users: list of dictionaries
+
+    :rtype dictionary
+    :returns the users ``created`` and the ``errors`` of those that weren't,
+        as a list of ``{"index": <position in users>, "errors": {...}}``
+    """
+    model = context['model']
+    toolkit.check_access('user_create_batch', context, data_dict)
+    users = data_dict.get('users')
+    if not isinstance(users, list) or not all(isinstance(user, dict) for user in users):
+        raise ValidationError({'users': [_('Must be a list of users')]})
+    users = [dict(user) for user in users]
+    errors = {}
+
+    def add_error(index, field, message):
+        errors.setdefault(index, {}).setdefault(field, []).append(message)
+
+    for field, column, message in [
+        ('id', model.User.id, _('That user ID is not available.')),
+        ('name', model.User.name, _('That login name is not available.')),
+    ]:
+        values = {index: user[field] for index, user in enumerate(users) if user.get(field)}
+        for index, value in values.items():
+            if not isinstance(value, str):
+                add_error(index, field, _('Must be a string'))
+        taken = _existing_values(model, column, [value for value in values.values() if isinstance(value, str)])
+        for index, value in values.items():
+            if value in taken:
+                add_error(index, field, message)
+            elif isinstance(value, str):
+                taken.add(value)
+
+    unnamed = {}
+    for index, user in enumerate(users):
+        if user.get('name') or index in errors:
+            continue
+        if isinstance(user.get('email'), str) and '@' in user['email']:
+            unnamed[index] = user['email']
+        else:
+            add_error(index, 'email', _('Missing value'))
+    names = _get_random_usernames_from_emails(unnamed, model, exclude={
+        user['name'] for user in users if isinstance(user.get('name'), str)
+    })
+    for index in unnamed:
+        if index in names:
+            users[index]['name'] = names[index]
+        else:
+            add_error(index, 'name', _('Could not generate a unique user name'))
+
+    schema = _user_batch_schema()
+    created = []
+    try:
+        for index, user in enumerate(users):
+            if index in errors:
+                continue
+            user_context = dict(context, schema=schema, defer_commit=True)
+            _data, user_errors = toolkit.navl_validate(dict(user), schema, user_context)
+            if user_errors:
+                errors[index] = user_errors
+                continue
+            created.append(toolkit.get_action('user_create')(user_context, user))
+        model.repo.commit()
+    except Exception:
+        model.Session.rollback()
+        raise
+    return {
+        'created': created,
+        'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)],
+    }
+
+
+def _user_batch_schema():
+    """
+    Core's user schema, less the validators checking a user's name against
+    the existing users one query at a time, as user_create_batch checks
+    them all at once beforehand.
+    """
+    schema = ckan_schema.default_user_schema()
+    schema['name'] = [
+        validator for validator in schema['name']
+        if validator is not toolkit.get_validator('user_name_validator')
+    ]
+    return schema
+
+
+def _existing_values(model, column, values):
+    """Returns those of the values found in a user column, in one query"""
+    if not values:
+        return set()
+    return {
+        value for (value,) in model.Session.query(column).filter(column.in_(set(values)))
+    }
+
+
 def lambda_invoke(context, data_dict):
+    """
+    Invokes a lambda function asynchronously and records the invocation.
+
+    :param lambda_function: the name of the lambda function
+    :type lambda_function: string
+
+    All other parameters are passed on to the lambda function, along with the
+    ``ckan_user`` invoking it and the ``ckan_url`` it should act upon.
+
+    The function is invoked on AWS Lambda, or run by its local handler if
+    ``ckanext.who_romania.lambda_executor`` is ``jobs`` (the CKAN background
+    job queue) or ``process`` (a local process pool).
+
+    Repeated invocations of a function with the same parameters are
+    coalesced: while an earlier invocation invoked within
+    ``ckanext.who_romania.lambda_coalesce_window`` seconds (and within the
+    time its executor lets it run for) is still queued or running, it is
+    returned (with ``coalesced`` set) instead of invoking the
+    function again.  If ``ckanext.who_romania.lambda_coalesce_mode`` is
+    ``reject`` a ValidationError is raised instead.
+
+    :rtype dictionary
+    :returns the recorded invocation, see ``lambda_invocation_show``, and
+        ``coalesced``.  The ``StatusCode`` of the asynchronous invocation,
+        202, and its ``ResponseMetadata`` ``RequestId`` are returned too, as
+        they were before invocations were recorded.
+    """
     toolkit.check_access('lambda_invoke', context, data_dict)
     lambda_function = toolkit.get_or_bust(data_dict, 'lambda_function')
     del data_dict['lambda_function']
+    model = context['model']
+    payload_hash = _payload_hash(lambda_function, data_dict)
+    # Serialises concurrent invocations with the same payload across
+    # processes until this transaction commits.
+    model.Session.execute(
+        text('SELECT pg_advisory_xact_lock(:key)'),
+        {'key': int(payload_hash[:15], 16)}
+    )
+    duplicate = _in_progress_duplicate(model, lambda_function, payload_hash)
+    if duplicate:
+        model.Session.commit()
+        if toolkit.config.get('ckanext.who_romania.lambda_coalesce_mode') == 'reject':
+            raise ValidationError({'lambda_function': [_(
+                'This function is already running with the same parameters'
+            )]})
+        return _invocation_result(duplicate, coalesced=True)
     data_dict['ckan_user'] = context['user']
     data_dict['ckan_url'] = toolkit.config.get('ckanext.who_romania.lambda_ckan_url')
+    executor = executors.get_executor()
+    user = model.User.get(context['user'])
+    invocation = LambdaInvocation(
+        lambda_function=lambda_function,
+        dataset_id=data_dict.get('dataset_id'),
+        user_id=getattr(user, 'id', None),
+        payload_hash=payload_hash,
+        executor=executor.name
+    )
+    if executor.local:
+        # Local runs look up their invocation, so it must exist beforehand
+        invocation.id = str(uuid.uuid4())
+        model.Session.add(invocation)
+        model.Session.commit()
     try:
-        client = boto3.client('lambda')
-        return client.invoke(
-            FunctionName=lambda_function,
-            InvocationType='Event',
-            LogType='None',
-            ClientContext='string',
-            Payload=json.dumps(data_dict)
-        )
+        invocation.id = executor.invoke(lambda_function, data_dict, invocation.id)
     except Exception as e:
+        if executor.local:
+            invocation.status = LambdaInvocation.FAILED
+            model.Session.commit()
+        else:
+            model.Session.rollback()
         raise toolkit.ObjectNotFound(
             f"{e} Lambda function could not be found and invoked, are "
             f"you sure access permissions are correct? {data_dict}"
         )
+    if not executor.local:
+        model.Session.add(invocation)
+        model.Session.commit()
+        executor.track(invocation.id)
+    return _invocation_result(invocation, coalesced=False)
+
+
+def _invocation_result(invocation, coalesced):
+    # Asynchronous invocations are accepted with a 202, which API clients
+    # relied on when the AWS response was returned as it was
+    return {
+        **invocation.as_dict(),
+        'coalesced': coalesced,
+        'StatusCode': 202,
+        'ResponseMetadata': {'RequestId': invocation.id},
+    }
+
+
+def _payload_hash(lambda_function, data_dict):
+    payload = json.dumps(data_dict, sort_keys=True, default=str)
+    return hashlib.sha256(f"{lambda_function}\n{payload}".encode('utf-8')).hexdigest()
+
+
+def _in_progress_duplicate(model, lambda_function, payload_hash):
+    """
+    Returns the latest invocation with the same payload that is still queued
+    or running, invoked within the coalescing window.  Invocations older
+    than the time their executor allows them to run for are ignored, even
+    if their status hasn't caught up with them yet.
+    """
+    window = toolkit.config.get('ckanext.who_romania.lambda_coalesce_window')
+    if not window:
+        return None
+    now = datetime.datetime.utcnow()
+    aws_since = now - datetime.timedelta(seconds=min(
+        window, toolkit.config.get('ckanext.who_romania.lambda_timeout')
+    ))
+    local_since = now - datetime.timedelta(seconds=min(
+        window, toolkit.config.get('ckanext.who_romania.lambda_local_timeout')
+    ))
+    return model.Session.query(LambdaInvocation).filter(
+        LambdaInvocation.lambda_function == lambda_function,
+        LambdaInvocation.payload_hash == payload_hash,
+        or_(
+            and_(
+                LambdaInvocation.executor == executors.AWSLambdaExecutor.name,
+                LambdaInvocation.created >= aws_since
+            ),
+            and_(
+                LambdaInvocation.executor != executors.AWSLambdaExecutor.name,
+                LambdaInvocation.created >= local_since
+            )
+        ),
+        LambdaInvocation.status.in_([LambdaInvocation.QUEUED, LambdaInvocation.RUNNING])
+    ).order_by(LambdaInvocation.created.desc()).first()
+
+
+@toolkit.side_effect_free
+def lambda_invocation_show(context, data_dict):
+    """
+    Returns a recorded lambda invocation.  Its status and log stream are
+    kept up to date by the executor running it, see
+    ``executors.track_invocation``.
+
+    :param id: the invocation (AWS, or local executor) request id
+    :type id: string
+
+    :rtype dictionary
+    :returns the invocation's ``id``, ``lambda_function``, ``dataset_id``,
+        ``user_id``, ``created`` time, ``status``, ``log_stream_name`` and
+        ``executor``.
+    """
+    toolkit.check_access('lambda_invoke', context, data_dict)
+    invocation = _get_invocation_or_bust(data_dict)
+    if invocation.in_progress:
+        # Executors update the status on a connection of their own
+        context['model'].Session.refresh(invocation)
+    return invocation.as_dict()
+
+
+@toolkit.side_effect_free
+def lambda_invocation_list(context, data_dict):
+    """
+    Returns the most recent lambda invocations.
+
+    :param lambda_function: only list invocations of this function (optional)
+    :type lambda_function: string
+    :param dataset_id: only list invocations for this dataset (optional)
+    :type dataset_id: string
+    :param limit: the maximum number of invocations to return (optional,
+        default: 20)
+    :type limit: int
+
+    :rtype list of dictionaries
+    """
+    toolkit.check_access('lambda_invoke', context, data_dict)
+    limit = _int_param(data_dict, 'limit')
+    query = context['model'].Session.query(LambdaInvocation)
+    if data_dict.get('lambda_function'):
+        query = query.filter(LambdaInvocation.lambda_function == data_dict['lambda_function'])
+    if data_dict.get('dataset_id'):
+        query = query.filter(LambdaInvocation.dataset_id == data_dict['dataset_id'])
+    query = query.order_by(LambdaInvocation.created.desc())
+    query = query.limit(20 if limit is None else limit)
+    return [invocation.as_dict() for invocation in query]
+
+
+def _get_invocation_or_bust(data_dict):
+    invocation_id = toolkit.get_or_bust(data_dict, 'id')
+    invocation = LambdaInvocation.get(invocation_id)
+    if invocation is None:
+        raise toolkit.ObjectNotFound(_('Lambda invocation not found'))
+    return invocation
 
 
 def lambda_logs(context, data_dict):
-    lambda_function = toolkit.get_or_bust(data_dict, 'lambda_function')
+    """
+    Returns the events logged by a lambda function, parsed into records.
+
+    :param lambda_function: the name of the lambda function
+    :type lambda_function: string
+    :param invocation_id: return only the logs of this invocation, instead of
+        the latest logs of ``lambda_function`` (optional, and the only way to
+        read the logs of functions run by a local executor)
+    :type invocation_id: string
+    :param log_stream_name: the log stream to read (optional, defaults to the
+        stream with the most recent event)
+    :type log_stream_name: string
+    :param next_token: the ``nextForwardToken`` returned by a previous call,
+        to fetch only events logged since that call (optional)
+    :type next_token: string
+    :param levels: only return records with these log levels, e.g.
+        ``["ERROR", "WARNING"]`` or ``"ERROR,WARNING"`` (optional)
+    :type levels: list or string
+    :param start_time: only return records logged at or after this time, in
+        milliseconds since the epoch (optional)
+    :type start_time: int
+    :param end_time: only return records logged at or before this time, in
+        milliseconds since the epoch (optional)
+    :type end_time: int
+    :param limit: the maximum number of records to return, the most recent
+        records are kept, and only as much of the log stream as they need is
+        read (optional)
+    :type limit: int
+
+    :rtype dictionary
+    :returns ``records``, each with a ``level``, ``timestamp``, ``request_id``
+        and ``message``, the ``log_stream_name`` that was read and the
+        ``nextForwardToken`` to pass in as ``next_token`` next time.  Also
+        the ``invocation`` if an ``invocation_id`` was given.  The unparsed
+        CloudWatch ``events`` of the records are returned too, as they were
+        before records were added.
+    """
+    invocation = None
+    if data_dict.get('invocation_id'):
+        invocation = toolkit.get_action('lambda_invocation_show')(
+            context, {'id': data_dict['invocation_id']}
+        )
+        lambda_function = invocation['lambda_function']
+    else:
+        lambda_function = toolkit.get_or_bust(data_dict, 'lambda_function')
     log_group = f'/aws/lambda/{lambda_function}'
+    levels = data_dict.get('levels')
+    if isinstance(levels, str):
+        levels = [level.strip() for level in levels.split(',') if level.strip()]
+    start_time = _int_param(data_dict, 'start_time')
+    end_time = _int_param(data_dict, 'end_time')
+    limit = _int_param(data_dict, 'limit')
+    if invocation and invocation['executor'] != executors.AWSLambdaExecutor.name:
+        # Local runs store their own log records
+        records, next_token = executors.local_log_records(
+            invocation['id'], data_dict.get('next_token')
+        )
+        records = aws.filter_log_records(
+            records,
+            levels=levels,
+            start_time=start_time,
+            end_time=end_time,
+            limit=limit
+        )
+        return {
+            'records': records,
+            'events': [_log_event(record) for record in records],
+            'log_stream_name': None,
+            'nextForwardToken': next_token,
+            'invocation': invocation
+        }
+    if invocation:
+        if not invocation['log_stream_name']:
+            return {
+                'records': [],
+                'events': [],
+                'log_stream_name': None,
+                'nextForwardToken': None,
+                'invocation': invocation
+            }
+        log_stream_name = invocation['log_stream_name']
+        # Log streams are reused by later invocations
+        if start_time is None and not data_dict.get('next_token'):
+            start_time = LambdaInvocation.get(invocation['id']).created_timestamp - aws.LOG_CLOCK_SKEW
     try:
-        client = boto3.client('logs')
-        if not data_dict.get('log_stream_name'):
-            log_stream_name = client.describe_log_streams(
-                logGroupName=log_group,
-                orderBy='LastEventTime',
-                limit=1,
-                descending=True
-            )['logStreams'][0]['logStreamName']
+        if not invocation:
+            log_stream_name = data_dict.get('log_stream_name') or aws.latest_log_stream(log_group)
+        if limit and not data_dict.get('next_token'):
+            # Only the most recent records are wanted, so the stream is read
+            # backwards until enough of them are attributed and filtered as
+            # they will be returned
+            def enough(events):
+                records, _events = _log_records(events, invocation, levels, start_time, end_time)
+                return len(records) >= limit
+
+            events, next_token = aws.latest_log_events(
+                log_group,
+                log_stream_name,
+                enough,
+                start_time=start_time,
+                end_time=end_time
+            )
         else:
-            log_stream_name = data_dict['log_stream_name']
-        return client.get_log_events(
-            logGroupName=log_group,
-            logStreamName=log_stream_name,
-            startTime=1
-        )
+            events, next_token = aws.log_events(
+                log_group,
+                log_stream_name,
+                next_token=data_dict.get('next_token'),
+                start_time=start_time,
+                end_time=end_time
+            )
     except Exception as e:
         raise toolkit.ObjectNotFound(f"{e} Lambda logs could not be found, are you sure "
                                      f"AWS access permissions are correct? {data_dict}")
+    records, events = _log_records(events, invocation, levels, start_time, end_time, limit)
+    result = {
+        'records': records,
+        'events': events,
+        'log_stream_name': log_stream_name,
+        'nextForwardToken': next_token
+    }
+    if invocation:
+        result['invocation'] = invocation
+    return result
+
+
+def _log_records(events, invocation, levels, start_time, end_time, limit=None):
+    """
+    Parses CloudWatch events into records, attributing printed lines to the
+    invocation running at the time before filtering them.  Returns the
+    records and the events they were parsed from.
+    """
+    records = [aws.parse_log_event(event) for event in events]
+    events_by_record = {id(record): event for record, event in zip(records, events)}
+    aws.attribute_log_records(records)
+    records = aws.filter_log_records(
+        records,
+        levels=levels,
+        start_time=start_time,
+        end_time=end_time,
+        limit=limit,
+        request_id=invocation['id'] if invocation else None
+    )
+    return records, [events_by_record[id(record)] for record in records]
+
+
+def _log_event(record):
+    # Local runs store parsed records, this is the CloudWatch event they'd be
+    return {'timestamp': record['timestamp'], 'message': record['message']}
+
+
+def _int_param(data_dict, key):
+    value = data_dict.get(key)
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({key: [_('Must be an integer')]})
+    if value < 0:
+        raise ValidationError({key: [_('Must be a positive integer')]})
+    return value
+
+
+def family_medicine_aggregate(context, data_dict):
+    """
+    Aggregates the weekly CSV reports of a family medicine dataset into
+    monthly totals.  Only reports that have changed since the last time the
+    dataset was aggregated are read again.
+
+    :param id: the id or name of the dataset
+    :type id: string
+
+    :rtype dictionary
+    :returns the ``columns`` and ``rows`` of the monthly totals, summing the
+        numeric columns of the reports grouped by their other columns, and
+        the number of reports read (``reports_read``) and reused from the
+        last run (``reports_cached``).
+    """
+    dataset_id = toolkit.get_or_bust(data_dict, 'id')
+    toolkit.check_access('package_update', context, {'id': dataset_id})
+    try:
+        return aggregation.aggregate_dataset(context, dataset_id)
+    except ValueError as e:
+        context['model'].Session.rollback()
+        raise ValidationError({'resources': [str(e)]})
 
 
 def dataset_tag_replace(context, data_dict):
@@ -243,30 +694,64 @@ def _record_dataset_duplication(dataset_id, new_dataset_id, context):
 
 def _get_random_username_from_email(email, model):
     """
-    This function is copied from a CKAN core private function:
+    This function is adapted from a CKAN core private function:
         ckan.logic.action.create._get_random_username_from_email
     Github permalink:
         https://github.com/ckan/ckan/blob/0a596b8394dbf9582902853ad91450d2c0d7959b/ckan/logic/action/create.py#L1102-L1116
 
     The function has been deployed and used across a plethora of CKAN
-    instances, which is why we are adopting it here.
+    instances, which is why we are adopting it here.  Rather than looking up
+    each random name in turn, the candidates are checked in one query.
 
     WARNING: This logic reveals part of the user's email address
     as their username.  Fjelltopp recommends overriding this logic
     for public CKAN instances.
     """
+    names = _get_random_usernames_from_emails({email: email}, model)
+    return names.get(email, _cleaned_localpart(email))
 
-    localpart = email.split('@')[0]
-    cleaned_localpart = re.sub(r'[^\w]', '-', localpart).lower()
 
+def _get_random_usernames_from_emails(emails, model, exclude=()):
+    """
+    Generates a random user name for each of a dict of emails, checking
+    the candidates for all of them against the existing users together,
+    usually in a single query.  Names in exclude, e.g. those of other new users, aren't used.
+
+    Returns the names by the emails' keys, leaving out any that couldn't
+    be given a unique name.
+    """
     # if we can't create a unique user name within this many attempts
     # then something else is probably wrong and we should give up
     max_name_creation_attempts = 100
+    # candidates are checked a few per email at a time, so a large batch
+    # doesn't send a huge query when the first usually suffices
+    attempts_per_query = 5
+
+    usernames = {}
+    taken = set(exclude)
+    pending = dict(emails)
+    for _query in range(max_name_creation_attempts // attempts_per_query):
+        if not pending:
+            break
+        candidates = {
+            key: [
+                '%s-%d' % (_cleaned_localpart(email), random.SystemRandom().random() * 10000)
+                for _attempt in range(attempts_per_query)
+            ]
+            for key, email in pending.items()
+        }
+        taken |= _existing_values(
+            model, model.User.name, [name for names in candidates.values() for name in names]
+        )
+        for key, names in candidates.items():
+            name = next((name for name in names if name not in taken), None)
+            if name:
+                usernames[key] = name
+                taken.add(name)
+                del pending[key]
+    return usernames
 
-    for i in range(max_name_creation_attempts):
-        random_number = random.SystemRandom().random() * 10000
-        name = '%s-%d' % (cleaned_localpart, random_number)
-        if not model.User.get(name):
-            return name
 
-    return cleaned_localpart
+def _cleaned_localpart(email):
+    localpart = email.split('@')[0]
+    return re.sub(r'[^\w]', '-', localpart).lower()
@@ -0,0 +1,195 @@
+import hashlib
+import logging
+
+from sqlalchemy import text
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+import ckanext.who_romania.executors as executors
+import ckanext.who_romania.ingest as ingest
+import ckanext.who_romania.tabular as tabular
+import ckanext.who_romania.upload as who_romania_upload
+import ckanext.who_romania.validation as validation
+from ckanext.who_romania.model import AggregationPartial
+
+
+log = logging.getLogger(__name__)
+handler_log = logging.getLogger(f'{executors.HANDLER_LOGGER}.family_medicine')
+
+CHUNK_ROWS = tabular.CHUNK_ROWS
+
+
+def handler(event, context):
+    """
+    Computes the monthly totals of a family medicine dataset, taking the
+    same event as the family medicine lambda function so that it can be run
+    by a local executor, e.g. with:
+
+        ckanext.who_romania.lambda_local_functions =
+            FamilyMedicine=ckanext.who_romania.aggregation:handler
+
+    Unlike the lambda function it doesn't write a monthly output resource,
+    the totals are only logged and returned, so it is for trying out and
+    checking aggregations rather than replacing the lambda function.
+    """
+    result = toolkit.get_action('family_medicine_aggregate')(
+        {'user': event['ckan_user']},
+        {'id': event['dataset_id']}
+    )
+    handler_log.info(
+        f"Aggregated {len(result['rows'])} rows from {result['reports_read']} "
+        f"changed and {result['reports_cached']} unchanged weekly reports"
+    )
+    return result
+
+
+def aggregate_dataset(context, dataset_id):
+    """
+    Aggregates the weekly reports of a family medicine dataset into monthly
+    totals.  Each report is aggregated on its own into a partial, cached
+    against the report's sha256, so only reports uploaded since the last
+    run are read.  The monthly totals are then merged from the partials.
+
+    The columns grouped by and summed are taken from the reporting
+    template's schema, so every report is aggregated the same way.
+    Datasets with reports that failed validation are not aggregated.
+    """
+    schema = tabular.template_schema()
+    if not schema:
+        raise ValueError(
+            "Aggregation needs the reporting template's schema, configure "
+            "ckanext.who_romania.family_medicine_template_schema"
+        )
+    key_columns, value_columns = tabular.aggregation_columns(schema)
+    dataset = toolkit.get_action('package_show')(context, {'id': dataset_id})
+    failed = validation.failed_reports(dataset)
+    if failed:
+        raise ValueError("Weekly reports failed validation: " + ", ".join(
+            resource.get('name') or resource['id'] for resource in failed
+        ))
+    # Serialises aggregations of the dataset across processes until the
+    # partials are committed, so they aren't inserted twice
+    lock_key = int(hashlib.sha256(f"aggregate:{dataset['id']}".encode('utf-8')).hexdigest()[:15], 16)
+    model.Session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': lock_key})
+    partials = {partial.resource_id: partial for partial in AggregationPartial.for_dataset(dataset['id'])}
+    reports_read = 0
+    reports_cached = 0
+    current = []
+    for resource in dataset.get('resources', []):
+        # Only weekly reports are summed, not other CSVs such as outputs
+        if not ingest.is_weekly_report(resource):
+            continue
+        partial = partials.pop(resource['id'], None)
+        if partial is not None and partial.sha256 == resource['sha256'] \
+                and partial.key_columns == key_columns and partial.value_columns == value_columns:
+            reports_cached += 1
+        else:
+            log.info(f"Aggregating weekly report {resource['id']}")
+            with who_romania_upload.open_giftless_resource(context, resource) as report:
+                aggregated = aggregate_report(report, key_columns, value_columns)
+            if partial is None:
+                partial = AggregationPartial(resource_id=resource['id'], dataset_id=dataset['id'])
+                model.Session.add(partial)
+            partial.sha256 = resource['sha256']
+            partial.key_columns = aggregated['key_columns']
+            partial.value_columns = aggregated['value_columns']
+            partial.totals = aggregated['totals']
+            partial.row_count = aggregated['row_count']
+            reports_read += 1
+        current.append(partial)
+    # Whatever is left over belongs to reports that have since been deleted
+    for partial in partials.values():
+        model.Session.delete(partial)
+    model.Session.commit()
+    merged = merge_partials(
+        {
+            'key_columns': partial.key_columns,
+            'value_columns': partial.value_columns,
+            'totals': partial.totals
+        }
+        for partial in current
+    )
+    merged.update({'reports_read': reports_read, 'reports_cached': reports_cached})
+    return merged
+
+
+def aggregate_report(report, key_columns, value_columns):
+    """
+    Sums the value columns of a CSV weekly report, grouped by its key
+    columns.  The report is read in chunks, and each chunk processed a
+    column at a time, so memory use is bounded however long the report.
+
+    Columns missing from the report are grouped under an empty value, or
+    summed as zero, and a non-numeric value in a value column is an error.
+    """
+    header, chunks = tabular.csv_chunks(report, CHUNK_ROWS)
+    positions = {name: i for i, name in enumerate(header)}
+    totals = {}
+    row_count = 0
+    for chunk in chunks:
+        columns = list(zip(*chunk))
+        blank = ('',) * len(chunk)
+        keys = list(zip(*(
+            columns[positions[name]] if name in positions else blank
+            for name in key_columns
+        ))) if key_columns else [()] * len(chunk)
+        for key in keys:
+            if key not in totals:
+                totals[key] = [0] * len(value_columns)
+        for position, name in enumerate(value_columns):
+            if name not in positions:
+                continue
+            values = _numbers(columns[positions[name]], name, row_count)
+            for key, value in zip(keys, values):
+                totals[key][position] += value
+        row_count += len(chunk)
+    return {
+        'key_columns': list(key_columns),
+        'value_columns': list(value_columns),
+        'totals': [list(key) + sums for key, sums in totals.items()],
+        'row_count': row_count
+    }
+
+
+def merge_partials(partials):
+    """
+    Merges the totals of several weekly reports, matching columns by name.
+    Reports without one of the grouping columns are grouped under an empty
+    value for it.
+    """
+    partials = list(partials)
+    key_columns = []
+    value_columns = []
+    for partial in partials:
+        key_columns += [c for c in partial['key_columns'] if c not in key_columns]
+    for partial in partials:
+        value_columns += [
+            c for c in partial['value_columns'] if c not in value_columns and c not in key_columns
+        ]
+    merged = {}
+    for partial in partials:
+        key_count = len(partial['key_columns'])
+        for row in partial['totals']:
+            keys = dict(zip(partial['key_columns'], row[:key_count]))
+            sums = merged.setdefault(tuple(keys.get(c, '') for c in key_columns), {})
+            for column, value in zip(partial['value_columns'], row[key_count:]):
+                sums[column] = sums.get(column, 0) + value
+    return {
+        'columns': key_columns + value_columns,
+        'rows': [
+            list(key) + [sums.get(column, 0) for column in value_columns]
+            for key, sums in merged.items()
+        ]
+    }
+
+
+def _numbers(column, name, offset):
+    numbers = []
+    for row, value in enumerate(column, start=offset + 2):
+        value = value.strip()
+        try:
+            number = float(value) if value else 0
+        except ValueError:
+            raise ValueError(f"Non-numeric value '{value}' in column {name}, row {row}")
+        numbers.append(int(number) if float(number).is_integer() else number)
+    return numbers
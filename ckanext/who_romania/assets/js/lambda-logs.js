@@ -0,0 +1,42 @@
+/* Appends lambda log records to the page as they are logged.
+ *
+ * url - the server-sent events endpoint streaming the logs, picking up
+ *       after the records already rendered on the page
+ */
+ckan.module('lambda-logs', function ($) {
+  // Lines logged by the lambda runtime rather than the function itself
+  var PLATFORM_LEVELS = ['INIT_START', 'START', 'END', 'REPORT'];
+
+  return {
+    options: {
+      url: null
+    },
+
+    initialize: function () {
+      if (!window.EventSource || !this.options.url) return;
+      this.source = new EventSource(this.options.url);
+      this.source.onopen = $.proxy(this._onOpen, this);
+      this.source.onmessage = $.proxy(this._onMessage, this);
+    },
+
+    teardown: function () {
+      if (this.source) this.source.close();
+    },
+
+    _onOpen: function () {
+      $('.logs-reload').hide();
+    },
+
+    _onMessage: function (message) {
+      var logs = this.el;
+      $.each(JSON.parse(message.data), function (i, record) {
+        if (!record.message || PLATFORM_LEVELS.indexOf(record.level) >= 0) return;
+        logs.append(
+          $('<p class="log"></p>')
+            .addClass((record.level || '').toLowerCase())
+            .text(record.message)
+        );
+      });
+    }
+  };
+});
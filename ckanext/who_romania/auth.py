@@ -1,13 +1,116 @@
+from collections import namedtuple
+
+from flask import g, has_request_context
+
+import ckan.model as model
 from ckan.plugins import toolkit
 
 
+# Organization roles, each granting everything the ones before it do
+ORGANIZATION_ROLES = ['member', 'editor', 'admin']
+
+LambdaInvokePolicy = namedtuple('LambdaInvokePolicy', ['users', 'org_roles', 'groups'])
+
+_lambda_invoke_policy = None
+
+
 def lambda_invoke(context, data_dict):
-    authorized_users = toolkit.config.get('ckanext.who_romania.lambda_invoke_users', " ")
-    authorized_users = authorized_users.split(" ")
-    if context['user'] in authorized_users:
+    if can_invoke_lambda(context['user']):
         return {'success': True}
     else:
         return {
             'success': False,
             'msg': 'You are not authorized to carry out this action'
         }
+
+
+def parse_lambda_invoke_policy(config):
+    """
+    Parses who may invoke lambda functions (other than sysadmins) from
+    ckanext.who_romania.lambda_invoke_users, lambda_invoke_org_roles and
+    lambda_invoke_groups.  Organization role rules are "organization:role",
+    with "*" matching any organization, and are expanded to the roles above
+    the given one, so that each rule is a single set lookup.
+    """
+    org_roles = set()
+    for rule in _split(config.get('ckanext.who_romania.lambda_invoke_org_roles')):
+        organization, _sep, role = rule.partition(':')
+        if role not in ORGANIZATION_ROLES:
+            raise ValueError(f"Invalid lambda_invoke_org_roles rule '{rule}'")
+        org_roles.update(
+            (organization, granting_role)
+            for granting_role in ORGANIZATION_ROLES[ORGANIZATION_ROLES.index(role):]
+        )
+    return LambdaInvokePolicy(
+        users=frozenset(_split(config.get('ckanext.who_romania.lambda_invoke_users'))),
+        org_roles=frozenset(org_roles),
+        groups=frozenset(_split(config.get('ckanext.who_romania.lambda_invoke_groups')))
+    )
+
+
+def configure_lambda_invoke_policy(config):
+    global _lambda_invoke_policy
+    _lambda_invoke_policy = parse_lambda_invoke_policy(config)
+
+
+def can_invoke_lambda(user_name):
+    """
+    Whether the policy allows a user to invoke lambda functions.  Decisions
+    are remembered for the rest of the request, so pages checking several
+    times pay for it once.
+    """
+    if not has_request_context():
+        return _can_invoke_lambda(user_name)
+    decisions = g.setdefault('who_romania_lambda_invoke', {})
+    if user_name not in decisions:
+        decisions[user_name] = _can_invoke_lambda(user_name)
+    return decisions[user_name]
+
+
+def _can_invoke_lambda(user_name):
+    policy = _lambda_invoke_policy or parse_lambda_invoke_policy(toolkit.config)
+    if not user_name:
+        return False
+    if user_name in policy.users:
+        return True
+    if not (policy.org_roles or policy.groups):
+        return False
+    memberships = model.Session.query(
+        model.Group.name, model.Group.is_organization, model.Member.capacity
+    ).join(
+        model.Member, model.Member.group_id == model.Group.id
+    ).join(
+        model.User, model.User.id == model.Member.table_id
+    ).filter(
+        model.User.name == user_name,
+        model.Member.table_name == 'user',
+        model.Member.state == 'active',
+        model.Group.state == 'active'
+    )
+    for group_name, is_organization, capacity in memberships:
+        if is_organization:
+            if (group_name, capacity) in policy.org_roles or ('*', capacity) in policy.org_roles:
+                return True
+        elif group_name in policy.groups:
+            return True
+    return False
+
+
+def catalogue_export(context, data_dict):
+    # Exports include private datasets, so only sysadmins may export
+    return {
+        'success': False,
+        'msg': 'Only system administrators may export the catalogue'
+    }
+
+
+def user_create_batch(context, data_dict):
+    # Batches may set ids, so only sysadmins may create users in bulk
+    return {
+        'success': False,
+        'msg': 'Only system administrators may create users in bulk'
+    }
+
+
+def _split(value):
+    return [item for item in (value or '').split() if item]
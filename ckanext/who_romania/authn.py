@@ -1,9 +1,20 @@
 import ckan.model as model
 from flask import current_app
+from sqlalchemy import event, inspect
+
+from ckanext.who_romania.cache import MISSING, TTLCache
+
+
+SUBSTITUTE_USER_CACHE_TTL = 60
+UNKNOWN_SUBSTITUTE_USER_CACHE_TTL = 10
+
+# The ids of substitute users by their id and name, or None for headers that
+# didn't identify a user
+_substitute_user_ids = TTLCache(ttl=SUBSTITUTE_USER_CACHE_TTL, maxsize=1024)
 
 
 def substitute_user(substitute_user_id):
-    substitute_user_obj = model.User.get(substitute_user_id)
+    substitute_user_obj = get_substitute_user(substitute_user_id)
 
     if not substitute_user_obj:
         return {
@@ -19,3 +30,39 @@ def substitute_user(substitute_user_id):
     # https://github.com/ckan/ckan/issues/7581
     current_app.login_manager._update_request_context_with_user(substitute_user_obj)
 
+
+def get_substitute_user(user_reference):
+    """
+    Returns the user with the given id or name.  The id a reference resolves
+    to is cached, so that automation sending every request on behalf of a
+    user doesn't search for them by name every time, until the user is
+    changed or SUBSTITUTE_USER_CACHE_TTL passes.  The user is still loaded
+    by id on every request, so their state and sysadmin rights are never
+    stale, even when changed by another process.  References to unknown
+    users are cached for UNKNOWN_SUBSTITUTE_USER_CACHE_TTL.
+    """
+    user_id = _substitute_user_ids.get(user_reference, MISSING)
+    if user_id is None:
+        return None
+    if user_id is not MISSING:
+        user = model.Session.query(model.User).get(user_id)
+        # Another process may have renamed or purged the user
+        if user is not None and user_reference in (user.id, user.name):
+            return user
+        _substitute_user_ids.pop(user_reference)
+    user = model.User.get(user_reference)
+    if user is None:
+        _substitute_user_ids.set(user_reference, None, ttl=UNKNOWN_SUBSTITUTE_USER_CACHE_TTL)
+        return None
+    _substitute_user_ids.set(user.id, user.id)
+    _substitute_user_ids.set(user.name, user.id)
+    return user
+
+
+@event.listens_for(model.User, 'after_insert')
+@event.listens_for(model.User, 'after_update')
+@event.listens_for(model.User, 'after_delete')
+def _invalidate_substitute_user(mapper, connection, user):
+    _substitute_user_ids.pop(user.id)
+    for name in [user.name] + list(inspect(user).attrs.name.history.deleted or []):
+        _substitute_user_ids.pop(name)
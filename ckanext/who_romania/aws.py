@@ -0,0 +1,282 @@
+import logging
+import re
+import threading
+
+from ckanext.who_romania.cache import TTLCache
+
+
+log = logging.getLogger(__name__)
+
+EXPIRED_CREDENTIALS_ERRORS = {
+    'ExpiredToken',
+    'ExpiredTokenException',
+    'RequestExpired',
+    'InvalidClientTokenId',
+    'UnrecognizedClientException',
+}
+
+LOG_STREAM_CACHE_TTL = 30
+INVOCATION_LOG_STREAM_CACHE_TTL = 5
+# Allows for clock differences between CKAN and AWS when searching the logs
+LOG_CLOCK_SKEW = 60 * 1000
+
+# Lines written by the Lambda runtime itself rather than the function
+PLATFORM_LOG_LEVELS = ('INIT_START', 'START', 'END', 'REPORT')
+_platform_log_line = re.compile(
+    r'^(INIT_START|START|END|REPORT) (?:RequestId: (\S+))?\s*(.*)$',
+    re.DOTALL
+)
+
+_clients = {}
+_clients_lock = threading.Lock()
+_log_streams = TTLCache(ttl=LOG_STREAM_CACHE_TTL, maxsize=256)
+_invocation_log_streams = TTLCache(ttl=INVOCATION_LOG_STREAM_CACHE_TTL, maxsize=256)
+
+
+def get_client(service_name):
+    """
+    Returns a boto3 client for the given service, shared by every thread in
+    the process.
+
+    boto3 is imported on first use so that workers which never talk to AWS
+    don't pay for loading the SDK.  Clients are thread safe, but creating
+    them from the shared default session is not, hence the lock.
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(service_name)
+            if client is None:
+                import boto3
+                client = boto3.session.Session().client(service_name)
+                _clients[service_name] = client
+    return client
+
+
+def reset_client(service_name=None):
+    """
+    Drops the cached client for the given service (or all services), so that
+    the next call creates a new one with freshly resolved credentials.
+    """
+    with _clients_lock:
+        if service_name is None:
+            _clients.clear()
+        else:
+            _clients.pop(service_name, None)
+
+
+def call(service_name, operation, **kwargs):
+    """
+    Calls an operation on the cached client for a service, e.g.
+    call('lambda', 'invoke', FunctionName=...).
+
+    Refreshable credentials (instance roles, SSO etc.) are renewed by botocore
+    itself.  If the credentials the client was created with have expired
+    regardless, the client is discarded and the call retried once.
+    """
+    try:
+        return getattr(get_client(service_name), operation)(**kwargs)
+    except Exception as e:
+        if _error_code(e) not in EXPIRED_CREDENTIALS_ERRORS:
+            raise
+        log.info(f"AWS credentials for {service_name} expired, recreating client")
+        reset_client(service_name)
+        return getattr(get_client(service_name), operation)(**kwargs)
+
+
+def _error_code(exception):
+    response = getattr(exception, 'response', None) or {}
+    return response.get('Error', {}).get('Code')
+
+
+def latest_log_stream(log_group):
+    """
+    Returns the name of the log stream in the log group with the most recent
+    event.  Lookups are cached briefly so that repeatedly viewing the logs
+    doesn't repeatedly scan the log group.
+    """
+    log_stream_name = _log_streams.get(log_group)
+    if log_stream_name is None:
+        log_streams = call(
+            'logs',
+            'describe_log_streams',
+            logGroupName=log_group,
+            orderBy='LastEventTime',
+            limit=1,
+            descending=True
+        )['logStreams']
+        if not log_streams:
+            raise LookupError(f"No log streams found in {log_group}")
+        log_stream_name = log_streams[0]['logStreamName']
+        _log_streams.set(log_group, log_stream_name)
+    return log_stream_name
+
+
+def invocation_log_stream(log_group, request_id, start_time=None):
+    """
+    Returns the name of the log stream an invocation logged to, found by
+    searching the log group for the invocation's request id, or None if the
+    invocation hasn't logged anything yet.  Searches that find nothing are
+    cached for a few seconds, so watchers waiting for an invocation to start
+    don't each search the log group.
+    """
+    if (log_group, request_id) in _invocation_log_streams:
+        return None
+    kwargs = {
+        'logGroupName': log_group,
+        'filterPattern': f'"{request_id}"',
+        'limit': 1
+    }
+    if start_time is not None:
+        kwargs['startTime'] = start_time
+    while True:
+        page = call('logs', 'filter_log_events', **kwargs)
+        if page['events']:
+            return page['events'][0]['logStreamName']
+        if not page.get('nextToken'):
+            _invocation_log_streams.set((log_group, request_id), None)
+            return None
+        kwargs['nextToken'] = page['nextToken']
+
+
+def log_events(log_group, log_stream_name, next_token=None, start_time=None,
+               end_time=None):
+    """
+    Pages through a log stream from the given forward token (or from the
+    start of the stream) until no more events are available.  Start and end
+    times, in milliseconds since the epoch, restrict the events fetched.
+
+    Returns a tuple of the events and the forward token to pass in next time
+    to fetch only the events logged since.
+    """
+    kwargs = {
+        'logGroupName': log_group,
+        'logStreamName': log_stream_name,
+        'startFromHead': True
+    }
+    if next_token:
+        kwargs['nextToken'] = next_token
+    if start_time is not None:
+        kwargs['startTime'] = start_time
+    if end_time is not None:
+        kwargs['endTime'] = end_time
+    events = []
+    while True:
+        page = call('logs', 'get_log_events', **kwargs)
+        events.extend(page['events'])
+        next_token = page['nextForwardToken']
+        # The same token is returned once the end of the stream is reached
+        if not page['events'] or next_token == kwargs.get('nextToken'):
+            return events, next_token
+        kwargs['nextToken'] = next_token
+
+
+def latest_log_events(log_group, log_stream_name, enough, start_time=None,
+                      end_time=None):
+    """
+    Pages backwards from the end of a log stream (or from end_time) until
+    enough(events) returns True for the events read so far, oldest first,
+    or the start of the stream is reached, so that callers after the most
+    recent events don't download the whole stream.
+
+    Returns a tuple of the events, oldest first, and the forward token to
+    pass to log_events() to fetch the events logged since.
+    """
+    kwargs = {
+        'logGroupName': log_group,
+        'logStreamName': log_stream_name,
+        'startFromHead': False
+    }
+    if start_time is not None:
+        kwargs['startTime'] = start_time
+    if end_time is not None:
+        kwargs['endTime'] = end_time
+    pages = []
+    forward_token = None
+    while True:
+        page = call('logs', 'get_log_events', **kwargs)
+        if forward_token is None:
+            forward_token = page['nextForwardToken']
+        pages.append(page['events'])
+        events = [event for events in reversed(pages) for event in events]
+        backward_token = page['nextBackwardToken']
+        # The same token is returned once the start of the stream is reached
+        if not page['events'] or backward_token == kwargs.get('nextToken') or enough(events):
+            return events, forward_token
+        kwargs['nextToken'] = backward_token
+
+
+def parse_log_event(event):
+    """
+    Parses a lambda log event into a record with the log level, the event
+    timestamp (milliseconds since the epoch), the invocation's request id and
+    the logged message.
+
+    Python lambdas log lines like "[INFO]\t<time>\t<request id>\t<message>".
+    Lines written by the runtime itself ("START RequestId: ...") are given
+    the platform line type as their level.  Anything else, e.g. printed
+    output, has no level or request id.
+    """
+    message = event.get('message', '')
+    record = {
+        'level': None,
+        'timestamp': event.get('timestamp'),
+        'request_id': None,
+        'message': message.strip()
+    }
+    parts = message.split('\t', 3)
+    if len(parts) == 4 and parts[0].startswith('[') and parts[0].endswith(']'):
+        record.update({
+            'level': parts[0][1:-1].upper(),
+            'request_id': parts[2],
+            'message': parts[3].strip()
+        })
+    else:
+        match = _platform_log_line.match(message)
+        if match:
+            level, request_id, text = match.groups()
+            record.update({
+                'level': level,
+                'request_id': request_id,
+                'message': text.strip()
+            })
+    return record
+
+
+def attribute_log_records(records, request_id=None):
+    """
+    Fills in the request id of records logged without one, e.g. printed
+    output, from the invocation running at the time.  A log stream only runs
+    one invocation at a time, between its START and REPORT lines.
+
+    Returns the request id of the invocation still running after the last
+    record, to pass in when attributing the records that follow.
+    """
+    for record in records:
+        if record['level'] == 'START':
+            request_id = record['request_id']
+        elif record['request_id'] is None:
+            record['request_id'] = request_id
+        if record['level'] == 'REPORT':
+            request_id = None
+    return request_id
+
+
+def filter_log_records(records, levels=None, start_time=None, end_time=None,
+                       limit=None, request_id=None):
+    """
+    Filters parsed log records by level, timestamp and request id, keeping
+    only the most recent records if a limit is given.
+    """
+    if request_id:
+        records = [r for r in records if r['request_id'] == request_id]
+    if levels:
+        levels = {level.upper() for level in levels}
+        records = [r for r in records if r['level'] in levels]
+    if start_time is not None:
+        records = [r for r in records if r['timestamp'] >= start_time]
+    if end_time is not None:
+        records = [r for r in records if r['timestamp'] <= end_time]
+    if limit is not None:
+        records = records[-limit:] if limit else []
+    return records
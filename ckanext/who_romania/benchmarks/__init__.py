@@ -0,0 +1,12 @@
+"""
+Microbenchmarks for the extension's validators, helpers and actions.
+
+Run them with::
+
+    python -m ckanext.who_romania.benchmarks [--save] [--filter NAME]
+
+Each benchmark is timed over several repeats and its peak memory traced,
+then compared with the stored baseline.  Benchmarks slower than the
+baseline by more than the tolerance are reported as regressions, and the
+command exits with status 1.
+"""
@@ -0,0 +1,6 @@
+import sys
+
+from ckanext.who_romania.benchmarks.runner import main
+
+
+sys.exit(main())
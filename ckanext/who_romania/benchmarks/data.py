@@ -0,0 +1,56 @@
+"""Synthetic data for the benchmarks, generated deterministically."""
+import random
+import uuid
+
+TAGS = [f'tag-{i}' for i in range(500)]
+DOCTORS = [f'Doctor {i}, Family Practice' for i in range(200)]
+
+
+def make_datasets(count=2000, resources=100, tags=10, seed=0):
+    """Returns a list of dataset dicts as returned by package_search"""
+    rng = random.Random(seed)
+    return [make_dataset(rng, resources, tags) for _i in range(count)]
+
+
+def make_dataset(rng, resources=100, tags=10):
+    dataset_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    return {
+        'id': dataset_id,
+        'name': f'family-medicine-{dataset_id[:8]}',
+        'title': f'Family Medicine {dataset_id[:8]}',
+        'type': 'family-medicine',
+        'tags': [{'name': name} for name in rng.sample(TAGS, tags)],
+        'resources': [
+            {
+                'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'package_id': dataset_id,
+                'family_doctor': rng.choice(DOCTORS),
+                'week': f'2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                'format': 'CSV',
+            }
+            for _j in range(resources)
+        ],
+    }
+
+
+def make_search_facets(facet='tags', items=5000, seed=0):
+    """Returns search facets as found in ``search_facets`` on search pages"""
+    rng = random.Random(seed)
+    return {
+        facet: {
+            'title': facet,
+            'items': [
+                {
+                    'name': f'{facet}-{i}',
+                    'display_name': f'{facet.title()} {i}',
+                    'count': rng.randint(1, 1000),
+                }
+                for i in range(items)
+            ],
+        }
+    }
+
+
+def make_tag_replacements(count=100):
+    """Returns a dataset_tag_replace ``tags`` dict renaming some of TAGS"""
+    return {name: f'{name}-renamed' for name in TAGS[:count]}
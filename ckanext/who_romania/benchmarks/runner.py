@@ -0,0 +1,134 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+import tracemalloc
+from collections import OrderedDict
+
+
+DEFAULT_BASELINE = os.path.join('.benchmarks', 'baseline.json')
+DEFAULT_TOLERANCE = 0.25
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(func):
+    """
+    Registers a benchmark.  Benchmarks are generator functions which set up
+    their data, yield the callable to time, and tear down once it is timed.
+    """
+    BENCHMARKS[func.__name__] = contextlib.contextmanager(func)
+    return func
+
+
+def measure(setup, repeat=7):
+    """
+    Times a benchmark, calling it enough times per repeat for each repeat
+    to take at least 0.2 seconds, and traces its peak memory use over one
+    call.  The fastest repeat is the most stable estimate of its cost, as
+    slower ones are slowed down by whatever else the machine was doing.
+    """
+    with setup() as target:
+        timer = timeit.Timer(target)
+        number, _time_taken = timer.autorange()
+        times = [elapsed / number for elapsed in timer.repeat(repeat=repeat, number=number)]
+        tracemalloc.start()
+        try:
+            target()
+            _size, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'loops': number,
+        'peak_memory': peak_memory,
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns (name, measure, ratio) for each result slower, or using more
+    memory, than its baseline by more than the tolerance.  Results without
+    a baseline are never regressions.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for key in ('min', 'peak_memory'):
+            if previous.get(key) and result[key] / previous[key] > 1 + tolerance:
+                regressions.append((name, key, result[key] / previous[key]))
+    return regressions
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline_file:
+        return json.load(baseline_file)['results']
+
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as baseline_file:
+        json.dump({
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results,
+        }, baseline_file, indent=2, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ckanext.who_romania.benchmarks',
+        description="Runs the who_romania microbenchmarks and compares them with a baseline"
+    )
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help=f"Baseline file (default {DEFAULT_BASELINE})")
+    parser.add_argument('--save', action='store_true',
+                        help="Store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slow down before flagging a regression, as a fraction")
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--filter', default='', help="Only run benchmarks with names containing this")
+    args = parser.parse_args(argv)
+
+    # Registers the benchmarks
+    import ckanext.who_romania.benchmarks.suite  # noqa: F401
+
+    baseline = load_baseline(args.baseline)
+    results = OrderedDict()
+    print(f"{'benchmark':<40} {'min':>12} {'median':>12} {'stdev':>10} {'peak memory':>12} {'baseline':>10}")
+    for name, setup in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        try:
+            result = measure(setup, repeat=args.repeat)
+        except ImportError as e:
+            print(f"{name:<40} skipped: {e}")
+            continue
+        results[name] = result
+        previous = baseline.get(name, {}).get('min')
+        print("{:<40} {:>10.2f}us {:>10.2f}us {:>9.1f}% {:>10.1f}KB {:>10}".format(
+            name,
+            result['min'] * 1e6,
+            result['median'] * 1e6,
+            100 * result['stdev'] / result['median'] if result['median'] else 0,
+            result['peak_memory'] / 1024,
+            f"{result['min'] / previous:.2f}x" if previous else '-'
+        ))
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, key, ratio in regressions:
+        print(f"REGRESSION {name}: {key} is {ratio:.2f}x the baseline", file=sys.stderr)
+    if args.save:
+        save_baseline(args.baseline, dict(baseline, **results))
+        print(f"Saved baseline to {args.baseline}")
+    return 1 if regressions and not args.save else 0
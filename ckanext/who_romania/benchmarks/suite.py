@@ -0,0 +1,111 @@
+from unittest import mock
+
+import flask
+
+from ckanext.who_romania.benchmarks import data
+from ckanext.who_romania.benchmarks.runner import benchmark
+
+
+@benchmark
+def autogenerate_name_from_title():
+    import ckanext.who_romania.validators as validators
+
+    attempts = []
+
+    def package_name_validator(key, data_dict, errors, context):
+        # The first few names tried are taken
+        attempts.append(data_dict[key])
+        if len(attempts) % 4:
+            errors[key].append('That URL is already in use.')
+
+    validator = validators.autogenerate_name_from_title({}, {})
+    key = ('name',)
+    record = {key: '', ('title',): 'Family Medicine Report, Cluj-Napoca – Săptămâna 12'}
+    errors = {key: [], ('title',): []}
+
+    def run():
+        record[key] = ''
+        validator(key, record, errors, {})
+
+    with mock.patch.object(validators, 'package_name_validator', package_name_validator):
+        yield run
+
+
+@benchmark
+def autogenerate_resource_names():
+    import ckanext.who_romania.validators as validators
+
+    validator = validators.autogenerate({
+        'template': '{}-{}',
+        'template_args': ['family_doctor', 'week'],
+        'template_formatters': ['comma_swap', 'slugify'],
+    }, {})
+    dataset = data.make_datasets(count=1, resources=100)[0]
+    flattened = {}
+    for i, resource in enumerate(dataset['resources']):
+        for field, value in resource.items():
+            flattened[('resources', i, field)] = value
+
+    def run():
+        for i in range(len(dataset['resources'])):
+            validator(('resources', i, 'name'), flattened, {}, {})
+
+    yield run
+
+
+@benchmark
+def get_facet_items_dict():
+    from ckanext.who_romania.helpers import get_facet_items_dict
+
+    search_facets = data.make_search_facets('tags', items=5000)
+    app = flask.Flask(__name__)
+    with app.test_request_context('/dataset/?tags=tags-1&tags=tags-2&q=report'):
+        yield lambda: get_facet_items_dict('tags', search_facets)
+
+
+@benchmark
+def get_week_options():
+    from ckanext.who_romania.helpers import get_week_options
+
+    months = [f'{year}-{month:02d}' for year in range(2014, 2024) for month in range(1, 13)]
+
+    def run():
+        for month in months:
+            get_week_options(month)
+
+    yield run
+
+
+@benchmark
+def prepare_final_tag_list():
+    from ckanext.who_romania.actions import _prepare_final_tag_list
+
+    datasets = data.make_datasets(count=2000, resources=0, tags=20)
+    replacements = data.make_tag_replacements(100)
+
+    def run():
+        for dataset in datasets:
+            _prepare_final_tag_list(dataset['tags'], replacements)
+
+    yield run
+
+
+@benchmark
+def dataset_tag_replace():
+    import ckanext.who_romania.actions as actions
+
+    datasets = data.make_datasets(count=2000, resources=100, tags=20)
+    replacements = data.make_tag_replacements(100)
+    # The search and patches are CKAN's, only the extension's work is timed
+    search = {'count': len(datasets), 'results': datasets}
+    get_action = {
+        'package_search': lambda context, data_dict: search,
+        'package_patch': lambda context, data_dict: data_dict,
+    }.get
+
+    def run():
+        actions.dataset_tag_replace({'user': 'benchmark'}, {'tags': dict(replacements)})
+
+    with mock.patch.object(actions.toolkit, 'get_action', get_action), \
+            mock.patch.object(actions.toolkit, 'check_access', lambda *args: True):
+        yield run
@@ -1,49 +1,202 @@
+import hmac
+import json
 import logging
-from flask import Blueprint, request
+import time
+from flask import Blueprint, Response, request, stream_with_context
 from ckan.plugins import toolkit
 from datetime import datetime
+import ckanext.who_romania.aws as aws
+import ckanext.who_romania.executors as executors
+import ckanext.who_romania.export as export
+import ckanext.who_romania.log_tail as log_tail
+import ckanext.who_romania.metrics as metrics
+import ckanext.who_romania.validation as validation
 
 log = logging.getLogger(__name__)
+
+# Streams are closed after a short while to free up the worker, browsers
+# reconnect automatically and pick up from the last record they received.
+STREAM_DURATION = 30
+KEEP_ALIVE_INTERVAL = 10
+# Milliseconds browsers wait before reconnecting, and before trying again
+# when all of the process's stream slots are taken
+STREAM_RETRY = 1000
+BUSY_STREAM_RETRY = 10000
+
 lambda_blueprint = Blueprint(
     'lambda',
     __name__,
     url_prefix="/lambda/"
 )
 
+metrics_blueprint = Blueprint('who_romania_metrics', __name__)
+
+catalogue_blueprint = Blueprint(
+    'catalogue',
+    __name__,
+    url_prefix="/catalogue/"
+)
+
 
 def view_logs(lambda_function, logs=None):
     try:
         toolkit.check_access('lambda_invoke', {})
     except toolkit.NotAuthorized:
         toolkit.abort(403, toolkit._('Not authorized to perform this action'))
+    invocation_id = request.args.get('invocation_id')
+    invocation = None
+    log_stream_name = None
     if logs is None:
+        if invocation_id:
+            data_dict = {'invocation_id': invocation_id}
+        else:
+            data_dict = {'lambda_function': lambda_function}
         try:
-            logs = toolkit.get_action('lambda_logs')({}, {
-                'lambda_function': lambda_function
-            })['events']
+            response = toolkit.get_action('lambda_logs')({}, data_dict)
+            logs = response['records']
+            log_stream_name = response['log_stream_name']
+            invocation = response.get('invocation')
         except Exception as e:
             logs = [
-                {'message': f"[ERROR]\t{datetime.now()}\twrc\tERROR Failed to get logs"},
-                {'message': f"[ERROR]\t{datetime.now()}\twrc\t{type(e).__name__}: {e}"}
+                _log_record('ERROR', "ERROR Failed to get logs"),
+                _log_record('ERROR', f"{type(e).__name__}: {e}")
             ]
+    stream_url = None
+    if invocation:
+        # The invocation's records are a subset of its log stream, so the
+        # stream starts from the beginning and skips those already shown
+        stream_url = toolkit.url_for(
+            'lambda.stream_logs',
+            lambda_function=lambda_function,
+            invocation_id=invocation['id'],
+            skip=len(logs)
+        )
+    elif log_stream_name:
+        stream_url = toolkit.url_for(
+            'lambda.stream_logs',
+            lambda_function=lambda_function,
+            log_stream_name=log_stream_name,
+            position=len(logs)
+        )
     if logs == []:
         logs = [
-            {'message': f"[INFO]\t{datetime.now()}\twrc\tNothing logged yet, please "
-                        "wait a moment and then reload the page"},
+            _log_record('INFO', "Nothing logged yet, new logs will appear below "
+                                "as they arrive"),
         ]
     extra_vars = {
         "logs": logs,
-        "lambda_function": lambda_function
+        "lambda_function": lambda_function,
+        "invocation": invocation,
+        "stream_url": stream_url,
+        "platform_levels": aws.PLATFORM_LOG_LEVELS
     }
     return toolkit.render(
         'who_romania/lambda_logs.html', extra_vars
     )
 
 
+def _log_record(level, message):
+    return {
+        'level': level,
+        'timestamp': int(datetime.now().timestamp() * 1000),
+        'request_id': 'wrc',
+        'message': message
+    }
+
+
+def stream_logs(lambda_function):
+    """
+    Streams new log records as server-sent events.  Each message holds a JSON
+    list of records and its id is the position in the log stream to resume
+    from, which the browser sends back as Last-Event-ID when it reconnects.
+
+    Given an invocation_id, only that invocation's records are sent, waiting
+    for the invocation to start logging if need be.
+
+    Streams end after STREAM_DURATION seconds and each process serves at
+    most lambda_log_max_streams at once, so watchers don't tie up the web
+    workers; browsers over the limit are told to reconnect later.
+    """
+    try:
+        toolkit.check_access('lambda_invoke', {})
+    except toolkit.NotAuthorized:
+        toolkit.abort(403, toolkit._('Not authorized to perform this action'))
+    invocation_id = request.args.get('invocation_id')
+    log_stream_name = request.args.get('log_stream_name')
+    local = False
+    if invocation_id:
+        try:
+            invocation = toolkit.get_action('lambda_invocation_show')({}, {'id': invocation_id})
+        except toolkit.ObjectNotFound:
+            toolkit.abort(404, toolkit._('Lambda invocation not found'))
+        lambda_function = invocation['lambda_function']
+        log_stream_name = invocation['log_stream_name']
+        local = invocation['executor'] != executors.AWSLambdaExecutor.name
+    elif not log_stream_name:
+        try:
+            log_stream_name = aws.latest_log_stream(f'/aws/lambda/{lambda_function}')
+        except Exception as e:
+            log.warning(f"Failed to find log stream for {lambda_function}: {e}")
+            toolkit.abort(404, toolkit._('Lambda logs could not be found'))
+    try:
+        if 'Last-Event-ID' in request.headers:
+            position, skip = int(request.headers['Last-Event-ID']), 0
+        else:
+            position = int(request.args.get('position', 0))
+            skip = int(request.args.get('skip', 0))
+    except ValueError:
+        toolkit.abort(400, toolkit._('Invalid log position'))
+
+    max_streams = toolkit.asint(toolkit.config.get('ckanext.who_romania.lambda_log_max_streams'))
+
+    def event_stream(log_stream_name, position, skip):
+        if not log_tail.start_stream(max_streams):
+            yield f"retry: {BUSY_STREAM_RETRY}\n\n"
+            return
+        try:
+            yield f"retry: {STREAM_RETRY}\n\n"
+            yield from _log_events(log_stream_name, position, skip)
+        finally:
+            log_tail.end_stream()
+
+    def _log_events(log_stream_name, position, skip):
+        end = time.monotonic() + STREAM_DURATION
+        while not (local or log_stream_name) and time.monotonic() < end:
+            time.sleep(log_tail.POLL_INTERVAL)
+            yield ": waiting\n\n"
+            log_stream_name = toolkit.get_action('lambda_invocation_show')(
+                {}, {'id': invocation_id}
+            )['log_stream_name']
+        if local:
+            tail = log_tail.subscribe_local(invocation_id)
+        elif log_stream_name:
+            tail = log_tail.subscribe(lambda_function, log_stream_name)
+        else:
+            return
+        try:
+            while time.monotonic() < end:
+                records, position = tail.wait_for_records(position, KEEP_ALIVE_INTERVAL)
+                if invocation_id:
+                    records = aws.filter_log_records(records, request_id=invocation_id)
+                    records, skip = records[skip:], max(skip - len(records), 0)
+                if records:
+                    yield f"id: {position}\ndata: {json.dumps(records)}\n\n"
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            tail.unsubscribe()
+
+    return Response(
+        stream_with_context(event_stream(log_stream_name, position, skip)),
+        mimetype='text/event-stream',
+        headers={'X-Accel-Buffering': 'no'}
+    )
+
+
 def family_medicine(dataset_id):
     try:
-        toolkit.check_access('package_update', {}, {'id': dataset_id})
         toolkit.check_access('lambda_invoke', {})
+        toolkit.check_access('package_update', {}, {'id': dataset_id})
     except toolkit.NotAuthorized:
         toolkit.abort(403, toolkit._('Not authorized to perform this action'))
 
@@ -51,7 +204,17 @@ def family_medicine(dataset_id):
         'ckanext.who_romania.lambda_family_medicine_function',
         ''
     )
+    invocation = {}
     if request.method == 'POST':
+        dataset = toolkit.get_action('package_show')({}, {'id': dataset_id})
+        failed = validation.failed_reports(dataset)
+        if failed:
+            toolkit.h.flash_error(toolkit._(
+                "Some weekly reports failed validation against the reporting "
+                "template, please correct and re-upload them before running the "
+                "aggregation script: {reports}"
+            ).format(reports=", ".join(resource['name'] for resource in failed)))
+            return toolkit.redirect_to(f"{dataset['type']}.read", id=dataset['name'])
         reporting_template = toolkit.config.get(
             'ckanext.who_romania.lambda_family_medicine_template',
             ''
@@ -62,11 +225,17 @@ def family_medicine(dataset_id):
             'reporting_template': reporting_template
         }
         try:
-            toolkit.get_action('lambda_invoke')({}, data_dict)
-            toolkit.h.flash_success(toolkit._(
-                "Sucessfully triggered aggregation script. The script will take no "
-                "more than 5 minutes to complete.  Follow the logs below..."
-            ))
+            invocation = toolkit.get_action('lambda_invoke')({}, data_dict)
+            if invocation['coalesced']:
+                toolkit.h.flash_notice(toolkit._(
+                    "The aggregation script is already running for this dataset. "
+                    "Follow its logs below..."
+                ))
+            else:
+                toolkit.h.flash_success(toolkit._(
+                    "Sucessfully triggered aggregation script. The script will take no "
+                    "more than 5 minutes to complete.  Follow the logs below..."
+                ))
         except Exception as e:
             toolkit.h.flash_error(toolkit._(
                 "Failed to trigger aggregation script. Please try again and if the "
@@ -76,17 +245,82 @@ def family_medicine(dataset_id):
     return toolkit.redirect_to(
         'lambda.view_logs',
         lambda_function=lambda_function,
+        invocation_id=invocation.get('id'),
         logs=[]
     )
 
 
+def metrics_view():
+    """
+    Exposes the extension's metrics in the Prometheus text format, if
+    ckanext.who_romania.metrics is enabled.  If a metrics token is
+    configured, scrapers must send it as a bearer token, otherwise only
+    sysadmins may see the metrics.
+    """
+    if not metrics.enabled():
+        toolkit.abort(404)
+    token = toolkit.config.get('ckanext.who_romania.metrics_token')
+    if token:
+        authorized = hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Bearer {token}'
+        )
+    else:
+        authorized = getattr(toolkit.current_user, 'sysadmin', False)
+    if not authorized:
+        toolkit.abort(403, toolkit._('Not authorized to see this page'))
+    return Response(
+        metrics.exposition(),
+        mimetype='text/plain',
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+
+
+def export_catalogue():
+    """
+    Streams the catalogue's metadata as JSON lines or CSV, as it is read
+    from the database.  Filtered by the type, organization and
+    modified_since (ISO 8601) query parameters.
+    """
+    try:
+        toolkit.check_access('catalogue_export', {})
+    except toolkit.NotAuthorized:
+        toolkit.abort(403, toolkit._('Not authorized to perform this action'))
+    export_format = request.args.get('format', 'jsonl')
+    modified_since = request.args.get('modified_since')
+    try:
+        if modified_since:
+            modified_since = datetime.fromisoformat(modified_since)
+        lines = export.export_lines(
+            export_format,
+            dataset_type=request.args.get('type'),
+            organization=request.args.get('organization'),
+            modified_since=modified_since
+        )
+    except ValueError as e:
+        toolkit.abort(400, str(e))
+    return Response(
+        stream_with_context(lines),
+        mimetype='application/x-ndjson' if export_format == 'jsonl' else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename=catalogue.{export_format}'}
+    )
+
+
 lambda_blueprint.add_url_rule(
     '/logs/<lambda_function>',
     view_func=view_logs
 )
 
+lambda_blueprint.add_url_rule(
+    '/logs/<lambda_function>/stream',
+    view_func=stream_logs
+)
+
 lambda_blueprint.add_url_rule(
     '/family-medicine/<dataset_id>',
     view_func=family_medicine,
     methods=['POST', 'GET']
 )
+
+metrics_blueprint.add_url_rule('/metrics', view_func=metrics_view)
+
+catalogue_blueprint.add_url_rule('/export', view_func=export_catalogue)
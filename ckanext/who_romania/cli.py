@@ -0,0 +1,83 @@
+import click
+
+import ckan.plugins.toolkit as toolkit
+import ckanext.who_romania.export as who_romania_export
+import ckanext.who_romania.importer as who_romania_importer
+import ckanext.who_romania.static as who_romania_static
+
+
+@click.group(short_help="WHO Romania commands")
+def who_romania():
+    pass
+
+
+@who_romania.command(short_help="Write compressed copies of the static assets")
+def compress_assets():
+    """
+    Writes brotli and gzip compressed copies of the extension's static files
+    and the webassets bundles, for the middleware to serve.  Run after
+    `ckan asset build` and before (re)starting CKAN.
+    """
+    for url_prefix, directory in who_romania_static.static_directories():
+        written = who_romania_static.compress_directory(directory)
+        click.echo(f"Wrote {written} compressed files for {url_prefix} in {directory}")
+
+
+@who_romania.command(short_help="Import a directory of weekly family medicine reports")
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--organization', required=True, help="Organization to import into")
+@click.option('--user', help="User to import as, the site user by default")
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help="File recording progress, to resume an interrupted import from")
+@click.option('--pattern', default=who_romania_importer.DEFAULT_PATTERN, show_default=True,
+              help="Regular expression reading the family_doctor and week from file paths")
+@click.option('--workers', default=who_romania_importer.DEFAULT_WORKERS, show_default=True,
+              help="Number of concurrent uploads")
+@click.option('--batch-size', default=who_romania_importer.DEFAULT_BATCH_SIZE, show_default=True,
+              help="Number of reports added to a dataset at a time")
+@click.pass_context
+def import_family_medicine(ctx, directory, organization, user, checkpoint, pattern, workers, batch_size):
+    """
+    Imports the CSV and XLSX weekly reports in DIRECTORY into the
+    organization's family medicine datasets, one per month, reading each
+    report's family doctor and week ending from its path.
+    """
+    with ctx.meta['flask_app'].test_request_context():
+        if not user:
+            user = toolkit.get_action('get_site_user')({'ignore_auth': True}, {})['name']
+        try:
+            imported = who_romania_importer.import_reports(
+                {'user': user},
+                directory,
+                organization,
+                checkpoint_path=checkpoint,
+                pattern=pattern,
+                workers=workers,
+                batch_size=batch_size
+            )
+        except (toolkit.ValidationError, toolkit.ObjectNotFound, toolkit.NotAuthorized) as e:
+            raise click.ClickException(str(e))
+    click.echo(f"Imported {imported} reports")
+
+
+@who_romania.command(short_help="Export the catalogue's metadata")
+@click.option('--format', 'export_format', type=click.Choice(who_romania_export.FORMATS),
+              default='jsonl', show_default=True)
+@click.option('--type', 'dataset_type', help="Only export datasets of this type")
+@click.option('--organization', help="Only export the organization's datasets")
+@click.option('--modified-since', type=click.DateTime(),
+              help="Only export datasets modified since this date")
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+              help="File to write to, standard output by default")
+def export_catalogue(export_format, dataset_type, organization, modified_since, output):
+    """
+    Exports the metadata of the catalogue's datasets and their resources,
+    streaming it from the database as it is written.
+    """
+    for line in who_romania_export.export_lines(
+        export_format,
+        dataset_type=dataset_type,
+        organization=organization,
+        modified_since=modified_since
+    ):
+        output.write(line)
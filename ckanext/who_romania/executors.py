@@ -0,0 +1,428 @@
+import atexit
+import contextlib
+import datetime
+import functools
+import importlib
+import io
+import json
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+import ckanext.who_romania.aws as aws
+from ckanext.who_romania.model import LambdaInvocation, LambdaLogRecord
+
+
+log = logging.getLogger(__name__)
+
+# Local handlers log to this logger, or loggers below it, for their lines to
+# be stored with the invocation, as on AWS where the root logger is the
+# function's own
+HANDLER_LOGGER = 'ckanext.who_romania.lambda'
+
+LOG_FLUSH_INTERVAL = 1
+# Seconds between polls of an AWS invocation's logs, and the extra time
+# given for its report to reach CloudWatch
+TRACK_INTERVAL = 5
+TRACK_GRACE_PERIOD = 60
+
+
+class AWSLambdaExecutor(object):
+    """
+    Invokes the function on AWS Lambda, following the invocation's logs
+    from a background job to record how it ends.
+    """
+    name = 'aws'
+    local = False
+
+    def invoke(self, lambda_function, payload, request_id=None):
+        response = aws.call(
+            'lambda',
+            'invoke',
+            FunctionName=lambda_function,
+            InvocationType='Event',
+            LogType='None',
+            ClientContext='string',
+            Payload=json.dumps(payload)
+        )
+        return response['ResponseMetadata']['RequestId']
+
+    def track(self, invocation_id):
+        # Tracking jobs wait on the invocation for up to its timeout, so they
+        # have a queue of their own rather than holding up upload processing
+        timeout = toolkit.config.get('ckanext.who_romania.lambda_timeout')
+        toolkit.enqueue_job(
+            track_invocation,
+            [invocation_id],
+            title=f"Track lambda invocation {invocation_id}",
+            queue=toolkit.config.get('ckanext.who_romania.lambda_track_queue'),
+            rq_kwargs={'job_timeout': timeout + TRACK_GRACE_PERIOD}
+        )
+
+
+class JobQueueExecutor(object):
+    """Runs the function's local handler on the CKAN background job queue"""
+    name = 'jobs'
+    local = True
+
+    def invoke(self, lambda_function, payload, request_id):
+        local_handler(lambda_function)
+        toolkit.enqueue_job(
+            run_local_invocation,
+            [lambda_function, payload, request_id],
+            title=f"{lambda_function} {request_id}",
+            rq_kwargs={'job_timeout': toolkit.config.get(
+                'ckanext.who_romania.lambda_local_timeout'
+            )}
+        )
+        return request_id
+
+
+class LocalProcessExecutor(object):
+    """
+    Runs the function's local handler in a pool of local processes, which
+    interrupt it once lambda_local_timeout has passed.  Runs that crash,
+    or are cut short by the web worker exiting, are marked failed.
+    """
+    name = 'process'
+    local = True
+
+    _pool = None
+    _pool_lock = threading.Lock()
+    _running = set()
+
+    def invoke(self, lambda_function, payload, request_id):
+        local_handler(lambda_function)
+        future = self._get_pool().submit(run_local_invocation_with_timeout, lambda_function, payload, request_id)
+        with self._pool_lock:
+            self._running.add(request_id)
+        future.add_done_callback(functools.partial(self._finished, request_id))
+        return request_id
+
+    @classmethod
+    def _finished(cls, request_id, future):
+        with cls._pool_lock:
+            cls._running.discard(request_id)
+        exception = None if future.cancelled() else future.exception()
+        if future.cancelled() or exception:
+            # Failures of the handler itself are caught and recorded by the
+            # run, these are failures to run it at all, e.g. a crashed process
+            log.error(f"Local invocation {request_id} failed to run: {exception!r}")
+            _fail_unfinished([request_id])
+
+    @classmethod
+    def _get_pool(cls):
+        with cls._pool_lock:
+            if cls._pool is None or getattr(cls._pool, '_broken', False):
+                if cls._pool is None:
+                    atexit.register(cls._shutdown)
+                    # Runs left unfinished by an earlier web worker that was
+                    # killed outright are over by now, if they're past the timeout
+                    _fail_expired_local_invocations()
+                # Workers are spawned rather than forked from a web worker,
+                # so they set up their own CKAN environment and DB engine.
+                cls._pool = ProcessPoolExecutor(
+                    max_workers=toolkit.config.get(
+                        'ckanext.who_romania.lambda_local_processes'
+                    ),
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker_process,
+                    initargs=(toolkit.config['__file__'],)
+                )
+        return cls._pool
+
+    @classmethod
+    def _shutdown(cls):
+        with cls._pool_lock:
+            running, cls._running = list(cls._running), set()
+            if cls._pool is not None:
+                cls._pool.shutdown(wait=False, cancel_futures=True)
+        if running:
+            log.warning(f"Web worker exiting, marking local invocations {running} failed")
+            _fail_unfinished(running)
+
+
+EXECUTORS = {
+    executor.name: executor
+    for executor in (AWSLambdaExecutor, JobQueueExecutor, LocalProcessExecutor)
+}
+
+
+def get_executor():
+    name = toolkit.config.get('ckanext.who_romania.lambda_executor')
+    try:
+        return EXECUTORS[name]()
+    except KeyError:
+        raise toolkit.ValidationError({'lambda_executor': [
+            f"Unknown lambda executor '{name}', "
+            f"valid executors are: {', '.join(EXECUTORS)}"
+        ]})
+
+
+def local_handler(lambda_function):
+    """
+    Returns the local handler configured for a lambda function in
+    ckanext.who_romania.lambda_local_functions, as "FunctionName=module:callable"
+    entries.  Handlers take the same event and context arguments as on AWS,
+    and log to HANDLER_LOGGER (or a logger below it) rather than the root
+    logger.
+    """
+    for entry in toolkit.config.get('ckanext.who_romania.lambda_local_functions'):
+        function_name, _sep, handler_path = entry.partition('=')
+        if function_name == lambda_function:
+            module_name, _sep, handler_name = handler_path.partition(':')
+            return getattr(importlib.import_module(module_name), handler_name)
+    raise toolkit.ObjectNotFound(f"No local handler configured for {lambda_function}")
+
+
+class LocalContext(object):
+    """Stands in for the context object AWS Lambda passes to handlers"""
+
+    def __init__(self, lambda_function, request_id, timeout):
+        self.function_name = lambda_function
+        self.aws_request_id = request_id
+        self._deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self._deadline - time.monotonic()) * 1000), 0)
+
+
+class LogRecordWriter(logging.Handler):
+    """
+    Stores the lines logged during a local invocation as LambdaLogRecords.
+    Lines are written in batches on a connection of their own, so they can
+    be followed while the function runs and are stored independently of
+    whatever the function itself commits or rolls back.
+    """
+
+    def __init__(self, invocation_id):
+        super(LogRecordWriter, self).__init__(level=logging.INFO)
+        self.invocation_id = invocation_id
+        self._buffer = []
+        self._flushed = time.monotonic()
+        # Only the invocation's own lines, not those of other threads
+        self._thread_id = threading.get_ident()
+        self.addFilter(lambda record: record.thread == self._thread_id)
+
+    def write(self, level, message):
+        self._buffer.append({
+            'invocation_id': self.invocation_id,
+            'timestamp': int(time.time() * 1000),
+            'level': level,
+            'message': message
+        })
+        if time.monotonic() - self._flushed > LOG_FLUSH_INTERVAL:
+            self.flush()
+
+    def emit(self, record):
+        try:
+            message = record.getMessage()
+            if record.exc_info:
+                message += '\n' + ''.join(traceback.format_exception(*record.exc_info))
+            self.write(record.levelname, message)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            buffer, self._buffer = self._buffer, []
+            self._flushed = time.monotonic()
+            if buffer:
+                with model.meta.engine.begin() as connection:
+                    connection.execute(LambdaLogRecord.__table__.insert(), buffer)
+        finally:
+            self.release()
+
+
+class _StdoutWriter(io.TextIOBase):
+    """Stores printed lines, which have no log level, like on AWS"""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, text):
+        for line in text.splitlines():
+            if line.strip():
+                self.writer.write(None, line)
+        return len(text)
+
+
+def run_local_invocation(lambda_function, payload, request_id):
+    """
+    Runs a lambda function's local handler, capturing what it logs and
+    updating the invocation's status as it goes.
+    """
+    writer = LogRecordWriter(request_id)
+    handler_logger = logging.getLogger(HANDLER_LOGGER)
+    handler_logger.setLevel(logging.INFO)
+    timeout = toolkit.config.get('ckanext.who_romania.lambda_local_timeout')
+    started = time.monotonic()
+    status = LambdaInvocation.FAILED
+    _set_status(request_id, LambdaInvocation.RUNNING)
+    writer.write('START', "Version: $LOCAL")
+    handler_logger.addHandler(writer)
+    try:
+        handler = local_handler(lambda_function)
+        with contextlib.redirect_stdout(_StdoutWriter(writer)):
+            handler(payload, LocalContext(lambda_function, request_id, timeout))
+        status = LambdaInvocation.COMPLETED
+    except Exception:
+        handler_logger.exception(f"{lambda_function} invocation {request_id} failed")
+    finally:
+        handler_logger.removeHandler(writer)
+        duration = (time.monotonic() - started) * 1000
+        writer.write('END', "")
+        writer.write('REPORT', f"Duration: {duration:.2f} ms")
+        writer.flush()
+        _set_status(request_id, status)
+
+
+class LocalTimeout(Exception):
+    pass
+
+
+def run_local_invocation_with_timeout(lambda_function, payload, request_id):
+    """
+    Runs a local invocation in a pool process, interrupting the handler with
+    a LocalTimeout once lambda_local_timeout has passed.  Pool processes run
+    their tasks on their main thread, where the alarm signal is delivered.
+    """
+    timeout = toolkit.config.get('ckanext.who_romania.lambda_local_timeout')
+
+    def interrupt(signum, frame):
+        raise LocalTimeout(f"{lambda_function} timed out after {timeout} seconds")
+
+    previous_handler = signal.signal(signal.SIGALRM, interrupt)
+    signal.alarm(timeout)
+    try:
+        run_local_invocation(lambda_function, payload, request_id)
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def track_invocation(invocation_id):
+    """
+    Follows an AWS invocation's logs, recording its log stream and marking
+    it running once it starts logging, and completed or failed (if it logged
+    errors) once the lambda runtime reports on it.  Invocations that haven't
+    reported within ckanext.who_romania.lambda_timeout are marked failed.
+
+    Run as a background job, so the status is kept up to date whether or
+    not anyone is watching the logs.
+    """
+    invocation = LambdaInvocation.get(invocation_id)
+    if invocation is None or not invocation.in_progress:
+        return
+    log_group = f'/aws/lambda/{invocation.lambda_function}'
+    start_time = invocation.created_timestamp - aws.LOG_CLOCK_SKEW
+    log_stream_name = invocation.log_stream_name
+    deadline = time.monotonic() + toolkit.config.get(
+        'ckanext.who_romania.lambda_timeout'
+    ) + TRACK_GRACE_PERIOD
+    next_token = None
+    running_request_id = None
+    levels = set()
+    while time.monotonic() < deadline:
+        try:
+            if not log_stream_name:
+                log_stream_name = aws.invocation_log_stream(
+                    log_group, invocation_id, start_time=start_time
+                )
+                if log_stream_name:
+                    _set_status(invocation_id, LambdaInvocation.RUNNING, log_stream_name=log_stream_name)
+            if log_stream_name:
+                events, next_token = aws.log_events(
+                    log_group,
+                    log_stream_name,
+                    next_token=next_token,
+                    start_time=None if next_token else start_time
+                )
+                records = [aws.parse_log_event(event) for event in events]
+                running_request_id = aws.attribute_log_records(records, running_request_id)
+                levels.update(
+                    record['level']
+                    for record in aws.filter_log_records(records, request_id=invocation_id)
+                )
+                if 'REPORT' in levels:
+                    failed = levels & {'ERROR', 'CRITICAL'}
+                    _set_status(
+                        invocation_id,
+                        LambdaInvocation.FAILED if failed else LambdaInvocation.COMPLETED
+                    )
+                    return
+        except Exception as e:
+            log.warning(f"Failed to follow the logs of invocation {invocation_id}: {e}")
+        time.sleep(TRACK_INTERVAL)
+    log.warning(f"Invocation {invocation_id} didn't report in time, marking it failed")
+    _set_status(invocation_id, LambdaInvocation.FAILED)
+
+
+def local_log_records(invocation_id, next_token=None):
+    """
+    Returns the records logged by a local invocation after the given token,
+    and the token to pass in next time to fetch only the records logged
+    since.
+    """
+    table = LambdaLogRecord.__table__
+    query = table.select().where(table.c.invocation_id == invocation_id)
+    if next_token:
+        query = query.where(table.c.id > int(next_token))
+    with model.meta.engine.connect() as connection:
+        rows = connection.execute(query.order_by(table.c.id)).fetchall()
+    records = [
+        {
+            'level': row.level,
+            'timestamp': row.timestamp,
+            'request_id': row.invocation_id,
+            'message': row.message
+        }
+        for row in rows
+    ]
+    return records, str(rows[-1].id) if rows else next_token
+
+
+def _set_status(invocation_id, status, **values):
+    table = LambdaInvocation.__table__
+    with model.meta.engine.begin() as connection:
+        connection.execute(
+            table.update().where(table.c.id == invocation_id).values(status=status, **values)
+        )
+
+
+def _fail_unfinished(invocation_ids):
+    table = LambdaInvocation.__table__
+    with model.meta.engine.begin() as connection:
+        connection.execute(
+            table.update().where(
+                table.c.id.in_(invocation_ids),
+                table.c.status.in_([LambdaInvocation.QUEUED, LambdaInvocation.RUNNING])
+            ).values(status=LambdaInvocation.FAILED)
+        )
+
+
+def _fail_expired_local_invocations():
+    table = LambdaInvocation.__table__
+    timeout = toolkit.config.get('ckanext.who_romania.lambda_local_timeout')
+    expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=timeout)
+    with model.meta.engine.begin() as connection:
+        connection.execute(
+            table.update().where(
+                table.c.executor == LocalProcessExecutor.name,
+                table.c.created < expired,
+                table.c.status.in_([LambdaInvocation.QUEUED, LambdaInvocation.RUNNING])
+            ).values(status=LambdaInvocation.FAILED)
+        )
+
+
+def _init_worker_process(config_file):
+    from ckan.cli import load_config
+    from ckan.config.middleware import make_app
+    make_app(load_config(config_file))
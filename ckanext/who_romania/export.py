@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+
+from sqlalchemy.orm import selectinload
+
+import ckan.model as model
+
+
+BATCH_SIZE = 500
+
+# Fields exported for each dataset, and for each of its resources
+DATASET_FIELDS = [
+    'id', 'name', 'title', 'type', 'organization', 'private', 'metadata_modified',
+    'program_area', 'language', 'approval', 'month',
+]
+DATASET_EXTRAS = ['program_area', 'language', 'approval', 'month']
+RESOURCE_FIELDS = ['id', 'name', 'url', 'format', 'size', 'sha256', 'family_doctor', 'week', 'approval']
+RESOURCE_EXTRAS = ['sha256', 'family_doctor', 'week', 'approval']
+
+FORMATS = ['jsonl', 'csv']
+
+
+def iter_datasets(dataset_type=None, organization=None, modified_since=None, batch_size=BATCH_SIZE):
+    """
+    Yields the metadata of the active datasets in the catalogue, optionally
+    filtered by type, organization (name or id) and modification time,
+    oldest modification first.
+
+    Datasets are read from a server side cursor a batch at a time, with
+    their extras and resources loaded per batch, so memory use doesn't grow
+    with the size of the catalogue.
+    """
+    query = model.Session.query(model.Package, model.Group.name).outerjoin(
+        model.Group, model.Group.id == model.Package.owner_org
+    ).filter(
+        model.Package.state == 'active'
+    ).options(
+        selectinload(model.Package._extras),
+        selectinload(model.Package.resources_all)
+    ).order_by(model.Package.metadata_modified, model.Package.id)
+    if dataset_type:
+        query = query.filter(model.Package.type == dataset_type)
+    if organization:
+        query = query.filter(
+            (model.Group.name == organization) | (model.Group.id == organization)
+        )
+    if modified_since:
+        query = query.filter(model.Package.metadata_modified >= modified_since)
+    for dataset, organization_name in query.yield_per(batch_size):
+        yield _dataset_record(dataset, organization_name)
+
+
+def iter_jsonl(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+def iter_csv(records):
+    """
+    Yields CSV lines with a row per resource, repeating the dataset's
+    fields, or a single row for datasets without resources.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(DATASET_FIELDS + [f'resource_{field}' for field in RESOURCE_FIELDS])
+    for record in records:
+        dataset_row = [_csv_value(record.get(field)) for field in DATASET_FIELDS]
+        for resource in record['resources'] or [{}]:
+            writer.writerow(dataset_row + [_csv_value(resource.get(field)) for field in RESOURCE_FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def export_lines(export_format, **filters):
+    """Yields the catalogue in the given format, a line or so at a time"""
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format {export_format}, use one of {', '.join(FORMATS)}")
+    records = iter_datasets(**filters)
+    return iter_jsonl(records) if export_format == 'jsonl' else iter_csv(records)
+
+
+def _dataset_record(dataset, organization_name):
+    extras = dataset.extras
+    record = {
+        'id': dataset.id,
+        'name': dataset.name,
+        'title': dataset.title,
+        'type': dataset.type,
+        'organization': organization_name,
+        'private': dataset.private,
+        'metadata_modified': dataset.metadata_modified.isoformat() if dataset.metadata_modified else None,
+    }
+    record.update((key, extras.get(key)) for key in DATASET_EXTRAS)
+    record['resources'] = [
+        _resource_record(resource)
+        for resource in sorted(dataset.resources_all, key=lambda resource: resource.position or 0)
+        if resource.state == 'active'
+    ]
+    return record
+
+
+def _resource_record(resource):
+    extras = resource.extras or {}
+    record = {
+        'id': resource.id,
+        'name': resource.name,
+        'url': resource.url,
+        'format': resource.format,
+        'size': resource.size,
+    }
+    record.update((key, extras.get(key)) for key in RESOURCE_EXTRAS)
+    return record
+
+
+def _csv_value(value):
+    return '' if value is None else value
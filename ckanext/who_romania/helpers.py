@@ -1,3 +1,4 @@
+import ckan.lib.webassets_tools as webassets_tools
 import ckan.logic as logic
 import ckan.model as model
 from ckan.common import request, g
@@ -142,3 +143,12 @@ def get_week_options(month):
 
 def get_login_view():
     return toolkit.config.get("ckan.auth.login_view", "user.login")
+
+
+def asset_url(name):
+    """
+    Returns the URL of a webassets bundle without including it in the page,
+    for scripts to fetch when they need it.
+    """
+    bundle = webassets_tools.env[name]
+    return toolkit.h.url_for_static_or_external(bundle.urls()[0])
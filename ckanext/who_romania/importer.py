@@ -0,0 +1,211 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import re
+from datetime import datetime
+
+import ckan.plugins.toolkit as toolkit
+import ckanext.who_romania.jobs as who_romania_jobs
+import ckanext.who_romania.search as who_romania_search
+import ckanext.who_romania.upload as who_romania_upload
+
+
+log = logging.getLogger(__name__)
+
+REPORT_EXTENSIONS = ('.csv', '.xlsx')
+# Matches e.g. SERBAN/2023-09-08.csv or serban_2023-09-08.xlsx
+DEFAULT_PATTERN = r'(?P<family_doctor>[A-Za-z]+)[/_ -]+(?P<week>\d{4}-\d{2}-\d{2})'
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_WORKERS = 4
+
+Report = collections.namedtuple('Report', ['path', 'relative_path', 'family_doctor', 'week'])
+
+
+def find_reports(directory, pattern=DEFAULT_PATTERN):
+    """
+    Walks a directory for weekly report files, reading the family doctor and
+    week of each from its path relative to the directory with the pattern's
+    family_doctor and week groups.  Files the pattern doesn't match are
+    logged and skipped.
+
+    Returns the reports by week and family doctor.
+    """
+    regex = re.compile(pattern)
+    reports = []
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            relative_path = os.path.relpath(path, directory).replace(os.sep, '/')
+            if not name.lower().endswith(REPORT_EXTENSIONS):
+                continue
+            match = regex.search(relative_path)
+            if not match:
+                log.warning(f"Skipping {relative_path}, its family doctor and week are unknown")
+                continue
+            reports.append(Report(
+                path,
+                relative_path,
+                match.group('family_doctor').upper(),
+                match.group('week')
+            ))
+    return sorted(reports, key=lambda report: (report.week, report.family_doctor, report.relative_path))
+
+
+def group_by_month(reports):
+    """Groups reports into the month datasets they belong in, by week ending"""
+    months = collections.OrderedDict()
+    for report in reports:
+        months.setdefault(report.week[:7], []).append(report)
+    return months
+
+
+class Checkpoint(object):
+    """
+    Records the datasets created and the files imported so far, so that an
+    interrupted import can carry on where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.datasets = {}
+        self.imported = {}
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                state = json.load(checkpoint_file)
+            self.datasets = state.get('datasets', {})
+            self.imported = state.get('imported', {})
+
+    def save(self):
+        if not self.path:
+            return
+        with open(self.path + '.tmp', 'w') as checkpoint_file:
+            json.dump({'datasets': self.datasets, 'imported': self.imported}, checkpoint_file, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def import_reports(context, directory, organization, checkpoint_path=None,
+                   pattern=DEFAULT_PATTERN, workers=DEFAULT_WORKERS,
+                   batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Imports a directory of weekly reports into the organization's family
+    medicine datasets, one per month, creating those that don't exist.
+
+    Reports are uploaded to giftless by a pool of worker threads and added
+    to their dataset a batch at a time with package_revise, so datasets are
+    validated and indexed once per batch rather than once per report.
+    Progress is saved to the checkpoint file after each batch.  Reports for
+    a family doctor and week the dataset already has a resource for are
+    skipped, so a run interrupted before it saved its checkpoint doesn't add
+    them twice when resumed.
+
+    Each action is passed a copy of the context, as actions add to theirs.
+
+    Returns the number of reports imported.
+    """
+    organization = toolkit.get_action('organization_show')(dict(context), {'id': organization})
+    checkpoint = Checkpoint(checkpoint_path)
+    imported = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for month, reports in group_by_month(find_reports(directory, pattern)).items():
+            pending = [report for report in reports if report.relative_path not in checkpoint.imported]
+            if not pending:
+                continue
+            dataset = _month_dataset(context, organization, month, checkpoint)
+            pending = _skip_existing(dataset, pending, checkpoint)
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                # The token is shared by the batch's uploads, which only talk
+                # to giftless, and fetched afresh for each batch so that it
+                # doesn't expire part way through a month
+                upload_context = {
+                    'giftless_token': who_romania_upload._get_upload_authz_token(
+                        dict(context), dataset['name'], organization['name']
+                    )
+                }
+                uploads = list(pool.map(
+                    lambda report: _upload_report(upload_context, dataset, report),
+                    batch
+                ))
+                dataset = _add_resources(context, dataset, batch, uploads)
+                checkpoint.imported.update(
+                    (report.relative_path, uploaded['sha256'])
+                    for report, uploaded in zip(batch, uploads)
+                )
+                checkpoint.save()
+                imported += len(batch)
+                log.info(f"Imported {imported} reports, up to {batch[-1].relative_path}")
+    return imported
+
+
+def _month_dataset(context, organization, month, checkpoint):
+    dataset_id = checkpoint.datasets.get(month)
+    if dataset_id:
+        return toolkit.get_action('package_show')(dict(context), {'id': dataset_id})
+    month_date = datetime.strptime(month, '%Y-%m').strftime(who_romania_search.SOLR_DATE_FORMAT)
+    results = toolkit.get_action('package_search')(dict(context), {
+        'fq': (
+            f'+dataset_type:family-medicine +owner_org:"{organization["id"]}" '
+            f'+{who_romania_search.MONTH_FIELD}:"{month_date}"'
+        ),
+        'include_private': True,
+        'rows': 1,
+    })['results']
+    if results:
+        dataset = toolkit.get_action('package_show')(dict(context), {'id': results[0]['id']})
+    else:
+        dataset = toolkit.get_action('package_create')(dict(context), {
+            'type': 'family-medicine',
+            'owner_org': organization['id'],
+            'month': month,
+        })
+        log.info(f"Created dataset {dataset['name']} for {month}")
+    checkpoint.datasets[month] = dataset['id']
+    checkpoint.save()
+    return dataset
+
+
+def _skip_existing(dataset, reports, checkpoint):
+    existing = {
+        (resource.get('family_doctor'), resource.get('week')): resource
+        for resource in dataset.get('resources', [])
+    }
+    remaining = []
+    for report in reports:
+        resource = existing.get((report.family_doctor, report.week))
+        if resource is None:
+            remaining.append(report)
+            continue
+        log.info(f"Skipping {report.relative_path}, {dataset['name']} already has it")
+        checkpoint.imported[report.relative_path] = resource.get('sha256')
+    if len(remaining) < len(reports):
+        checkpoint.save()
+    return remaining
+
+
+def _upload_report(context, dataset, report):
+    with open(report.path, 'rb') as report_file:
+        return who_romania_upload.upload_blob(
+            context, dataset, report_file, os.path.basename(report.path)
+        )
+
+
+def _add_resources(context, dataset, reports, uploads):
+    resources = [
+        dict(
+            uploaded,
+            family_doctor=report.family_doctor,
+            week=report.week,
+            format=os.path.splitext(report.path)[1].lstrip('.').upper()
+        )
+        for report, uploaded in zip(reports, uploads)
+    ]
+    dataset = toolkit.get_action('package_revise')(dict(context), {
+        'match': {'id': dataset['id']},
+        'update__resources__extend': resources,
+    })['package']
+    # package_revise doesn't call the resource hooks which process uploads
+    for resource in dataset['resources'][-len(resources):]:
+        who_romania_jobs.enqueue_upload_processing(resource)
+    return dataset
@@ -0,0 +1,132 @@
+import csv
+import hashlib
+import io
+import logging
+
+from sqlalchemy import text
+
+import ckanext.who_romania.tabular as tabular
+import ckanext.who_romania.upload as who_romania_upload
+from ckanext.datastore.backend.postgres import get_write_engine, identifier
+
+
+log = logging.getLogger(__name__)
+
+# Columns identifying which weekly report a row was loaded from
+REPORT_COLUMNS = [
+    ('resource_id', 'text'),
+    ('family_doctor', 'text'),
+    ('week', 'date'),
+]
+# The names Postgres reports for the column types not already in full
+POSTGRES_TYPE_NAMES = {
+    'timestamp': 'timestamp without time zone',
+}
+
+
+def is_weekly_report(resource):
+    return bool(resource.get('family_doctor') and resource.get('week')) \
+        and tabular.is_csv_upload(resource)
+
+
+def table_name(dataset_id):
+    """
+    The DataStore table holding a family medicine dataset's weekly reports.
+    The DataStore's default privileges make it readable by its read user.
+    """
+    return f'family_medicine_{dataset_id}'
+
+
+def load_weekly_report(context, resource):
+    """
+    Streams a weekly report into its dataset's DataStore table with COPY, a
+    chunk of rows at a time.  Report columns are typed as described by the
+    reporting template's schema, and columns the template doesn't describe
+    are text, so any value a report holds can be loaded.
+
+    Rows are keyed by the report's family doctor and week, so re-uploading a
+    report replaces the rows previously loaded for it.
+    """
+    name = table_name(resource['package_id'])
+    table = identifier(name)
+    template_fields = tabular.schema_fields(tabular.template_schema())
+    with who_romania_upload.open_giftless_resource(context, resource) as report:
+        header, chunks = tabular.csv_chunks(report)
+        # The report's own columns can't replace those identifying the report
+        indexes = [
+            i for i, column in enumerate(header)
+            if column and column not in dict(REPORT_COLUMNS)
+        ]
+        fields = [
+            (header[i], tabular.POSTGRES_TYPES.get(
+                template_fields.get(header[i], {}).get('type'), 'text'
+            ))
+            for i in indexes
+        ]
+        with get_write_engine().begin() as connection:
+            # Serialises loads into the table, so its columns are compared
+            # and altered by one report at a time
+            lock_key = int(hashlib.sha256(f'ingest:{name}'.encode('utf-8')).hexdigest()[:15], 16)
+            connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), key=lock_key)
+            _create_table(connection, name, fields)
+            connection.execute(
+                text(
+                    f'DELETE FROM {table} WHERE resource_id = :resource_id '
+                    'OR (family_doctor = :family_doctor AND week = :week)'
+                ),
+                resource_id=resource['id'],
+                family_doctor=resource['family_doctor'],
+                week=resource['week']
+            )
+            copy = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                table,
+                ', '.join(identifier(column) for column, _type in REPORT_COLUMNS + fields)
+            )
+            cursor = connection.connection.cursor()
+            report_values = [resource['id'], resource['family_doctor'], resource['week']]
+            row_count = 0
+            for chunk in chunks:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in chunk:
+                    writer.writerow(report_values + [row[i].strip() or None for i in indexes])
+                buffer.seek(0)
+                cursor.copy_expert(copy, buffer)
+                row_count += len(chunk)
+    log.info(f"Loaded {row_count} rows from weekly report {resource['id']} into {table}")
+    return row_count
+
+
+def _create_table(connection, name, fields):
+    table = identifier(name)
+    connection.execute(text('CREATE TABLE IF NOT EXISTS {} ({})'.format(
+        table,
+        ', '.join(f'{identifier(column)} {column_type}' for column, column_type in REPORT_COLUMNS)
+    )))
+    existing_types = _column_types(connection, table)
+    for column, column_type in fields:
+        existing_type = existing_types.get(column)
+        if existing_type is None:
+            # Later reports may have columns earlier ones didn't
+            connection.execute(text(
+                f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {identifier(column)} {column_type}'
+            ))
+        elif existing_type not in (POSTGRES_TYPE_NAMES.get(column_type, column_type), 'text'):
+            # The column was typed differently for an earlier report, e.g.
+            # before the template changed, so it's widened to hold both
+            connection.execute(text(
+                f'ALTER TABLE {table} ALTER COLUMN {identifier(column)} '
+                f'TYPE text USING {identifier(column)}::text'
+            ))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS {} ON {} (family_doctor, week)'.format(
+        identifier(f'{name}_report_idx'),
+        table
+    )))
+
+
+def _column_types(connection, table):
+    rows = connection.execute(text(
+        'SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute '
+        'WHERE attrelid = to_regclass(:table) AND attnum > 0 AND NOT attisdropped'
+    ), table=table)
+    return dict(rows.fetchall())
@@ -0,0 +1,51 @@
+import logging
+
+import ckan.plugins as plugins
+import ckan.plugins.toolkit as toolkit
+import ckanext.who_romania.ingest as ingest
+import ckanext.who_romania.preview as preview
+import ckanext.who_romania.tabular as tabular
+import ckanext.who_romania.validation as validation
+
+
+log = logging.getLogger(__name__)
+
+
+def enqueue_upload_processing(resource):
+    toolkit.enqueue_job(
+        process_upload,
+        [resource['id']],
+        title=f"Process upload {resource['id']}"
+    )
+
+
+def process_upload(resource_id):
+    """
+    Processes a newly uploaded resource in the background.  A preview of
+    tabular files is stored for the resource page.  Weekly family medicine
+    reports are validated against the reporting template's schema, if one
+    is configured, and those that pass are loaded into the DataStore, if it
+    is enabled.
+
+    Jobs run on the CKAN background job workers, so as many reports are
+    processed at a time as there are workers.
+    """
+    site_user = toolkit.get_action('get_site_user')({'ignore_auth': True}, {})
+    context = {'user': site_user['name'], 'ignore_auth': True}
+    resource = toolkit.get_action('resource_show')(context, {'id': resource_id})
+    if preview.is_previewable(resource):
+        try:
+            preview.preview_resource(dict(context), resource)
+        except Exception:
+            # The preview is a nicety, it mustn't hold up the data
+            log.exception(f"Failed to preview {resource_id}")
+    if not ingest.is_weekly_report(resource):
+        return
+    schema = tabular.template_schema()
+    if schema and validation.validate_resource(dict(context), resource, schema):
+        return
+    if plugins.plugin_loaded('datastore'):
+        try:
+            ingest.load_weekly_report(dict(context), resource)
+        except Exception:
+            log.exception(f"Failed to load weekly report {resource_id} into the DataStore")
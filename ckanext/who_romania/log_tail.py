@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+
+import ckanext.who_romania.aws as aws
+
+
+log = logging.getLogger(__name__)
+
+POLL_INTERVAL = 2
+IDLE_TIMEOUT = 30
+MAX_BUFFERED_RECORDS = 10000
+
+_tails = {}
+_tails_lock = threading.Lock()
+_open_streams = 0
+
+
+class LogTail(object):
+    """
+    Polls a single CloudWatch log stream in a background thread, using the
+    stream's forward token so that each poll only fetches new events.
+
+    Events are parsed into log records and buffered in the order they were
+    logged, so a subscriber tracks its position in the stream and asks for
+    everything after it.  However many users are watching, a stream is only
+    polled once.  The poller stops once it has had no subscribers for
+    IDLE_TIMEOUT seconds.
+    """
+
+    def __init__(self, log_group, log_stream_name):
+        self.log_group = log_group
+        self.log_stream_name = log_stream_name
+        self.key = (log_group, log_stream_name)
+        self.records = []
+        self.offset = 0
+        self.subscribers = 0
+        self.next_token = None
+        self.request_id = None
+        self.condition = threading.Condition()
+        self._idle_since = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"log-tail:{log_stream_name}",
+            daemon=True
+        )
+
+    @property
+    def position(self):
+        return self.offset + len(self.records)
+
+    def subscribe(self):
+        with self.condition:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+            if not self.subscribers:
+                self._idle_since = time.monotonic()
+
+    def wait_for_records(self, position, timeout):
+        """
+        Returns the records logged after the given position in the stream,
+        and the position to ask from next time.  Blocks for up to timeout
+        seconds if there are no such records yet.
+        """
+        with self.condition:
+            if position >= self.position:
+                self.condition.wait(timeout)
+            start = max(position - self.offset, 0)
+            return self.records[start:], self.position
+
+    def _fetch(self):
+        events, self.next_token = aws.log_events(
+            self.log_group,
+            self.log_stream_name,
+            next_token=self.next_token
+        )
+        records = [aws.parse_log_event(event) for event in events]
+        self.request_id = aws.attribute_log_records(records, self.request_id)
+        return records
+
+    def _run(self):
+        while not self._is_idle():
+            try:
+                records = self._fetch()
+            except Exception as e:
+                log.warning(f"Failed to poll {self.log_stream_name}: {e}")
+                records = []
+            if records:
+                with self.condition:
+                    self.records.extend(records)
+                    overflow = len(self.records) - MAX_BUFFERED_RECORDS
+                    if overflow > 0:
+                        del self.records[:overflow]
+                        self.offset += overflow
+                    self.condition.notify_all()
+            time.sleep(POLL_INTERVAL)
+
+    def _is_idle(self):
+        with _tails_lock, self.condition:
+            idle = (
+                not self.subscribers
+                and time.monotonic() - self._idle_since > IDLE_TIMEOUT
+            )
+            if idle:
+                _tails.pop(self.key, None)
+            return idle
+
+
+class LocalLogTail(LogTail):
+    """
+    Polls the log records stored by a lambda function run by a local
+    executor, rather than a CloudWatch log stream.
+    """
+
+    def __init__(self, invocation_id):
+        super(LocalLogTail, self).__init__(None, invocation_id)
+        self.key = ('local', invocation_id)
+        self.request_id = invocation_id
+
+    def _fetch(self):
+        # Imported here as executors needs the CKAN model, which the
+        # CloudWatch tails don't
+        import ckanext.who_romania.executors as executors
+        records, self.next_token = executors.local_log_records(
+            self.request_id, self.next_token
+        )
+        return records
+
+
+def subscribe(lambda_function, log_stream_name):
+    """
+    Returns the LogTail for a lambda function's log stream with a new
+    subscriber registered, starting a poller if one isn't already running.
+    Callers must call unsubscribe() on the tail once they are done with it.
+    """
+    log_group = f'/aws/lambda/{lambda_function}'
+    return _subscribe((log_group, log_stream_name), lambda: LogTail(log_group, log_stream_name))
+
+
+def subscribe_local(invocation_id):
+    """
+    Like subscribe(), for the log records of an invocation run by a local
+    executor.
+    """
+    return _subscribe(('local', invocation_id), lambda: LocalLogTail(invocation_id))
+
+
+def start_stream(max_streams):
+    """
+    Takes one of this process's max_streams slots for a streaming response,
+    so that log watchers can't tie up all of its web workers.  Returns
+    False if they are all taken, otherwise callers must call end_stream()
+    once the response is finished.
+    """
+    global _open_streams
+    with _tails_lock:
+        if _open_streams >= max_streams:
+            return False
+        _open_streams += 1
+        return True
+
+
+def end_stream():
+    global _open_streams
+    with _tails_lock:
+        _open_streams = max(_open_streams - 1, 0)
+
+
+def _subscribe(key, create):
+    with _tails_lock:
+        log_tail = _tails.get(key)
+        if log_tail is None:
+            log_tail = create()
+            _tails[key] = log_tail
+            log_tail._thread.start()
+        log_tail.subscribe()
+    return log_tail
@@ -0,0 +1,168 @@
+import bisect
+import functools
+import threading
+import time
+
+from flask import g, has_request_context
+
+from ckan.plugins import toolkit
+
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_enabled = False
+_profiling = False
+
+
+class Histogram(object):
+    """
+    A Prometheus histogram of durations, labelled by the name of what was
+    timed and its outcome.  Observations take a lock only long enough to
+    bump their bucket, so timing stays cheap under concurrent requests.
+    """
+
+    def __init__(self, name, documentation, label):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, outcome, seconds):
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            series = self._series.get((name, outcome))
+            if series is None:
+                series = self._series[(name, outcome)] = [[0] * (len(BUCKETS) + 1), 0.0]
+            series[0][bucket] += 1
+            series[1] += seconds
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def exposition(self):
+        """Returns the histogram in the Prometheus text exposition format"""
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for (name, outcome), (counts, total) in sorted(series.items()):
+            labels = f'{self.label}="{_escape(name)}",outcome="{_escape(outcome)}"'
+            cumulative = 0
+            for upper_bound, count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{upper_bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+ACTIONS = Histogram(
+    'ckanext_who_romania_action_duration_seconds',
+    "Time spent in the extension's actions",
+    'action'
+)
+HOOKS = Histogram(
+    'ckanext_who_romania_hook_duration_seconds',
+    "Time spent in the extension's plugin hooks",
+    'hook'
+)
+HELPERS = Histogram(
+    'ckanext_who_romania_helper_duration_seconds',
+    "Time spent in the extension's template helpers",
+    'helper'
+)
+HISTOGRAMS = [ACTIONS, HOOKS, HELPERS]
+
+
+def configure(config):
+    global _enabled, _profiling
+    _enabled = toolkit.asbool(config.get('ckanext.who_romania.metrics'))
+    _profiling = toolkit.asbool(config.get('ckanext.who_romania.profile'))
+
+
+def enabled():
+    return _enabled
+
+
+def start_profile():
+    """Starts recording the calls made while handling the current request"""
+    g.who_romania_profile = {}
+
+
+def request_profile():
+    """
+    Returns the calls recorded for the current request, as
+    {(kind, name): [calls, seconds]}, or None if it isn't being profiled.
+    """
+    return g.get('who_romania_profile') if has_request_context() else None
+
+
+def timed(histogram, name, func):
+    """
+    Wraps a function so that its calls are timed into a histogram, when
+    metrics are enabled, and into the request's profile, when profiling.
+    Calls are labelled with the name of the exception they raised, or
+    "success".  The function's attributes, such as the ones marking chained
+    or side effect free actions, are kept.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not (_enabled or _profiling):
+            return func(*args, **kwargs)
+        outcome = 'success'
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            if _enabled:
+                histogram.observe(name, outcome, seconds)
+            profile = request_profile() if _profiling else None
+            if profile is not None:
+                calls = profile.setdefault((histogram.label, name), [0, 0.0])
+                calls[0] += 1
+                calls[1] += seconds
+    return wrapper
+
+
+def timed_actions(actions):
+    return {name: timed(ACTIONS, name, action) for name, action in actions.items()}
+
+
+def timed_helpers(helpers):
+    return {name: timed(HELPERS, name, helper) for name, helper in helpers.items()}
+
+
+def profiled_core_helpers(names):
+    """
+    Returns timed chained helpers for CKAN's own helpers with the given
+    names, so that they appear in profiles and metrics too.
+    """
+    def passthrough(next_helper, *args, **kwargs):
+        return next_helper(*args, **kwargs)
+
+    return {
+        name: toolkit.chained_helper(timed(HELPERS, name, passthrough))
+        for name in names
+    }
+
+
+def timed_hook(func):
+    """Decorates a plugin method to time it as a hook"""
+    return timed(HOOKS, func.__name__, func)
+
+
+def exposition():
+    return "".join(histogram.exposition() for histogram in HISTOGRAMS)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
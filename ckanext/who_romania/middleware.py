@@ -0,0 +1,266 @@
+import hashlib
+import importlib.metadata
+import logging
+import random
+import time
+
+from flask import current_app, g, make_response, request, session
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+import ckanext.who_romania.metrics as metrics
+from ckan.views.dataset import read as dataset_read
+from ckanext.who_romania.model import ResourcePreview, ResourceValidation
+
+
+log = logging.getLogger(__name__)
+
+
+# Response headers, and the ckanext.who_romania options that set them
+SECURITY_HEADERS = [
+    ("Strict-Transport-Security", "strict_transport_security"),
+    ("X-Content-Type-Options", "content_type_options"),
+    ("X-Permitted-Cross-Domain-Policies", "cross_domain_policies"),
+    ("Referrer-Policy", "referrer_policy"),
+    ("Cache-Control", "cache_control"),
+    ("Cross-Origin-Opener-Policy", "coop"),
+    ("Cross-Origin-Embedder-Policy", "coep"),
+    ("Cross-Origin-Resource-Policy", "corp"),
+    ("Content-Security-Policy", "content_security_policy"),
+]
+
+
+def response_headers(config):
+    """
+    Returns the headers to set on every response, as configured.  Headers
+    configured to be empty are left unset.
+    """
+    return tuple(
+        (header, config.get(f"ckanext.who_romania.{option}"))
+        for header, option in SECURITY_HEADERS
+        if config.get(f"ckanext.who_romania.{option}")
+    )
+
+
+def cache_control_overrides(config):
+    """
+    Parses ckanext.who_romania.cache_control_overrides, "path prefix=value"
+    pairs separated by semicolons, into (prefix, value) pairs with the
+    longest prefixes first so that they take precedence.
+    """
+    overrides = []
+    for entry in (config.get("ckanext.who_romania.cache_control_overrides") or "").split(";"):
+        prefix, _sep, value = entry.partition("=")
+        if prefix.strip() and value.strip():
+            overrides.append((prefix.strip(), value.strip()))
+    return tuple(sorted(overrides, key=lambda override: len(override[0]), reverse=True))
+
+
+def apply_response_headers(app, config):
+    """
+    Sets the configured security and caching headers on every response.  The
+    headers are resolved once, when the app is built, rather than on every
+    response.
+    """
+    headers = response_headers(config)
+    overrides = cache_control_overrides(config)
+
+    @app.after_request
+    def apply_owasp(response):
+        for header, value in headers:
+            response.headers[header] = value
+        for prefix, cache_control in overrides:
+            if request.path.startswith(prefix):
+                response.headers["Cache-Control"] = cache_control
+                break
+        if ("Location" in response.headers) and (
+            "logged_out_redirect" in response.headers["Location"]
+        ):
+            response.headers["Clear-Site-Data"] = '"*"'
+        return response
+
+    return app
+
+
+def apply_conditional_get(app, config):
+    """
+    Answers conditional GETs of dataset pages and the package_show API with
+    a 304 before the dataset is fetched and rendered.  Responses carry a
+    strong ETag of the dataset's metadata_modified, the state of its
+    resources' validation results and previews, the user and what they may
+    do with the dataset, and a build token, so templates changed by a
+    deployment aren't served stale.  The token is
+    ckanext.who_romania.etag_build, e.g. the deployed commit, or else the
+    extension's version, so all processes of a deployment agree on it.
+
+    Requests without validators are rendered as usual, and the ETag worked
+    out once the dataset has been fetched for the response.
+    """
+    build = config.get('ckanext.who_romania.etag_build') or _package_version()
+
+    @app.before_request
+    def check_conditional_get():
+        dataset_id = _conditional_dataset_id()
+        if not dataset_id:
+            return None
+        g.who_romania_conditional_dataset_id = dataset_id
+        if not (request.if_none_match or request.if_modified_since):
+            return None
+        g.who_romania_validators_looked_up = True
+        dataset = _find_validators(build, dataset_id)
+        if dataset is None:
+            return None
+        not_modified = request.if_none_match.contains(g.who_romania_etag) if request.if_none_match else (
+            not getattr(toolkit.current_user, 'name', None)
+            and dataset.metadata_modified.replace(microsecond=0)
+            <= request.if_modified_since.replace(tzinfo=None)
+        )
+        if not_modified:
+            response = make_response('', 304)
+            _set_validators(response)
+            return response
+        return None
+
+    @app.after_request
+    def set_validators(response):
+        dataset_id = getattr(g, 'who_romania_conditional_dataset_id', None)
+        if not dataset_id or response.status_code != 200:
+            return response
+        if not getattr(g, 'who_romania_validators_looked_up', False):
+            _find_validators(build, dataset_id)
+        if getattr(g, 'who_romania_etag', None):
+            _set_validators(response)
+        return response
+
+    return app
+
+
+def apply_profiling(app, config):
+    """
+    Adds a Server-Timing header to every response, breaking down how many
+    times each of the timed helpers and actions was called while handling
+    the request and how long they took, if ckanext.who_romania.profile is
+    enabled.  A sample of requests, ckanext.who_romania.profile_log_sample
+    of them, also log the breakdown.
+    """
+    if not toolkit.asbool(config.get("ckanext.who_romania.profile")):
+        return app
+    log_sample = float(config.get("ckanext.who_romania.profile_log_sample") or 0)
+
+    @app.before_request
+    def start_profile():
+        g.who_romania_profile_start = time.perf_counter()
+        metrics.start_profile()
+
+    @app.after_request
+    def add_server_timing(response):
+        profile = metrics.request_profile()
+        if profile is None:
+            return response
+        total = time.perf_counter() - g.who_romania_profile_start
+        timings = server_timings(profile, total)
+        response.headers.add("Server-Timing", ", ".join(timings))
+        if log_sample and random.random() < log_sample:
+            log.info(f"Profile of {request.method} {request.path}: {'; '.join(timings)}")
+        return response
+
+    return app
+
+
+def server_timings(profile, total):
+    """
+    Formats a request's profile as Server-Timing metrics, the slowest
+    first, after the total time spent handling the request.
+    """
+    timings = [f"total;dur={total * 1000:.1f}"]
+    for (kind, name), (calls, seconds) in sorted(
+        profile.items(), key=lambda item: item[1][1], reverse=True
+    ):
+        timings.append(f'{kind}.{name};desc="{calls}x";dur={seconds * 1000:.1f}')
+    return timings
+
+
+def _conditional_dataset_id():
+    if request.method != 'GET' or request.endpoint is None:
+        return None
+    # Pages showing flashed messages must always be rendered
+    if session.get('_flashes'):
+        return None
+    view_args = request.view_args or {}
+    if current_app.view_functions.get(request.endpoint) is dataset_read:
+        return view_args.get('id')
+    if request.blueprint == 'api' and view_args.get('logic_function') == 'package_show':
+        return request.args.get('id')
+    return None
+
+
+def _find_validators(build, dataset_id):
+    """
+    Works out the validators of a dataset's responses for the current user,
+    returning the dataset, or None if its responses aren't cached.
+    """
+    dataset = model.Package.get(dataset_id)
+    if dataset is None or dataset.state != 'active' or not dataset.metadata_modified:
+        return None
+    user = toolkit.current_user
+    user_name = getattr(user, 'name', None)
+    try:
+        toolkit.check_access('package_show', {'user': user_name}, {'id': dataset.id})
+    except toolkit.NotAuthorized:
+        return None
+    try:
+        toolkit.check_access('package_update', {'user': user_name}, {'id': dataset.id})
+        can_edit = True
+    except toolkit.NotAuthorized:
+        can_edit = False
+    g.who_romania_etag = hashlib.sha1(":".join([
+        build,
+        dataset.id,
+        dataset.metadata_modified.isoformat(),
+        _resource_state(dataset),
+        getattr(user, 'id', None) or '',
+        str(can_edit),
+        request.query_string.decode('utf-8', 'replace'),
+        str(toolkit.h.lang()),
+    ]).encode('utf-8')).hexdigest()
+    g.who_romania_last_modified = dataset.metadata_modified
+    return dataset
+
+
+def _resource_state(dataset):
+    """
+    Describes the validation results and previews of a dataset's resources,
+    which are shown with the dataset but stored when uploads are processed,
+    after the dataset was last modified.
+    """
+    resources = [
+        {'id': resource.id, 'sha256': resource.extras.get('sha256')}
+        for resource in dataset.resources
+    ]
+    validations = ResourceValidation.for_resources(resources)
+    sha256s = {resource['sha256'] for resource in resources if resource['sha256']}
+    previewed = {
+        sha256 for (sha256,) in model.Session.query(ResourcePreview.sha256)
+        .filter(ResourcePreview.sha256.in_(sha256s))
+    } if sha256s else set()
+    return ",".join(
+        "{}/{}/{}".format(
+            resource['id'],
+            validations[resource['id']].status if resource['id'] in validations else '',
+            resource['sha256'] in previewed
+        )
+        for resource in resources
+    )
+
+
+def _package_version():
+    try:
+        return importlib.metadata.version('ckanext-who-romania')
+    except importlib.metadata.PackageNotFoundError:
+        return ''
+
+
+def _set_validators(response):
+    response.set_etag(g.who_romania_etag)
+    response.last_modified = g.who_romania_last_modified
+    response.vary.update(('Cookie', 'Authorization'))
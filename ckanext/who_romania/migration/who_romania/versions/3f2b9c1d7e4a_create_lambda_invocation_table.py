@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""create lambda invocation table
+
+Revision ID: 3f2b9c1d7e4a
+Revises:
+Create Date: 2026-10-19 09:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2b9c1d7e4a'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'who_romania_lambda_invocation',
+        sa.Column('id', sa.UnicodeText, primary_key=True),
+        sa.Column('lambda_function', sa.UnicodeText, nullable=False),
+        sa.Column('dataset_id', sa.UnicodeText),
+        sa.Column('user_id', sa.UnicodeText),
+        sa.Column('created', sa.DateTime, nullable=False),
+        sa.Column('status', sa.UnicodeText, nullable=False),
+        sa.Column('log_stream_name', sa.UnicodeText),
+    )
+    op.create_index(
+        'who_romania_lambda_invocation_function_created_idx',
+        'who_romania_lambda_invocation',
+        ['lambda_function', 'created']
+    )
+    op.create_index(
+        'who_romania_lambda_invocation_dataset_id_idx',
+        'who_romania_lambda_invocation',
+        ['dataset_id']
+    )
+
+
+def downgrade():
+    op.drop_table('who_romania_lambda_invocation')
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+"""create resource preview table
+
+Revision ID: 4b7c1e58d062
+Revises: e9d4a2b7f310
+Create Date: 2026-10-19 16:40:53.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7c1e58d062'
+down_revision = 'e9d4a2b7f310'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'who_romania_resource_preview',
+        sa.Column('sha256', sa.UnicodeText, primary_key=True),
+        sa.Column('schema', sa.JSON, nullable=False),
+        sa.Column('rows', sa.JSON, nullable=False),
+        sa.Column('truncated', sa.Boolean, nullable=False),
+        sa.Column('created', sa.DateTime, nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('who_romania_resource_preview')
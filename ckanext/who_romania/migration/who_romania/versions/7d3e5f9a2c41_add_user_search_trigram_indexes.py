@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""add user search trigram indexes
+
+Revision ID: 7d3e5f9a2c41
+Revises: 4b7c1e58d062
+Create Date: 2026-10-19 18:12:37.540116
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3e5f9a2c41'
+down_revision = '4b7c1e58d062'
+branch_labels = None
+depends_on = None
+
+log = logging.getLogger(__name__)
+
+# The user columns user_list searches with ILIKE '%q%'
+COLUMNS = ['name', 'fullname', 'email']
+
+
+def upgrade():
+    if not _trigram_available(op.get_bind()):
+        log.warning(
+            "The pg_trgm extension is not available and can't be created, "
+            "user searches will not be indexed"
+        )
+        return
+    for column in COLUMNS:
+        op.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_user_{column}_trgm '
+            f'ON "user" USING gin ({column} gin_trgm_ops)'
+        )
+
+
+def downgrade():
+    for column in COLUMNS:
+        op.execute(f'DROP INDEX IF EXISTS idx_user_{column}_trgm')
+
+
+def _trigram_available(bind):
+    installed = bind.execute(sa.text(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+    )).scalar()
+    if installed:
+        return True
+    # Creating extensions needs privileges the CKAN user may not have
+    try:
+        with bind.begin_nested():
+            bind.execute(sa.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    except sa.exc.DBAPIError:
+        return False
+    return True
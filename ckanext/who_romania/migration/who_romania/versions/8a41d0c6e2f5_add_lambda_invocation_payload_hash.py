@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""add lambda invocation payload hash
+
+Revision ID: 8a41d0c6e2f5
+Revises: 3f2b9c1d7e4a
+Create Date: 2026-10-19 11:03:54.118420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a41d0c6e2f5'
+down_revision = '3f2b9c1d7e4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'who_romania_lambda_invocation',
+        sa.Column('payload_hash', sa.UnicodeText)
+    )
+    op.create_index(
+        'who_romania_lambda_invocation_payload_hash_idx',
+        'who_romania_lambda_invocation',
+        ['lambda_function', 'payload_hash', 'created']
+    )
+
+
+def downgrade():
+    op.drop_index('who_romania_lambda_invocation_payload_hash_idx')
+    op.drop_column('who_romania_lambda_invocation', 'payload_hash')
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+"""create resource validation table
+
+Revision ID: a6c2f8e41b97
+Revises: 7d3e5f9a2c41
+Create Date: 2026-10-19 21:05:12.604318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c2f8e41b97'
+down_revision = '7d3e5f9a2c41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'who_romania_resource_validation',
+        sa.Column('resource_id', sa.UnicodeText, primary_key=True),
+        sa.Column('sha256', sa.UnicodeText, nullable=False),
+        sa.Column('status', sa.UnicodeText, nullable=False),
+        sa.Column('errors', sa.JSON, nullable=False),
+        sa.Column('created', sa.DateTime, nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('who_romania_resource_validation')
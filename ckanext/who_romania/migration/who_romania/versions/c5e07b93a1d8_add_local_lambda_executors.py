@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+"""add local lambda executors
+
+Revision ID: c5e07b93a1d8
+Revises: 8a41d0c6e2f5
+Create Date: 2026-10-19 13:27:40.551906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e07b93a1d8'
+down_revision = '8a41d0c6e2f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'who_romania_lambda_invocation',
+        sa.Column('executor', sa.UnicodeText, nullable=False, server_default='aws')
+    )
+    op.create_table(
+        'who_romania_lambda_log_record',
+        sa.Column('id', sa.BigInteger, primary_key=True),
+        sa.Column(
+            'invocation_id',
+            sa.UnicodeText,
+            sa.ForeignKey('who_romania_lambda_invocation.id', ondelete='CASCADE'),
+            nullable=False
+        ),
+        sa.Column('timestamp', sa.BigInteger, nullable=False),
+        sa.Column('level', sa.UnicodeText),
+        sa.Column('message', sa.UnicodeText, nullable=False),
+    )
+    op.create_index(
+        'who_romania_lambda_log_record_invocation_id_idx',
+        'who_romania_lambda_log_record',
+        ['invocation_id', 'id']
+    )
+
+
+def downgrade():
+    op.drop_table('who_romania_lambda_log_record')
+    op.drop_column('who_romania_lambda_invocation', 'executor')
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""create aggregation partial table
+
+Revision ID: e9d4a2b7f310
+Revises: c5e07b93a1d8
+Create Date: 2026-10-19 15:02:11.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9d4a2b7f310'
+down_revision = 'c5e07b93a1d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'who_romania_aggregation_partial',
+        sa.Column('resource_id', sa.UnicodeText, primary_key=True),
+        sa.Column('dataset_id', sa.UnicodeText, nullable=False),
+        sa.Column('sha256', sa.UnicodeText, nullable=False),
+        sa.Column('key_columns', sa.JSON, nullable=False),
+        sa.Column('value_columns', sa.JSON, nullable=False),
+        sa.Column('totals', sa.JSON, nullable=False),
+        sa.Column('row_count', sa.Integer, nullable=False),
+        sa.Column('created', sa.DateTime, nullable=False),
+    )
+    op.create_index(
+        'who_romania_aggregation_partial_dataset_id_idx',
+        'who_romania_aggregation_partial',
+        ['dataset_id']
+    )
+
+
+def downgrade():
+    op.drop_table('who_romania_aggregation_partial')
@@ -0,0 +1,182 @@
+import datetime
+
+from sqlalchemy import JSON, BigInteger, Boolean, Column, DateTime, ForeignKey, Index, Integer, UnicodeText
+
+import ckan.model as model
+from ckan.plugins import toolkit
+
+
+class LambdaInvocation(toolkit.BaseModel):
+    """
+    A record of a lambda function invocation.  The id is the invocation's
+    AWS request id, which is also the request id found in its log lines.
+    """
+    __tablename__ = 'who_romania_lambda_invocation'
+    __table_args__ = (
+        Index('who_romania_lambda_invocation_function_created_idx',
+              'lambda_function', 'created'),
+        Index('who_romania_lambda_invocation_dataset_id_idx', 'dataset_id'),
+        Index('who_romania_lambda_invocation_payload_hash_idx',
+              'lambda_function', 'payload_hash', 'created'),
+    )
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+    id = Column(UnicodeText, primary_key=True)
+    lambda_function = Column(UnicodeText, nullable=False)
+    dataset_id = Column(UnicodeText)
+    user_id = Column(UnicodeText)
+    created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    status = Column(UnicodeText, nullable=False, default=QUEUED)
+    log_stream_name = Column(UnicodeText)
+    payload_hash = Column(UnicodeText)
+    executor = Column(UnicodeText, nullable=False, default='aws', server_default='aws')
+
+    @classmethod
+    def get(cls, id):
+        return model.Session.query(cls).get(id)
+
+    @property
+    def in_progress(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    @property
+    def created_timestamp(self):
+        """The creation time in milliseconds since the epoch, as used by AWS"""
+        return int(self.created.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'lambda_function': self.lambda_function,
+            'dataset_id': self.dataset_id,
+            'user_id': self.user_id,
+            'created': self.created.isoformat(),
+            'status': self.status,
+            'log_stream_name': self.log_stream_name,
+            'executor': self.executor,
+        }
+
+
+class LambdaLogRecord(toolkit.BaseModel):
+    """
+    A line logged by a lambda function run by a local executor, stored in the
+    same form as the records parsed from CloudWatch.
+    """
+    __tablename__ = 'who_romania_lambda_log_record'
+    __table_args__ = (
+        Index('who_romania_lambda_log_record_invocation_id_idx',
+              'invocation_id', 'id'),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    invocation_id = Column(
+        UnicodeText,
+        ForeignKey('who_romania_lambda_invocation.id', ondelete='CASCADE'),
+        nullable=False
+    )
+    timestamp = Column(BigInteger, nullable=False)
+    level = Column(UnicodeText)
+    message = Column(UnicodeText, nullable=False)
+
+    def as_dict(self):
+        return {
+            'level': self.level,
+            'timestamp': self.timestamp,
+            'request_id': self.invocation_id,
+            'message': self.message,
+        }
+
+
+class AggregationPartial(toolkit.BaseModel):
+    """
+    The totals aggregated from a single weekly report, cached against the
+    sha256 of the report's blob so that unchanged reports aren't re-read.
+    """
+    __tablename__ = 'who_romania_aggregation_partial'
+    __table_args__ = (
+        Index('who_romania_aggregation_partial_dataset_id_idx', 'dataset_id'),
+    )
+
+    resource_id = Column(UnicodeText, primary_key=True)
+    dataset_id = Column(UnicodeText, nullable=False)
+    sha256 = Column(UnicodeText, nullable=False)
+    key_columns = Column(JSON, nullable=False)
+    value_columns = Column(JSON, nullable=False)
+    totals = Column(JSON, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    @classmethod
+    def for_dataset(cls, dataset_id):
+        return model.Session.query(cls).filter(cls.dataset_id == dataset_id).all()
+
+
+class ResourcePreview(toolkit.BaseModel):
+    """
+    The first rows and inferred schema of an uploaded tabular file, keyed by
+    the sha256 of its blob so resources sharing a file share its preview.
+    """
+    __tablename__ = 'who_romania_resource_preview'
+
+    sha256 = Column(UnicodeText, primary_key=True)
+    schema = Column(JSON, nullable=False)
+    rows = Column(JSON, nullable=False)
+    truncated = Column(Boolean, nullable=False)
+    created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    @classmethod
+    def get(cls, sha256):
+        return model.Session.query(cls).get(sha256)
+
+    def as_dict(self):
+        return {
+            'sha256': self.sha256,
+            'schema': self.schema,
+            'rows': self.rows,
+            'truncated': self.truncated,
+            'created': self.created.isoformat(),
+        }
+
+
+class ResourceValidation(toolkit.BaseModel):
+    """
+    The result of validating a weekly report against the reporting template.
+    It is kept apart from the resource, so editing the resource doesn't lose
+    it, and holds the sha256 of the blob validated, so re-uploads don't
+    inherit it.
+    """
+    __tablename__ = 'who_romania_resource_validation'
+
+    SUCCESS = 'success'
+    FAILURE = 'failure'
+
+    resource_id = Column(UnicodeText, primary_key=True)
+    sha256 = Column(UnicodeText, nullable=False)
+    status = Column(UnicodeText, nullable=False)
+    errors = Column(JSON, nullable=False)
+    created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    @classmethod
+    def for_resources(cls, resources):
+        """Returns the results for the resources' current blobs by resource id"""
+        sha256s = {resource['id']: resource.get('sha256') for resource in resources}
+        if not sha256s:
+            return {}
+        results = model.Session.query(cls).filter(cls.resource_id.in_(sha256s)).all()
+        return {
+            result.resource_id: result for result in results
+            if result.sha256 == sha256s[result.resource_id]
+        }
+
+    def as_dict(self):
+        return {
+            'resource_id': self.resource_id,
+            'sha256': self.sha256,
+            'status': self.status,
+            'errors': self.errors,
+            'created': self.created.isoformat(),
+        }
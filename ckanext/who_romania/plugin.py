@@ -12,7 +12,15 @@ import ckanext.who_romania.upload as who_romania_upload
 import ckanext.who_romania.validators as who_romania_validators
 import ckanext.who_romania.helpers as who_romania_helpers
 import ckanext.who_romania.blueprints as who_romania_blueprints
+import ckanext.who_romania.cli as who_romania_cli
 import ckanext.who_romania.auth as who_romania_auth
+import ckanext.who_romania.jobs as who_romania_jobs
+import ckanext.who_romania.metrics as who_romania_metrics
+import ckanext.who_romania.middleware as who_romania_middleware
+import ckanext.who_romania.preview as who_romania_preview
+import ckanext.who_romania.search as who_romania_search
+import ckanext.who_romania.static as who_romania_static
+import ckanext.who_romania.validation as who_romania_validation
 from ckan.lib.plugins import DefaultPermissionLabels
 
 from ckan.common import config_declaration
@@ -34,10 +42,11 @@ class WHORomaniaPlugin(plugins.SingletonPlugin, DefaultPermissionLabels):
     plugins.implements(plugins.IPackageController, inherit=True)
     plugins.implements(plugins.IAuthenticator, inherit=True)
     plugins.implements(plugins.IMiddleware, inherit=True)
+    plugins.implements(plugins.IClick)
 
     # ITemplateHelpers
     def get_helpers(self):
-        return {
+        helpers = who_romania_metrics.timed_helpers({
             "max_resource_size": uploader.get_max_resource_size,
             "get_dataset_from_id": who_romania_helpers.get_dataset_from_id,
             "blob_storage_resource_filename": blobstorage_helpers.resource_filename,
@@ -50,7 +59,15 @@ class WHORomaniaPlugin(plugins.SingletonPlugin, DefaultPermissionLabels):
             "get_dates_of_weekday_in_month": who_romania_helpers.get_dates_of_weekday_in_month,
             "get_week_options": who_romania_helpers.get_week_options,
             "get_login_view": who_romania_helpers.get_login_view,
-        }
+            "get_resource_preview": who_romania_preview.get_resource_preview,
+            "get_resource_validation": who_romania_validation.get_resource_validation,
+            "asset_url": who_romania_helpers.asset_url,
+        })
+        if toolkit.asbool(toolkit.config.get("ckanext.who_romania.profile")):
+            helpers.update(who_romania_metrics.profiled_core_helpers(
+                toolkit.config.get("ckanext.who_romania.profile_core_helpers")
+            ))
+        return helpers
 
     # IConfigurer
     def update_config(self, config_):
@@ -66,6 +83,8 @@ class WHORomaniaPlugin(plugins.SingletonPlugin, DefaultPermissionLabels):
         This should be removed when the issue is resolved.
         """
         config_declaration.normalize(config)
+        who_romania_auth.configure_lambda_invoke_policy(config)
+        who_romania_metrics.configure(config)
 
     # IConfigDeclaration
     def declare_config_options(self, declaration, key):
@@ -83,10 +102,128 @@ class WHORomaniaPlugin(plugins.SingletonPlugin, DefaultPermissionLabels):
         declaration.declare(group.lambda_invoke_users, "").set_description(
             "Users (other than sysadmins) with permission to invoke"
         )
+        declaration.declare(group.lambda_invoke_org_roles, "").set_description(
+            "Organization roles with permission to invoke, as space separated "
+            "organization:role rules; '*' matches any organization and "
+            "higher roles are included"
+        )
+        declaration.declare(group.lambda_invoke_groups, "").set_description(
+            "Groups whose members have permission to invoke"
+        )
+        declaration.declare_int(group.lambda_coalesce_window, 300).set_description(
+            "Seconds during which a queued or running lambda invocation is "
+            "reused for repeat invocations with the same parameters (0 disables)"
+        )
+        declaration.declare(group.lambda_coalesce_mode, "coalesce").set_description(
+            "What to do with repeat invocations: 'coalesce' returns the "
+            "existing invocation, 'reject' raises a validation error"
+        )
+        declaration.declare(group.lambda_executor, "aws").set_description(
+            "Where lambda functions run: 'aws' invokes them on AWS Lambda, "
+            "'jobs' runs their local handlers on the background job queue and "
+            "'process' in a pool of local processes"
+        )
+        declaration.declare_list(group.lambda_local_functions, []).set_description(
+            "Local handlers for the 'jobs' and 'process' executors, as "
+            "space separated FunctionName=module:callable entries"
+        )
+        declaration.declare_int(group.lambda_timeout, 900).set_description(
+            "Seconds an AWS Lambda invocation may run for, after which it is "
+            "marked failed if it hasn't reported"
+        )
+        declaration.declare(group.lambda_track_queue, "who_romania_lambda").set_description(
+            "Background job queue of the jobs following AWS Lambda invocations, "
+            "which needs a worker of its own"
+        )
+        declaration.declare_int(group.lambda_local_timeout, 900).set_description(
+            "Seconds a local handler may run for"
+        )
+        declaration.declare_int(group.lambda_local_processes, 2).set_description(
+            "Number of processes run by the 'process' executor"
+        )
+        declaration.declare_int(group.lambda_log_max_streams, 4).set_description(
+            "Number of log streams each web process serves at once, further "
+            "watchers are asked to reconnect later"
+        )
+        declaration.declare(group.family_medicine_template_schema).set_description(
+            "Path to a Frictionless Table Schema describing the columns of the "
+            "family medicine reporting template"
+        )
+        declaration.declare_bool(group.metrics, False).set_description(
+            "Time the extension's actions, hooks and helpers, and expose them "
+            "in the Prometheus format at /metrics"
+        )
+        declaration.declare(group.metrics_token, "").set_description(
+            "Bearer token Prometheus must send to scrape /metrics, if unset only "
+            "sysadmins may see /metrics"
+        )
+        declaration.declare(group.etag_build, "").set_description(
+            "Token identifying the deployment in dataset ETags, e.g. the deployed "
+            "commit, defaulting to the extension's version"
+        )
+        declaration.declare_bool(group.profile, False).set_description(
+            "Add a Server-Timing header to responses breaking down the time "
+            "spent in the extension's actions and helpers, and the core "
+            "helpers in profile_core_helpers"
+        )
+        declaration.declare(group.profile_log_sample, "0").set_description(
+            "Fraction of profiled requests that also log the breakdown"
+        )
+        declaration.declare_list(
+            group.profile_core_helpers, ["get_site_statistics"]
+        ).set_description(
+            "CKAN helpers to include in profiles, space separated"
+        )
+        declaration.declare_int(group.preview_rows, 100).set_description(
+            "Number of rows of uploaded CSV and XLSX files to preview"
+        )
+        declaration.declare_int(group.preview_max_xlsx_size, 50 * 1024 * 1024).set_description(
+            "Size in bytes of the largest XLSX file to preview, as XLSX files are read whole"
+        )
+        declaration.declare(
+            group.strict_transport_security, "max-age=31536000; preload"
+        ).set_description("Strict-Transport-Security response header")
+        declaration.declare(group.content_type_options, "nosniff").set_description(
+            "X-Content-Type-Options response header"
+        )
+        declaration.declare(group.cross_domain_policies, "none").set_description(
+            "X-Permitted-Cross-Domain-Policies response header"
+        )
+        declaration.declare(
+            group.referrer_policy, "no-referrer-when-downgrade"
+        ).set_description("Referrer-Policy response header")
+        declaration.declare(group.cache_control, "").set_description(
+            "Cache-Control response header, unless overridden for the path"
+        )
+        declaration.declare(
+            group.cache_control_overrides,
+            "/fonts/=public, max-age=31536000, immutable; "
+            "/webassets/=public, max-age=31536000, immutable; "
+            "/api/=no-store; /user/=no-store; /dashboard=no-store; /lambda/=no-store"
+        ).set_description(
+            "Cache-Control response headers for paths starting with the given "
+            "prefixes, as semicolon separated prefix=value pairs"
+        )
+        declaration.declare(group.coop, "same-site").set_description(
+            "Cross-Origin-Opener-Policy response header"
+        )
+        declaration.declare(group.coep, "unsafe-none").set_description(
+            "Cross-Origin-Embedder-Policy response header"
+        )
+        declaration.declare(group.corp, "cross-origin").set_description(
+            "Cross-Origin-Resource-Policy response header"
+        )
+        declaration.declare(group.content_security_policy, "").set_description(
+            "Content-Security-Policy response header"
+        )
 
     # IBlueprint
     def get_blueprint(self):
-        return [who_romania_blueprints.lambda_blueprint]
+        return [
+            who_romania_blueprints.lambda_blueprint,
+            who_romania_blueprints.metrics_blueprint,
+            who_romania_blueprints.catalogue_blueprint,
+        ]
 
     # IFacets
     def dataset_facets(self, facet_dict, package_type):
@@ -97,17 +234,31 @@ class WHORomaniaPlugin(plugins.SingletonPlugin, DefaultPermissionLabels):
         return new_fd
 
     # IResourceController
+    @who_romania_metrics.timed_hook
     def before_resource_create(self, context, resource):
         who_romania_upload.handle_giftless_uploads(context, resource)
         return resource
 
+    @who_romania_metrics.timed_hook
+    def after_resource_create(self, context, resource):
+        if resource.get('sha256'):
+            who_romania_jobs.enqueue_upload_processing(resource)
+
+    @who_romania_metrics.timed_hook
     def before_resource_update(self, context, current, resource):
         who_romania_upload.handle_giftless_uploads(context, resource, current=current)
+        if resource.get('sha256') and resource['sha256'] != current.get('sha256'):
+            context.setdefault('who_romania_new_uploads', set()).add(resource['sha256'])
         return resource
 
+    @who_romania_metrics.timed_hook
+    def after_resource_update(self, context, resource):
+        if resource.get('sha256') in context.get('who_romania_new_uploads', ()):
+            who_romania_jobs.enqueue_upload_processing(resource)
+
     # IActions
     def get_actions(self):
-        return {
+        return who_romania_metrics.timed_actions({
             "user_list": who_romania_actions.user_list,
             "dataset_duplicate": who_romania_actions.dataset_duplicate,
             "package_create": who_romania_actions.package_create,
@@ -115,11 +266,19 @@ class WHORomaniaPlugin(plugins.SingletonPlugin, DefaultPermissionLabels):
             "user_show_me": who_romania_actions.user_show_me,
             "lambda_invoke": who_romania_actions.lambda_invoke,
             "lambda_logs": who_romania_actions.lambda_logs,
-        }
+            "lambda_invocation_show": who_romania_actions.lambda_invocation_show,
+            "lambda_invocation_list": who_romania_actions.lambda_invocation_list,
+            "family_medicine_aggregate": who_romania_actions.family_medicine_aggregate,
+            "user_create_batch": who_romania_actions.user_create_batch,
+        })
 
     # IAuthFunctions
     def get_auth_functions(self):
-        return {"lambda_invoke": who_romania_auth.lambda_invoke}
+        return {
+            "lambda_invoke": who_romania_auth.lambda_invoke,
+            "catalogue_export": who_romania_auth.catalogue_export,
+            "user_create_batch": who_romania_auth.user_create_batch,
+        }
 
     # IValidators
     def get_validators(self):
@@ -131,6 +290,7 @@ class WHORomaniaPlugin(plugins.SingletonPlugin, DefaultPermissionLabels):
         }
 
     # IPackageContoller
+    @who_romania_metrics.timed_hook
     def after_dataset_delete(self, context, data_dict):
         package_data = toolkit.get_action("package_show")(context, data_dict)
         if package_data.get("private"):
@@ -138,57 +298,33 @@ class WHORomaniaPlugin(plugins.SingletonPlugin, DefaultPermissionLabels):
             context["package"].state = "deleted"
             who_romania_upload.add_activity(context, package_data, "changed")
 
+    @who_romania_metrics.timed_hook
     def after_dataset_update(self, context, data_dict):
         if data_dict.get("private"):
             who_romania_upload.add_activity(context, data_dict, "changed")
 
+    @who_romania_metrics.timed_hook
     def after_dataset_create(self, context, data_dict):
         if data_dict.get("private"):
             who_romania_upload.add_activity(context, data_dict, "new")
 
+    @who_romania_metrics.timed_hook
+    def before_dataset_index(self, pkg_dict):
+        return who_romania_search.index_fields(pkg_dict)
+
+    # IMiddleware
     def make_middleware(self, app, config):
-        @app.after_request
-        def apply_owasp(response):
-            response.headers["Strict-Transport-Security"] = config.get(
-                "ckanext.who_romania.strict_transport_security",
-                "max-age=31536000; preload",
-            )
-            response.headers["X-Content-Type-Options"] = config.get(
-                "ckanext.who_romania.content_type_options", "nosniff"
-            )
-            response.headers["X-Permitted-Cross-Domain-Policies"] = config.get(
-                "ckanext.who_romania.cross_domain_policies",
-                "none",  # not sure about this one
-            )
-            response.headers["Referrer-Policy"] = config.get(
-                "ckanext.who_romania.referrer_policy",
-                "no-referrer-when-downgrade",  # this is default when not set
-            )
-            response.headers["Cache-Control"] = config.get(
-                "ckanext.who_romania.cache_control",
-                "",
-            )
-            response.headers["Cross-Origin-Opener-Policy"] = config.get(
-                "ckanext.who_romania.coop", "same-site"
-            )
-            response.headers["Cross-Origin-Embedder-Policy"] = config.get(
-                "ckanext.who_romania.coep", "unsafe-none"
-            )
-            response.headers["Cross-Origin-Resource-Policy"] = config.get(
-                "ckanext.who_romania.corp", "cross-origin"
-            )
-            response.headers["Content-Security-Policy"] = config.get(
-                "ckanext.who_romania.content_security_policy", ""
-            )
-            if ("Location" in response.headers) and (
-                "logged_out_redirect" in response.headers["Location"]
-            ):
-                response.headers["Clear-Site-Data"] = '"*"'
-            return response
-
-        return app
+        app = who_romania_static.apply_precompressed(app, who_romania_static.static_directories())
+        app = who_romania_middleware.apply_conditional_get(app, config)
+        app = who_romania_middleware.apply_profiling(app, config)
+        return who_romania_middleware.apply_response_headers(app, config)
+
+    # IClick
+    def get_commands(self):
+        return [who_romania_cli.who_romania]
 
     # IAuthenticator
+    @who_romania_metrics.timed_hook
     def identify(self):
         """
         Allows API requests to be sent "on behalf" of a substitute user. This is
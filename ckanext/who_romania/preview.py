@@ -0,0 +1,101 @@
+import itertools
+import logging
+import shutil
+import tempfile
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+import ckanext.who_romania.tabular as tabular
+import ckanext.who_romania.upload as who_romania_upload
+from ckanext.who_romania.model import ResourcePreview
+
+
+log = logging.getLogger(__name__)
+
+# XLSX files are zip archives, so need spooling to a seekable file, and
+# larger ones than ckanext.who_romania.preview_max_xlsx_size aren't previewed
+SPOOL_SIZE = 10 * 1024 * 1024
+
+
+def is_previewable(resource):
+    resource_format = _format(resource)
+    if not resource.get('sha256') or resource_format not in ('csv', 'xlsx'):
+        return False
+    if resource_format == 'xlsx':
+        max_size = toolkit.config.get('ckanext.who_romania.preview_max_xlsx_size')
+        return (resource.get('size') or 0) <= max_size
+    return True
+
+
+def preview_resource(context, resource):
+    """
+    Stores a preview of an uploaded CSV or XLSX file, unless its blob has
+    already been previewed.  Only the first rows of the file are read.
+    """
+    if ResourcePreview.get(resource['sha256']):
+        return
+    preview_rows = toolkit.config.get('ckanext.who_romania.preview_rows')
+    if _format(resource) == 'xlsx':
+        with who_romania_upload.open_giftless_resource(context, resource, encoding=None) as blob:
+            header, rows = _xlsx_rows(blob, preview_rows)
+    else:
+        with who_romania_upload.open_giftless_resource(context, resource) as report:
+            header, chunks = tabular.csv_chunks(report, preview_rows + 1)
+            rows = next(chunks, [])
+    if header is None:
+        return
+    truncated = len(rows) > preview_rows
+    rows = rows[:preview_rows]
+    columns = list(zip(*rows)) or [()] * len(header)
+    model.Session.merge(ResourcePreview(
+        sha256=resource['sha256'],
+        schema={'fields': [
+            {'name': name, 'type': tabular.infer_field_type(values)}
+            for name, values in zip(header, columns)
+        ]},
+        rows=rows,
+        truncated=truncated
+    ))
+    model.Session.commit()
+    log.info(f"Stored a preview of {resource['id']}")
+
+
+def get_resource_preview(resource):
+    """Returns the stored preview of a resource's blob, if there is one"""
+    if not resource.get('sha256'):
+        return None
+    preview = ResourcePreview.get(resource['sha256'])
+    return preview.as_dict() if preview else None
+
+
+def _xlsx_rows(blob, preview_rows):
+    try:
+        import openpyxl
+    except ImportError:
+        log.warning("openpyxl is not installed, XLSX files can't be previewed")
+        return None, []
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spooled:
+        shutil.copyfileobj(blob, spooled)
+        spooled.seek(0)
+        workbook = openpyxl.load_workbook(spooled, read_only=True, data_only=True)
+        try:
+            values = workbook.active.iter_rows(max_row=preview_rows + 2, values_only=True)
+            rows = [
+                ['' if value is None else str(value) for value in row]
+                for row in values
+                if any(value is not None for value in row)
+            ]
+        finally:
+            workbook.close()
+    header = [column.strip() for column in rows[0]] if rows else []
+    return header, [
+        (row + [''] * len(header))[:len(header)]
+        for row in itertools.islice(rows, 1, None)
+    ]
+
+
+def _format(resource):
+    resource_format = (resource.get('format') or '').lower()
+    if not resource_format:
+        resource_format = (resource.get('url') or '').rsplit('.', 1)[-1].lower()
+    return resource_format
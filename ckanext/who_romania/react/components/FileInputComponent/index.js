@@ -13,7 +13,8 @@ const
   maxResourceSize = parseInt(getAttr('maxResourceSize')),
   lfsServer = getAttr('lfsServer'),
   orgId = getAttr('orgId'),
-  datasetName = getAttr('datasetName');
+  datasetName = getAttr('datasetName'),
+  frictionlessUrl = getAttr('frictionlessUrl');
 
 const existingResourceData = {
   urlType: getAttr('existingUrlType'),
@@ -29,7 +30,7 @@ window.addEventListener('load', function () {
     <App {...{
       loadingHtml,
       maxResourceSize, lfsServer, orgId,
-      datasetName, existingResourceData
+      datasetName, frictionlessUrl, existingResourceData
     }} />,
     componentElement
   );
@@ -5,7 +5,7 @@ import UrlUploader from './UrlUploader';
 import FileUploader from './FileUploader';
 import HiddenFormInputs from './HiddenFormInputs';
 
-export default function App({ loadingHtml, maxResourceSize, lfsServer, orgId, datasetName, existingResourceData }) {
+export default function App({ loadingHtml, maxResourceSize, lfsServer, orgId, datasetName, frictionlessUrl, existingResourceData }) {
 
     const defaultUploadProgress = { loaded: 0, total: 0 };
     const [uploadMode, setUploadMode] = useState();
@@ -110,7 +110,7 @@ export default function App({ loadingHtml, maxResourceSize, lfsServer, orgId, da
         return (
             [undefined, null, 'file'].includes(uploadMode)
                 ? <FileUploader {...{
-                    maxResourceSize, lfsServer, orgId, datasetName,
+                    maxResourceSize, lfsServer, orgId, datasetName, frictionlessUrl,
                     setUploadProgress, setUploadFileName,
                     setHiddenInputs, setUploadError
                 }} />
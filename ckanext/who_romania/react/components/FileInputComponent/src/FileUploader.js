@@ -2,9 +2,10 @@ import React from 'react';
 import { useDropzone } from 'react-dropzone'
 import axios from 'axios';
 import { Client } from "giftless-client";
+import loadFrictionless from './loadFrictionless';
 
 export default function FileUploader({
-    maxResourceSize, lfsServer, orgId, datasetName,
+    maxResourceSize, lfsServer, orgId, datasetName, frictionlessUrl,
     setUploadProgress, setUploadFileName, setHiddenInputs,
     setUploadError
 }) {
@@ -42,10 +43,21 @@ export default function FileUploader({
                 throw error;
             });
 
+    const openFile = inputFile =>
+        loadFrictionless(frictionlessUrl)
+            .then(data => data.open(inputFile))
+            .catch(error => {
+                setUploadError({
+                    error: ckan.i18n._('Network Error'),
+                    description: ckan.i18n._('The file uploader could not be loaded.')
+                });
+                throw error;
+            });
+
     const handleFileSelected = async inputFile => {
         if (!inputFile) return;
         setUploadProgress({ loaded: 0, total: 1 });
-        const file = data.open(inputFile);
+        const file = await openFile(inputFile);
         const authToken = await getAuthToken();
         console.log(authToken);
         const client = new Client(lfsServer, authToken, ['basic']);
@@ -62,6 +74,8 @@ export default function FileUploader({
     const { getRootProps, getInputProps, open } = useDropzone({
         multiple: false,
         noClick: true,
+        // start fetching frictionless-js while the user drags the file in
+        onDragEnter: () => loadFrictionless(frictionlessUrl).catch(() => null),
         maxSize: maxResourceSize * 1000000,
         onDrop: acceptedFiles =>
             handleFileSelected(acceptedFiles[0]),
@@ -92,6 +106,7 @@ export default function FileUploader({
             label: ckan.i18n._('Upload a file'),
             icon: 'fa-cloud-upload',
             onClick: e => {
+                loadFrictionless(frictionlessUrl).catch(() => null);
                 open(e);
                 e.preventDefault();
             }
@@ -0,0 +1,21 @@
+let frictionless;
+
+// frictionless-js is a large library, so it is fetched from its own
+// bundle once a file is picked rather than with the upload widget
+export default function loadFrictionless(url) {
+    if (window.data) return Promise.resolve(window.data);
+    if (!frictionless) {
+        frictionless = new Promise((resolve, reject) => {
+            const script = document.createElement('script');
+            script.src = url;
+            script.async = true;
+            script.onload = () => resolve(window.data);
+            script.onerror = () => {
+                frictionless = undefined;
+                reject(new Error(`Could not load ${url}`));
+            };
+            document.head.appendChild(script);
+        });
+    }
+    return frictionless;
+}
@@ -0,0 +1,29 @@
+import loadFrictionless from './loadFrictionless';
+
+describe('loadFrictionless', () => {
+
+  const frictionless = global.data;
+  afterEach(() => {
+    global.data = frictionless;
+    document.head.innerHTML = '';
+  });
+
+  test('uses frictionless-js if already loaded', async () => {
+    await expect(loadFrictionless('/frictionless.js')).resolves.toBe(frictionless);
+    expect(document.head.querySelector('script')).toBeNull();
+  });
+
+  test('fetches the frictionless-js bundle once', async () => {
+    delete global.data;
+    const first = loadFrictionless('/frictionless.js');
+    const second = loadFrictionless('/frictionless.js');
+    const scripts = document.head.querySelectorAll('script');
+    expect(scripts).toHaveLength(1);
+    expect(scripts[0].src).toContain('/frictionless.js');
+    global.data = frictionless;
+    scripts[0].onload();
+    await expect(first).resolves.toBe(frictionless);
+    await expect(second).resolves.toBe(frictionless);
+  });
+
+});
@@ -0,0 +1,87 @@
+import json
+import logging
+from datetime import datetime
+
+from ckan.plugins import toolkit
+
+
+log = logging.getLogger(__name__)
+
+# Typed copies of the schema fields written to the search index, so that
+# ranges, approval filters and doctor facets can be queried in Solr.  The
+# names follow the dynamic fields of CKAN's Solr schema: *_date is a date,
+# vocab_* a multi-valued string and anything else a single string.
+MONTH_FIELD = 'month_date'
+WEEKS_FIELD = 'vocab_weeks'
+FAMILY_DOCTORS_FIELD = 'vocab_family_doctors'
+APPROVAL_FIELD = 'approval'
+
+SOLR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def index_fields(pkg_dict):
+    """
+    Adds the typed fields to a dataset about to be indexed:
+
+    - month_date, the first day of the dataset's month, e.g.
+      ``month_date:[NOW/MONTH-6MONTHS TO NOW]``
+    - vocab_weeks, the ISO dates of its weekly reports, e.g.
+      ``vocab_weeks:[2023-09-01 TO 2023-09-30]``
+    - vocab_family_doctors, the doctors with reports, for facets and
+      ``vocab_family_doctors:SERBAN``
+    - approval, as ``true`` or ``false``, whatever the form submitted
+
+    Resource fields are read from the validated dataset, as core only
+    indexes the resource extras named in its config.
+    """
+    month = _month_date(pkg_dict.get('month'))
+    if month:
+        pkg_dict[MONTH_FIELD] = month
+    approval = _approval(pkg_dict.get(APPROVAL_FIELD))
+    if approval:
+        pkg_dict[APPROVAL_FIELD] = approval
+    resources = _validated_resources(pkg_dict)
+    weeks = sorted({
+        week for week in (_week_date(resource.get('week')) for resource in resources) if week
+    })
+    if weeks:
+        pkg_dict[WEEKS_FIELD] = weeks
+    family_doctors = sorted({
+        resource['family_doctor'] for resource in resources if resource.get('family_doctor')
+    })
+    if family_doctors:
+        pkg_dict[FAMILY_DOCTORS_FIELD] = family_doctors
+    return pkg_dict
+
+
+def _validated_resources(pkg_dict):
+    try:
+        validated = json.loads(pkg_dict.get('validated_data_dict') or '{}')
+    except ValueError:
+        return []
+    return [resource for resource in validated.get('resources') or [] if isinstance(resource, dict)]
+
+
+def _month_date(month):
+    try:
+        return datetime.strptime(month, '%Y-%m').strftime(SOLR_DATE_FORMAT)
+    except (TypeError, ValueError):
+        if month:
+            log.warning(f"Not indexing invalid month {month}")
+        return None
+
+
+def _approval(approval):
+    if approval in (None, ''):
+        return None
+    try:
+        return 'true' if toolkit.asbool(approval) else 'false'
+    except ValueError:
+        return None
+
+
+def _week_date(week):
+    try:
+        return datetime.strptime(week, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,124 @@
+import gzip
+import logging
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_file
+
+from ckan.lib.webassets_tools import get_webassets_path
+
+
+log = logging.getLogger(__name__)
+
+PUBLIC_DIRECTORY = os.path.join(os.path.dirname(__file__), 'public')
+
+# Fonts and images are compressed formats already
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.svg', '.json', '.map', '.ico', '.ttf', '.txt')
+
+# Content codings, most preferred first, and their file extensions
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def static_directories():
+    """
+    The directories of static files to precompress, as (URL prefix, path)
+    pairs: the extension's public files and the built webassets bundles.
+    """
+    return [('/', PUBLIC_DIRECTORY), ('/webassets', get_webassets_path())]
+
+
+def compress_directory(directory):
+    """
+    Writes brotli and gzip compressed copies of the compressible files in a
+    directory, next to the originals.  Copies that wouldn't be smaller are
+    skipped, as are those already up to date.  Brotli copies need the
+    brotli package.
+
+    Returns the number of copies written.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        log.warning("brotli is not installed, only gzip copies will be written")
+    written = 0
+    for path in _files(directory):
+        if not path.endswith(COMPRESSIBLE_EXTENSIONS):
+            continue
+        with open(path, 'rb') as original:
+            content = original.read()
+        compressors = {'gzip': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli:
+            compressors['br'] = lambda data: brotli.compress(data, quality=11)
+        for encoding, extension in ENCODINGS:
+            if encoding not in compressors:
+                continue
+            target = path + extension
+            if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                continue
+            compressed = compressors[encoding](content)
+            if len(compressed) >= len(content):
+                continue
+            with open(target + '.tmp', 'wb') as copy:
+                copy.write(compressed)
+            shutil.move(target + '.tmp', target)
+            written += 1
+    return written
+
+
+def precompressed_index(directories):
+    """
+    Maps the URL paths of files with compressed copies to the copies' paths
+    by content coding, for directories given as (URL prefix, path) pairs.
+    """
+    index = {}
+    for url_prefix, directory in directories:
+        for path in _files(directory):
+            for encoding, extension in ENCODINGS:
+                original = path[:-len(extension)]
+                if path.endswith(extension) and os.path.exists(original):
+                    url_path = url_prefix.rstrip('/') + '/' + os.path.relpath(original, directory).replace(os.sep, '/')
+                    index.setdefault(url_path, {})[encoding] = path
+    return index
+
+
+def apply_precompressed(app, directories):
+    """
+    Serves the compressed copies of static files written by the
+    who-romania compress-assets command, to clients accepting their content
+    coding.  The copies present when the app is built are served, so the
+    command should be run before (re)starting CKAN.
+    """
+    index = precompressed_index(directories)
+    if not index:
+        return app
+
+    @app.before_request
+    def serve_precompressed():
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        variants = index.get(request.path)
+        if not variants:
+            return None
+        for encoding, _extension in ENCODINGS:
+            if encoding in variants and request.accept_encodings[encoding]:
+                response = send_file(
+                    variants[encoding],
+                    mimetype=mimetypes.guess_type(request.path)[0] or 'application/octet-stream',
+                    conditional=True
+                )
+                response.headers['Content-Encoding'] = encoding
+                response.vary.add('Accept-Encoding')
+                return response
+        return None
+
+    return app
+
+
+def _files(directory):
+    if not directory or not os.path.isdir(directory):
+        return
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            yield os.path.join(root, name)
@@ -0,0 +1,140 @@
+import csv
+import datetime
+import functools
+import itertools
+import json
+
+import ckan.plugins.toolkit as toolkit
+
+
+CHUNK_ROWS = 5000
+
+# Frictionless field types, and the PostgreSQL types they are stored as
+POSTGRES_TYPES = {
+    'string': 'text',
+    'integer': 'bigint',
+    'number': 'numeric',
+    'boolean': 'boolean',
+    'date': 'date',
+    'datetime': 'timestamp',
+}
+BOOLEAN_VALUES = {'true', 'false'}
+
+
+def is_csv_upload(resource):
+    """Whether a resource is a CSV file uploaded to giftless"""
+    return bool(resource.get('sha256')) and (
+        (resource.get('format') or '').lower() == 'csv'
+        or (resource.get('url') or '').lower().endswith('.csv')
+    )
+
+
+def csv_chunks(report, chunk_rows=None):
+    """
+    Reads a CSV file object a chunk of rows at a time, so that it can be
+    processed in bounded memory however big it is.
+
+    Returns the (stripped) header and an iterator over the chunks.  Blank
+    rows are skipped, and the other rows padded or cut to the header's
+    length.
+    """
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    reader = csv.reader(report)
+    header = [column.strip() for column in next(reader, [])]
+
+    def chunks():
+        while True:
+            chunk = [
+                (row + [''] * len(header))[:len(header)]
+                for row in itertools.islice(reader, chunk_rows)
+                if any(value.strip() for value in row)
+            ]
+            if not chunk:
+                return
+            yield chunk
+
+    return header, chunks()
+
+
+def template_schema():
+    """
+    Returns the Frictionless Table Schema describing the columns of the
+    family medicine reporting template, read from the file configured in
+    ckanext.who_romania.family_medicine_template_schema, or None if there
+    isn't one.
+    """
+    path = toolkit.config.get('ckanext.who_romania.family_medicine_template_schema')
+    return _load_schema(path) if path else None
+
+
+@functools.lru_cache(maxsize=8)
+def _load_schema(path):
+    with open(path, encoding='utf-8') as schema_file:
+        return json.load(schema_file)
+
+
+def schema_fields(schema):
+    """Returns the fields of a Table Schema by name"""
+    return {field['name']: field for field in (schema or {}).get('fields', [])}
+
+
+def aggregation_columns(schema):
+    """
+    Splits the fields of a reporting template's Table Schema into the
+    columns reports are grouped by and the columns that are summed.  Integer
+    and number fields are summed, unless they are part of the schema's
+    primaryKey, as ID-like codes are; all other fields are grouped by.
+    """
+    primary_key = schema.get('primaryKey') or []
+    if isinstance(primary_key, str):
+        primary_key = [primary_key]
+    key_columns = []
+    value_columns = []
+    for name, field in schema_fields(schema).items():
+        if field.get('type') in ('integer', 'number') and name not in primary_key:
+            value_columns.append(name)
+        else:
+            key_columns.append(name)
+    return key_columns, value_columns
+
+
+def infer_field_type(values):
+    """
+    Infers the Frictionless type of a column from a sample of its values,
+    ignoring empty ones.  Columns with no values are strings.
+    """
+    values = [value.strip() for value in values if value and value.strip()]
+    if not values:
+        return 'string'
+    for field_type in ('integer', 'number', 'boolean', 'date', 'datetime'):
+        try:
+            for value in values:
+                parse_value(value, field_type)
+        except ValueError:
+            continue
+        return field_type
+    return 'string'
+
+
+def parse_value(value, field_type):
+    """
+    Parses a value as the given Frictionless type, raising a ValueError if
+    it isn't one.  Types without a parser are left as strings.
+    """
+    parse = PARSERS.get(field_type)
+    return parse(value) if parse else value
+
+
+def _parse_boolean(value):
+    if value.lower() not in BOOLEAN_VALUES:
+        raise ValueError(value)
+    return value.lower() == 'true'
+
+
+PARSERS = {
+    'integer': int,
+    'number': float,
+    'boolean': _parse_boolean,
+    'date': datetime.date.fromisoformat,
+    'datetime': datetime.datetime.fromisoformat,
+}
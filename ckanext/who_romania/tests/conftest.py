@@ -18,3 +18,9 @@ def vcr_config():
             "solr"
         ]
     }
+
+
+@pytest.fixture
+def clean_db(reset_db, migrate_db_for):
+    reset_db()
+    migrate_db_for('who_romania')
@@ -6,6 +6,8 @@ import ckan.tests.factories as factories
 from ckan.tests.helpers import call_action
 import ckan.plugins.toolkit as toolkit
 from ckan import model
+import ckanext.who_romania.actions as who_romania_actions
+from ckanext.who_romania import executors
 
 
 @pytest.mark.ckan_config('ckan.plugins', "who_romania")
@@ -40,6 +42,65 @@ class TestListUsers():
         user_ids_found = [u['id'] for u in response]
         assert user_ids_found == [users[2]['id']]
 
+    def test_search_by_id_does_not_show_user(self):
+        user = factories.User()
+        with mock.patch('ckan.logic.action.get.user_show') as mock_user_show:
+            response = call_action('user_list', q=user['id'])
+        assert [u['id'] for u in response] == [user['id']]
+        assert not mock_user_show.called
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'who_romania')
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestUserCreateBatch(object):
+
+    def test_users_are_created(self):
+        response = call_action('user_create_batch', users=[
+            {'name': 'doctor-one', 'email': 'one@example.com', 'password': 'password1234'},
+            {'email': 'doctor.two@example.com', 'password': 'password1234'},
+        ])
+        assert response['errors'] == []
+        assert response['created'][0]['name'] == 'doctor-one'
+        assert response['created'][1]['name'].startswith('doctor-two-')
+        assert model.User.by_name(response['created'][1]['name']).email == 'doctor.two@example.com'
+
+    def test_errors_are_reported_per_user(self):
+        existing = factories.User()
+        response = call_action('user_create_batch', users=[
+            {'name': existing['name'], 'email': 'one@example.com', 'password': 'password1234'},
+            {'id': existing['id'], 'name': 'doctor-two', 'email': 'two@example.com', 'password': 'password1234'},
+            {'name': 'doctor-three', 'email': 'three@example.com', 'password': 'password1234'},
+            {'name': 'doctor-three', 'email': 'four@example.com', 'password': 'password1234'},
+            {'name': 'doctor-five', 'email': 'five@example.com'},
+            {'password': 'password1234'},
+        ])
+        assert [user['name'] for user in response['created']] == ['doctor-three']
+        assert [error['index'] for error in response['errors']] == [0, 1, 3, 4, 5]
+        assert 'name' in response['errors'][0]['errors']
+        assert 'id' in response['errors'][1]['errors']
+        assert 'name' in response['errors'][2]['errors']
+        assert 'password' in response['errors'][3]['errors']
+        assert 'email' in response['errors'][4]['errors']
+
+    def test_names_are_checked_in_one_query(self):
+        with mock.patch('ckanext.who_romania.actions._existing_values',
+                        wraps=who_romania_actions._existing_values) as mock_existing:
+            call_action('user_create_batch', users=[
+                {'email': f'doctor{i}@example.com', 'password': 'password1234'}
+                for i in range(10)
+            ])
+        # ids, names given, then the generated names
+        assert mock_existing.call_count == 3
+
+    def test_users_must_be_a_list(self):
+        with pytest.raises(toolkit.ValidationError):
+            call_action('user_create_batch', users={'email': 'one@example.com'})
+
+    def test_only_sysadmins_can_create_users_in_bulk(self):
+        user = factories.User()
+        with pytest.raises(toolkit.NotAuthorized):
+            toolkit.check_access('user_create_batch', {'user': user['name']}, {'users': []})
+
 
 @pytest.mark.ckan_config('ckan.plugins', 'who_romania')
 @pytest.mark.usefixtures('clean_db', 'with_plugins')
@@ -79,6 +140,7 @@ class TestLambda(object):
             lambda_function='WRCLambda-FamilyMedicine-8lXLORrdBUsY'
         )
         assert 'events' in response
+        assert 'records' in response
 
     def test_lambda_logs_fail(self):
         with pytest.raises(toolkit.ObjectNotFound):
@@ -97,6 +159,7 @@ class TestLambda(object):
             dataset_id="family-medicine-demo"
         )
         assert response['StatusCode'] == 202
+        assert response['status'] == 'queued'
 
     def test_lambda_invoke_fail(self):
         with pytest.raises(toolkit.ObjectNotFound):
@@ -108,3 +171,163 @@ class TestLambda(object):
                                     "6e451aa0-9105-458f-a065-663f7e4fbed0/download/6.xlsx"),
                 dataset_id="family-medicine-demo"
             )
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'who_romania')
+@pytest.mark.ckan_config('ckanext.who_romania.lambda_invoke_users', 'invoker')
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+@mock.patch('ckanext.who_romania.actions.aws.call')
+class TestLambdaInvocations(object):
+
+    def _invoke(self, mock_call, request_id='request-1', dataset_id='dataset-1'):
+        mock_call.return_value = {
+            'StatusCode': 202,
+            'ResponseMetadata': {'RequestId': request_id}
+        }
+        with mock.patch('ckanext.who_romania.executors.toolkit.enqueue_job') as mock_enqueue_job:
+            invocation = call_action(
+                'lambda_invoke', {'user': 'invoker'},
+                lambda_function='function',
+                dataset_id=dataset_id
+            )
+        self.mock_enqueue_job = mock_enqueue_job
+        return invocation
+
+    def test_invocation_is_recorded(self, mock_call):
+        user = factories.User(name='invoker')
+        invocation = self._invoke(mock_call)
+        assert invocation['id'] == 'request-1'
+        assert invocation['lambda_function'] == 'function'
+        assert invocation['dataset_id'] == 'dataset-1'
+        assert invocation['user_id'] == user['id']
+        assert invocation['status'] == 'queued'
+
+    def test_repeat_invocation_is_coalesced(self, mock_call):
+        factories.User(name='invoker')
+        first = self._invoke(mock_call, 'request-1')
+        second = self._invoke(mock_call, 'request-2')
+        assert second['id'] == first['id']
+        assert second['coalesced']
+        assert second['StatusCode'] == 202
+        assert mock_call.call_count == 1
+
+    def test_invocations_for_other_datasets_are_not_coalesced(self, mock_call):
+        factories.User(name='invoker')
+        self._invoke(mock_call, 'request-1', 'dataset-1')
+        second = self._invoke(mock_call, 'request-2', 'dataset-2')
+        assert second['id'] == 'request-2'
+        assert not second['coalesced']
+
+    @pytest.mark.ckan_config('ckanext.who_romania.lambda_coalesce_mode', 'reject')
+    def test_repeat_invocation_is_rejected(self, mock_call):
+        factories.User(name='invoker')
+        self._invoke(mock_call, 'request-1')
+        with pytest.raises(toolkit.ValidationError):
+            self._invoke(mock_call, 'request-2')
+
+    @pytest.mark.ckan_config('ckanext.who_romania.lambda_timeout', 100)
+    def test_invocations_past_their_timeout_are_not_coalesced(self, mock_call):
+        factories.User(name='invoker')
+        with freeze_time(datetime.datetime.utcnow() - datetime.timedelta(seconds=200)):
+            self._invoke(mock_call, 'request-1')
+        assert self._invoke(mock_call, 'request-2')['id'] == 'request-2'
+
+    @pytest.mark.ckan_config('ckanext.who_romania.lambda_coalesce_window', 0)
+    def test_coalescing_disabled(self, mock_call):
+        factories.User(name='invoker')
+        self._invoke(mock_call, 'request-1')
+        assert self._invoke(mock_call, 'request-2')['id'] == 'request-2'
+
+    def test_invocation_is_tracked(self, mock_call):
+        factories.User(name='invoker')
+        invocation = self._invoke(mock_call)
+        args = self.mock_enqueue_job.call_args[0]
+        assert args[0] is executors.track_invocation
+        assert args[1] == [invocation['id']]
+        assert self.mock_enqueue_job.call_args[1]['queue'] == 'who_romania_lambda'
+
+    @mock.patch('ckanext.who_romania.actions.aws.invocation_log_stream')
+    def test_invocation_show_is_read_only(self, mock_log_stream, mock_call):
+        factories.User(name='invoker')
+        self._invoke(mock_call)
+        invocation = call_action('lambda_invocation_show', {'user': 'invoker'}, id='request-1')
+        assert invocation['status'] == 'queued'
+        assert not mock_log_stream.called
+
+    def test_invocation_not_found(self, mock_call):
+        factories.User(name='invoker')
+        with pytest.raises(toolkit.ObjectNotFound):
+            call_action('lambda_invocation_show', {'user': 'invoker'}, id='missing')
+
+    def test_invocation_list(self, mock_call):
+        factories.User(name='invoker')
+        self._invoke(mock_call, 'request-1', 'dataset-1')
+        self._invoke(mock_call, 'request-2', 'dataset-2')
+        invocations = call_action('lambda_invocation_list', {'user': 'invoker'}, dataset_id='dataset-2')
+        assert [i['id'] for i in invocations] == ['request-2']
+
+    @mock.patch('ckanext.who_romania.actions.aws.log_events')
+    @mock.patch('ckanext.who_romania.actions.aws.invocation_log_stream', return_value='stream-1')
+    def test_logs_for_tracked_invocation(self, mock_log_stream, mock_log_events, mock_call):
+        factories.User(name='invoker')
+        self._invoke(mock_call)
+        mock_log_events.return_value = ([
+            {'timestamp': 1, 'message': 'START RequestId: request-0 Version: $LATEST'},
+            {'timestamp': 2, 'message': '[INFO]\t-\trequest-0\tOther run'},
+            {'timestamp': 3, 'message': 'REPORT RequestId: request-0\tDuration: 1 ms'},
+            {'timestamp': 4, 'message': 'START RequestId: request-1 Version: $LATEST'},
+            {'timestamp': 5, 'message': '[INFO]\t-\trequest-1\tThis run'},
+            {'timestamp': 6, 'message': 'printed by this run'},
+            {'timestamp': 7, 'message': 'REPORT RequestId: request-1\tDuration: 1 ms'},
+        ], 'f/1')
+        executors.track_invocation('request-1')
+        response = call_action(
+            'lambda_logs', {'user': 'invoker'},
+            invocation_id='request-1',
+            start_time=0
+        )
+        messages = [r['message'] for r in response['records'] if r['level'] not in ('START', 'REPORT')]
+        assert messages == ['This run', 'printed by this run']
+        assert [e['timestamp'] for e in response['events']] == [4, 5, 6, 7]
+        assert response['invocation']['status'] == 'completed'
+        assert response['invocation']['log_stream_name'] == 'stream-1'
+
+    def test_limited_logs_for_invocation(self, mock_call):
+        factories.User(name='invoker')
+        self._invoke(mock_call)
+        invocation = who_romania_actions.LambdaInvocation.get('request-1')
+        invocation.log_stream_name = 'stream-1'
+        model.Session.commit()
+        # Read backwards, the lines printed by this run only belong to it
+        # once its START line, on the older page, has been read
+        pages = [
+            {'events': [
+                {'timestamp': 5, 'message': 'printed first'},
+                {'timestamp': 6, 'message': 'printed second'},
+            ], 'nextForwardToken': 'f/2', 'nextBackwardToken': 'b/1'},
+            {'events': [
+                {'timestamp': 1, 'message': 'START RequestId: request-0 Version: $LATEST'},
+                {'timestamp': 2, 'message': 'REPORT RequestId: request-0\tDuration: 1 ms'},
+                {'timestamp': 4, 'message': 'START RequestId: request-1 Version: $LATEST'},
+            ], 'nextForwardToken': 'f/1', 'nextBackwardToken': 'b/0'},
+        ]
+        mock_call.side_effect = lambda service, operation, **kwargs: pages.pop(0)
+        response = call_action(
+            'lambda_logs', {'user': 'invoker'},
+            invocation_id='request-1',
+            start_time=0,
+            limit=2
+        )
+        assert [r['message'] for r in response['records']] == ['printed first', 'printed second']
+        assert all(r['request_id'] == 'request-1' for r in response['records'])
+        assert not pages
+
+    @pytest.mark.ckan_config('ckanext.who_romania.lambda_timeout', 0)
+    @mock.patch('ckanext.who_romania.executors.TRACK_GRACE_PERIOD', 0)
+    @mock.patch('ckanext.who_romania.actions.aws.invocation_log_stream', return_value=None)
+    def test_unreported_invocation_fails(self, mock_log_stream, mock_call):
+        factories.User(name='invoker')
+        self._invoke(mock_call)
+        executors.track_invocation('request-1')
+        invocation = call_action('lambda_invocation_show', {'user': 'invoker'}, id='request-1')
+        assert invocation['status'] == 'failed'
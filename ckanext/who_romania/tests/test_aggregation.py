@@ -0,0 +1,173 @@
+import contextlib
+import io
+
+import mock
+import pytest
+import ckan.plugins.toolkit as toolkit
+from ckan.tests import factories
+from ckan.tests.helpers import call_action
+from ckanext.who_romania import aggregation
+from ckanext.who_romania.tests import get_context
+
+WEEK_1 = "indicator,age_group,consultations,referrals\nflu,0-5,3,1\nflu,6-18,2,0\nflu,0-5,1,1\n"
+WEEK_2 = "indicator,age_group,consultations,referrals\nflu,0-5,4,2\ncovid,6-18,1,\n"
+SCHEMA = {
+    'fields': [
+        {'name': 'indicator', 'type': 'string'},
+        {'name': 'age_group', 'type': 'string'},
+        {'name': 'consultations', 'type': 'integer'},
+        {'name': 'referrals', 'type': 'integer'},
+    ]
+}
+KEY_COLUMNS = ['indicator', 'age_group']
+VALUE_COLUMNS = ['consultations', 'referrals']
+
+
+def _aggregate_report(text, key_columns=KEY_COLUMNS, value_columns=VALUE_COLUMNS):
+    return aggregation.aggregate_report(io.StringIO(text), key_columns, value_columns)
+
+
+class TestAggregateReport():
+
+    def test_value_columns_are_summed_by_key_columns(self):
+        aggregated = _aggregate_report(WEEK_1)
+        assert aggregated['key_columns'] == ['indicator', 'age_group']
+        assert aggregated['value_columns'] == ['consultations', 'referrals']
+        assert aggregated['totals'] == [['flu', '0-5', 4, 2], ['flu', '6-18', 2, 0]]
+        assert aggregated['row_count'] == 3
+
+    @mock.patch('ckanext.who_romania.aggregation.CHUNK_ROWS', 1)
+    def test_report_is_read_in_chunks(self):
+        aggregated = _aggregate_report(WEEK_1)
+        assert aggregated['totals'] == [['flu', '0-5', 4, 2], ['flu', '6-18', 2, 0]]
+
+    @mock.patch('ckanext.who_romania.aggregation.CHUNK_ROWS', 1)
+    def test_non_numeric_value_in_numeric_column(self):
+        with pytest.raises(ValueError, match="column consultations, row 3"):
+            _aggregate_report("indicator,consultations\nflu,3\nflu,three\n", ['indicator'], ['consultations'])
+
+    def test_empty_report(self):
+        aggregated = _aggregate_report("indicator,consultations\n", ['indicator'], ['consultations'])
+        assert aggregated['totals'] == []
+
+    def test_numeric_key_columns_are_grouped_by(self):
+        aggregated = _aggregate_report(
+            "doctor_code,consultations\n101,3\n102,2\n101,1\n", ['doctor_code'], ['consultations']
+        )
+        assert aggregated['totals'] == [['101', 4], ['102', 2]]
+
+    @mock.patch('ckanext.who_romania.aggregation.CHUNK_ROWS', 1)
+    def test_columns_dont_depend_on_the_values(self):
+        aggregated = _aggregate_report("indicator,age_group,consultations,referrals\nflu,,3,\nflu,0-5,1,2\n")
+        assert aggregated['key_columns'] == KEY_COLUMNS
+        assert aggregated['value_columns'] == VALUE_COLUMNS
+        assert aggregated['totals'] == [['flu', '', 3, 0], ['flu', '0-5', 1, 2]]
+
+    def test_missing_columns(self):
+        aggregated = _aggregate_report("indicator,consultations\nflu,3\n")
+        assert aggregated['totals'] == [['flu', '', 3, 0]]
+
+
+class TestMergePartials():
+
+    def test_totals_are_merged(self):
+        merged = aggregation.merge_partials([
+            _aggregate_report(WEEK_1),
+            _aggregate_report(WEEK_2),
+        ])
+        assert merged['columns'] == ['indicator', 'age_group', 'consultations', 'referrals']
+        assert merged['rows'] == [
+            ['flu', '0-5', 8, 4],
+            ['flu', '6-18', 2, 0],
+            ['covid', '6-18', 1, 0],
+        ]
+
+    def test_columns_are_matched_by_name(self):
+        merged = aggregation.merge_partials([
+            {'key_columns': ['indicator'], 'value_columns': ['a'], 'totals': [['flu', 1]]},
+            {'key_columns': ['age_group', 'indicator'], 'value_columns': ['b', 'a'],
+             'totals': [['0-5', 'flu', 2, 3]]},
+        ])
+        assert merged['columns'] == ['indicator', 'age_group', 'a', 'b']
+        assert merged['rows'] == [['flu', '', 1, 0], ['flu', '0-5', 3, 2]]
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+@mock.patch('ckanext.who_romania.aggregation.tabular.template_schema', return_value=SCHEMA)
+class TestFamilyMedicineAggregate():
+
+    def _dataset(self, user, reports):
+        dataset = factories.Dataset(user=user)
+        for day, (sha256, report) in enumerate(reports.items(), 1):
+            factories.Resource(
+                package_id=dataset['id'],
+                url=f"{sha256}.csv",
+                format='CSV',
+                sha256=sha256,
+                size=len(report),
+                family_doctor='SERBAN',
+                week=f'2023-09-{day:02d}'
+            )
+        return dataset
+
+    def _aggregate(self, user, dataset, reports):
+        opened = []
+
+        @contextlib.contextmanager
+        def open_report(context, resource):
+            opened.append(resource['sha256'])
+            yield io.StringIO(reports[resource['sha256']])
+
+        with mock.patch.object(aggregation.who_romania_upload, 'open_giftless_resource', open_report):
+            result = call_action('family_medicine_aggregate', get_context(user['name']), id=dataset['id'])
+        return result, opened
+
+    def test_only_changed_reports_are_read(self, mock_template_schema):
+        user = factories.Sysadmin()
+        reports = {'week-1': WEEK_1, 'week-2': WEEK_2}
+        dataset = self._dataset(user, reports)
+        first, opened = self._aggregate(user, dataset, reports)
+        assert sorted(opened) == ['week-1', 'week-2']
+        assert first['reports_read'] == 2
+
+        resource = call_action('package_show', id=dataset['id'])['resources'][1]
+        reports['week-2-corrected'] = WEEK_1
+        call_action('resource_patch', id=resource['id'], sha256='week-2-corrected')
+        second, opened = self._aggregate(user, dataset, reports)
+        assert opened == ['week-2-corrected']
+        assert (second['reports_read'], second['reports_cached']) == (1, 1)
+        assert second['rows'] == [['flu', '0-5', 8, 4], ['flu', '6-18', 4, 0]]
+
+    def test_deleted_reports_are_dropped(self, mock_template_schema):
+        user = factories.Sysadmin()
+        reports = {'week-1': WEEK_1, 'week-2': WEEK_2}
+        dataset = self._dataset(user, reports)
+        self._aggregate(user, dataset, reports)
+        resource = call_action('package_show', id=dataset['id'])['resources'][1]
+        call_action('resource_delete', id=resource['id'])
+        result, opened = self._aggregate(user, dataset, reports)
+        assert opened == []
+        assert result['rows'] == [['flu', '0-5', 4, 2], ['flu', '6-18', 2, 0]]
+
+    def test_other_csvs_are_not_aggregated(self, mock_template_schema):
+        user = factories.Sysadmin()
+        reports = {'week-1': WEEK_1, 'output': WEEK_2}
+        dataset = self._dataset(user, {'week-1': WEEK_1})
+        factories.Resource(
+            package_id=dataset['id'],
+            url='output.csv',
+            format='CSV',
+            sha256='output',
+            size=len(WEEK_2)
+        )
+        result, opened = self._aggregate(user, dataset, reports)
+        assert opened == ['week-1']
+        assert result['reports_read'] == 1
+        assert result['rows'] == [['flu', '0-5', 4, 2], ['flu', '6-18', 2, 0]]
+
+    def test_template_schema_is_required(self, mock_template_schema):
+        mock_template_schema.return_value = None
+        user = factories.Sysadmin()
+        dataset = self._dataset(user, {'week-1': WEEK_1})
+        with pytest.raises(toolkit.ValidationError):
+            self._aggregate(user, dataset, {'week-1': WEEK_1})
@@ -0,0 +1,68 @@
+import pytest
+import ckan.plugins.toolkit as toolkit
+from ckan.tests import factories
+from ckan.tests.helpers import call_auth
+from ckanext.who_romania import auth
+
+
+class TestParseLambdaInvokePolicy():
+
+    def test_users_and_groups_are_parsed(self):
+        policy = auth.parse_lambda_invoke_policy({
+            'ckanext.who_romania.lambda_invoke_users': 'alice  bob',
+            'ckanext.who_romania.lambda_invoke_groups': 'analysts',
+        })
+        assert policy.users == frozenset(['alice', 'bob'])
+        assert policy.groups == frozenset(['analysts'])
+        assert policy.org_roles == frozenset()
+
+    def test_org_roles_include_higher_roles(self):
+        policy = auth.parse_lambda_invoke_policy({
+            'ckanext.who_romania.lambda_invoke_org_roles': 'who-romania:editor *:admin'
+        })
+        assert policy.org_roles == frozenset([
+            ('who-romania', 'editor'), ('who-romania', 'admin'), ('*', 'admin')
+        ])
+
+    def test_invalid_role_raises(self):
+        with pytest.raises(ValueError):
+            auth.parse_lambda_invoke_policy({
+                'ckanext.who_romania.lambda_invoke_org_roles': 'who-romania:owner'
+            })
+
+
+@pytest.mark.ckan_config('ckanext.who_romania.lambda_invoke_users', 'invoker')
+@pytest.mark.ckan_config('ckanext.who_romania.lambda_invoke_org_roles', 'who-romania:editor')
+@pytest.mark.ckan_config('ckanext.who_romania.lambda_invoke_groups', 'analysts')
+@pytest.mark.usefixtures('clean_db', 'with_plugins', 'with_request_context')
+class TestLambdaInvoke():
+
+    def _can_invoke(self, user):
+        try:
+            return call_auth('lambda_invoke', {'user': user['name']})
+        except toolkit.NotAuthorized:
+            return False
+
+    def test_listed_user_can_invoke(self):
+        assert self._can_invoke(factories.User(name='invoker'))
+
+    @pytest.mark.parametrize('role, allowed', [
+        ('member', False), ('editor', True), ('admin', True)
+    ])
+    def test_organization_role(self, role, allowed):
+        user = factories.User()
+        factories.Organization(name='who-romania', users=[{'name': user['name'], 'capacity': role}])
+        assert self._can_invoke(user) == allowed
+
+    def test_other_organization_editor_cannot_invoke(self):
+        user = factories.User()
+        factories.Organization(users=[{'name': user['name'], 'capacity': 'editor'}])
+        assert not self._can_invoke(user)
+
+    def test_group_member_can_invoke(self):
+        user = factories.User()
+        factories.Group(name='analysts', users=[{'name': user['name'], 'capacity': 'member'}])
+        assert self._can_invoke(user)
+
+    def test_other_user_cannot_invoke(self):
+        assert not self._can_invoke(factories.User())
@@ -1,6 +1,10 @@
 import pytest
+import ckan.model as model
 import ckan.plugins.toolkit as toolkit
 from ckan.tests import factories
+from ckan.tests.helpers import call_action
+from ckanext.who_romania import authn
+from ckanext.who_romania.cache import MISSING
 
 
 @pytest.mark.usefixtures('clean_db', 'with_plugins')
@@ -57,3 +61,57 @@ class TestSubstituteUser():
         )
         assert response.status_code == 200
         assert response.json['result']['creator_user_id'] == substitute_user['id']
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestGetSubstituteUser():
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        authn._substitute_user_ids.clear()
+
+    def test_user_is_cached_by_id_and_name(self):
+        user = factories.User()
+        assert authn.get_substitute_user(user['name']).id == user['id']
+        assert user['id'] in authn._substitute_user_ids
+        assert user['name'] in authn._substitute_user_ids
+
+    def test_cached_user_is_attached_to_session(self):
+        user = factories.User()
+        authn.get_substitute_user(user['id'])
+        assert authn.get_substitute_user(user['id']) in model.Session
+
+    def test_cache_is_invalidated_on_update(self):
+        user = factories.User(fullname='Old Name')
+        authn.get_substitute_user(user['id'])
+        call_action('user_patch', id=user['id'], fullname='New Name')
+        assert user['id'] not in authn._substitute_user_ids
+        assert authn.get_substitute_user(user['id']).fullname == 'New Name'
+
+    def test_cached_user_is_reloaded(self):
+        user = factories.User()
+        authn.get_substitute_user(user['id'])
+        # Changed without the ORM, as another process would be
+        model.Session.execute(
+            model.user_table.update().where(model.user_table.c.id == user['id']).values(sysadmin=True)
+        )
+        model.Session.commit()
+        model.Session.remove()
+        assert authn.get_substitute_user(user['id']).sysadmin
+
+    def test_cached_name_of_renamed_user_is_dropped(self):
+        user = factories.User(name='old_name')
+        authn.get_substitute_user('old_name')
+        model.Session.execute(
+            model.user_table.update().where(model.user_table.c.id == user['id']).values(name='new_name')
+        )
+        model.Session.commit()
+        model.Session.remove()
+        assert authn.get_substitute_user('old_name') is None
+        assert authn.get_substitute_user('new_name').id == user['id']
+
+    def test_unknown_user_is_cached_until_created(self):
+        assert authn.get_substitute_user('new_user') is None
+        assert authn._substitute_user_ids.get('new_user', MISSING) is None
+        user = factories.User(name='new_user')
+        assert authn.get_substitute_user('new_user').id == user['id']
@@ -0,0 +1,195 @@
+import pytest
+import mock
+from ckanext.who_romania import aws
+
+
+class ExpiredToken(Exception):
+    response = {'Error': {'Code': 'ExpiredTokenException'}}
+
+
+@pytest.fixture(autouse=True)
+def reset_clients():
+    aws.reset_client()
+    yield
+    aws.reset_client()
+
+
+@mock.patch('boto3.session.Session')
+class TestGetClient():
+
+    def test_client_is_cached(self, mock_session):
+        client = aws.get_client('logs')
+        assert aws.get_client('logs') is client
+        mock_session.return_value.client.assert_called_once_with('logs')
+
+    def test_clients_are_per_service(self, mock_session):
+        mock_session.return_value.client.side_effect = lambda service: mock.Mock(name=service)
+        assert aws.get_client('logs') is not aws.get_client('lambda')
+
+    def test_reset_client(self, mock_session):
+        aws.get_client('logs')
+        aws.reset_client('logs')
+        aws.get_client('logs')
+        assert mock_session.return_value.client.call_count == 2
+
+
+@mock.patch('boto3.session.Session')
+class TestCall():
+
+    def test_call(self, mock_session):
+        client = mock_session.return_value.client.return_value
+        client.invoke.return_value = {'StatusCode': 202}
+        assert aws.call('lambda', 'invoke', FunctionName='test') == {'StatusCode': 202}
+        client.invoke.assert_called_once_with(FunctionName='test')
+
+    def test_expired_credentials_recreate_client(self, mock_session):
+        expired_client, new_client = mock.Mock(), mock.Mock()
+        expired_client.invoke.side_effect = ExpiredToken()
+        new_client.invoke.return_value = {'StatusCode': 202}
+        mock_session.return_value.client.side_effect = [expired_client, new_client]
+        assert aws.call('lambda', 'invoke') == {'StatusCode': 202}
+        assert aws.get_client('lambda') is new_client
+
+    def test_other_errors_are_raised(self, mock_session):
+        client = mock_session.return_value.client.return_value
+        client.invoke.side_effect = ValueError()
+        with pytest.raises(ValueError):
+            aws.call('lambda', 'invoke')
+        assert mock_session.return_value.client.call_count == 1
+
+
+@mock.patch('ckanext.who_romania.aws.call')
+class TestLogs():
+
+    def test_latest_log_stream_is_cached(self, mock_call):
+        aws._log_streams.clear()
+        mock_call.return_value = {'logStreams': [{'logStreamName': 'stream-1'}]}
+        assert aws.latest_log_stream('/aws/lambda/test') == 'stream-1'
+        assert aws.latest_log_stream('/aws/lambda/test') == 'stream-1'
+        assert mock_call.call_count == 1
+
+    def test_latest_log_stream_missing(self, mock_call):
+        aws._log_streams.clear()
+        mock_call.return_value = {'logStreams': []}
+        with pytest.raises(LookupError):
+            aws.latest_log_stream('/aws/lambda/test')
+
+    def test_log_events_pages_until_end_of_stream(self, mock_call):
+        mock_call.side_effect = [
+            {'events': [{'message': 'a'}], 'nextForwardToken': 'f/1'},
+            {'events': [{'message': 'b'}], 'nextForwardToken': 'f/2'},
+            {'events': [], 'nextForwardToken': 'f/2'},
+        ]
+        events, next_token = aws.log_events('group', 'stream')
+        assert events == [{'message': 'a'}, {'message': 'b'}]
+        assert next_token == 'f/2'
+        assert 'nextToken' not in mock_call.call_args_list[0][1]
+        assert mock_call.call_args_list[2][1]['nextToken'] == 'f/2'
+
+    def test_log_events_from_forward_token(self, mock_call):
+        mock_call.return_value = {'events': [], 'nextForwardToken': 'f/2'}
+        events, next_token = aws.log_events('group', 'stream', next_token='f/2')
+        assert (events, next_token) == ([], 'f/2')
+        assert mock_call.call_args[1]['nextToken'] == 'f/2'
+
+    def test_latest_log_events_stop_when_enough(self, mock_call):
+        mock_call.side_effect = [
+            {'events': [{'message': 'c'}], 'nextForwardToken': 'f/3', 'nextBackwardToken': 'b/2'},
+            {'events': [{'message': 'b'}], 'nextForwardToken': 'f/2', 'nextBackwardToken': 'b/1'},
+            {'events': [{'message': 'a'}], 'nextForwardToken': 'f/1', 'nextBackwardToken': 'b/0'},
+        ]
+        read = []
+
+        def enough(events):
+            read.append(events)
+            return len(events) == 2
+
+        events, next_token = aws.latest_log_events('group', 'stream', enough)
+        assert events == [{'message': 'b'}, {'message': 'c'}]
+        assert next_token == 'f/3'
+        assert mock_call.call_count == 2
+        assert mock_call.call_args_list[0][1]['startFromHead'] is False
+        assert mock_call.call_args_list[1][1]['nextToken'] == 'b/2'
+        assert read == [[{'message': 'c'}], [{'message': 'b'}, {'message': 'c'}]]
+
+    def test_latest_log_events_stop_at_start_of_stream(self, mock_call):
+        mock_call.side_effect = [
+            {'events': [{'message': 'a'}], 'nextForwardToken': 'f/1', 'nextBackwardToken': 'b/0'},
+            {'events': [], 'nextForwardToken': 'f/0', 'nextBackwardToken': 'b/0'},
+        ]
+        events, next_token = aws.latest_log_events('group', 'stream', lambda events: False)
+        assert (events, next_token) == ([{'message': 'a'}], 'f/1')
+
+
+class TestParseLogEvent():
+
+    def test_function_log_line(self):
+        record = aws.parse_log_event({
+            'timestamp': 1695738000000,
+            'message': "[ERROR]\t2023-09-26T14:20:00.000Z\tabc-123\tSomething\tfailed\n"
+        })
+        assert record == {
+            'level': 'ERROR',
+            'timestamp': 1695738000000,
+            'request_id': 'abc-123',
+            'message': 'Something\tfailed'
+        }
+
+    def test_platform_log_line(self):
+        record = aws.parse_log_event({
+            'timestamp': 1695738000000,
+            'message': "START RequestId: abc-123 Version: $LATEST\n"
+        })
+        assert record['level'] == 'START'
+        assert record['request_id'] == 'abc-123'
+        assert record['message'] == 'Version: $LATEST'
+
+    def test_printed_line(self):
+        record = aws.parse_log_event({'timestamp': 1, 'message': "printed\n"})
+        assert record == {'level': None, 'timestamp': 1, 'request_id': None, 'message': 'printed'}
+
+
+class TestFilterLogRecords():
+
+    records = [
+        {'level': 'INFO', 'timestamp': 1, 'request_id': 'a', 'message': 'one'},
+        {'level': 'ERROR', 'timestamp': 2, 'request_id': 'a', 'message': 'two'},
+        {'level': 'INFO', 'timestamp': 3, 'request_id': 'a', 'message': 'three'},
+    ]
+
+    def _messages(self, **kwargs):
+        return [r['message'] for r in aws.filter_log_records(self.records, **kwargs)]
+
+    def test_no_filters(self):
+        assert self._messages() == ['one', 'two', 'three']
+
+    def test_levels(self):
+        assert self._messages(levels=['error']) == ['two']
+
+    def test_time_window(self):
+        assert self._messages(start_time=2, end_time=2) == ['two']
+
+    def test_limit_keeps_most_recent(self):
+        assert self._messages(limit=2) == ['two', 'three']
+
+
+class TestAttributeLogRecords():
+
+    def test_records_without_request_id_are_attributed(self):
+        records = [
+            aws.parse_log_event({'timestamp': 1, 'message': message})
+            for message in [
+                "before any invocation",
+                "START RequestId: abc-123 Version: $LATEST",
+                "printed",
+                "REPORT RequestId: abc-123\tDuration: 1 ms",
+                "after the invocation",
+            ]
+        ]
+        assert aws.attribute_log_records(records) is None
+        assert [r['request_id'] for r in records] == [None, 'abc-123', 'abc-123', 'abc-123', None]
+
+    def test_running_invocation_is_returned(self):
+        records = [aws.parse_log_event({'timestamp': 1, 'message': "printed"})]
+        assert aws.attribute_log_records(records, 'abc-123') == 'abc-123'
+        assert records[0]['request_id'] == 'abc-123'
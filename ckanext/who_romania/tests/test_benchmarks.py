@@ -0,0 +1,45 @@
+from ckanext.who_romania.benchmarks import data, runner
+
+
+class TestData():
+
+    def test_datasets_are_deterministic(self):
+        assert data.make_datasets(count=2, resources=3) == data.make_datasets(count=2, resources=3)
+
+    def test_datasets_have_resources_and_tags(self):
+        dataset = data.make_datasets(count=1, resources=3, tags=5)[0]
+        assert len(dataset['resources']) == 3
+        assert len(dataset['tags']) == 5
+
+
+class TestRunner():
+
+    def test_measure(self):
+        def setup():
+            yield lambda: sum(range(100))
+
+        result = runner.measure(runner.contextlib.contextmanager(setup), repeat=3)
+        assert result['min'] <= result['median']
+        assert result['loops'] >= 1
+
+    def test_compare_flags_regressions(self):
+        baseline = {
+            'slower': {'min': 1.0, 'peak_memory': 100},
+            'bigger': {'min': 1.0, 'peak_memory': 100},
+            'same': {'min': 1.0, 'peak_memory': 100},
+        }
+        results = {
+            'slower': {'min': 1.5, 'peak_memory': 100},
+            'bigger': {'min': 1.0, 'peak_memory': 200},
+            'same': {'min': 1.1, 'peak_memory': 110},
+            'new': {'min': 1.0, 'peak_memory': 100},
+        }
+        assert runner.compare(results, baseline, tolerance=0.25) == [
+            ('slower', 'min', 1.5),
+            ('bigger', 'peak_memory', 2.0),
+        ]
+
+    def test_baseline_round_trip(self, tmp_path):
+        path = str(tmp_path / 'baseline.json')
+        runner.save_baseline(path, {'benchmark': {'min': 1.0}})
+        assert runner.load_baseline(path) == {'benchmark': {'min': 1.0}}
@@ -0,0 +1,34 @@
+import mock
+from ckanext.who_romania.cache import TTLCache
+
+
+class TestTTLCache():
+
+    def test_get_and_set(self):
+        cache = TTLCache(ttl=60)
+        cache.set('key', 'value')
+        assert cache.get('key') == 'value'
+        assert cache.get('missing', 'default') == 'default'
+
+    @mock.patch('ckanext.who_romania.cache.time.monotonic')
+    def test_entries_expire(self, mock_monotonic):
+        cache = TTLCache(ttl=60)
+        mock_monotonic.return_value = 0
+        cache.set('key', 'value')
+        mock_monotonic.return_value = 61
+        assert 'key' not in cache
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(ttl=60, maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert 'a' in cache
+        assert 'b' not in cache
+
+    def test_none_can_be_cached(self):
+        cache = TTLCache(ttl=60)
+        cache.set('key', None)
+        assert 'key' in cache
+        assert cache.get('key', 'default') is None
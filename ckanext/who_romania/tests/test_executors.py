@@ -0,0 +1,176 @@
+import concurrent.futures
+import json
+import logging
+import threading
+import time
+
+import mock
+import pytest
+import ckan.model as model
+from ckan.tests import factories
+from ckan.tests.helpers import call_action
+from ckan.plugins import toolkit
+from ckanext.who_romania import executors
+from ckanext.who_romania.model import LambdaInvocation
+
+log = logging.getLogger(f'{executors.HANDLER_LOGGER}.tests')
+
+LOCAL_FUNCTIONS = (
+    'function=ckanext.who_romania.tests.test_executors:handler '
+    'failing=ckanext.who_romania.tests.test_executors:failing_handler'
+)
+
+
+def handler(event, context):
+    log.info(f"Aggregating {event['dataset_id']}")
+    print("printed")
+
+
+def failing_handler(event, context):
+    raise ValueError("Bad data")
+
+
+class TestGetExecutor():
+
+    def test_default_executor(self):
+        assert executors.get_executor().name == 'aws'
+
+    @pytest.mark.ckan_config('ckanext.who_romania.lambda_executor', 'jobs')
+    def test_configured_executor(self):
+        assert isinstance(executors.get_executor(), executors.JobQueueExecutor)
+
+    @pytest.mark.ckan_config('ckanext.who_romania.lambda_executor', 'unknown')
+    def test_unknown_executor(self):
+        with pytest.raises(toolkit.ValidationError):
+            executors.get_executor()
+
+
+@pytest.mark.ckan_config('ckanext.who_romania.lambda_local_functions', LOCAL_FUNCTIONS)
+class TestLocalHandler():
+
+    def test_configured_handler(self):
+        assert executors.local_handler('function') is handler
+
+    def test_unconfigured_handler(self):
+        with pytest.raises(toolkit.ObjectNotFound):
+            executors.local_handler('other')
+
+
+@pytest.mark.ckan_config('ckanext.who_romania.lambda_executor', 'jobs')
+@pytest.mark.ckan_config('ckanext.who_romania.lambda_local_functions', LOCAL_FUNCTIONS)
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+@mock.patch('ckanext.who_romania.executors.toolkit.enqueue_job')
+class TestLocalInvocation():
+
+    def _invoke(self, lambda_function='function'):
+        factories.User(name='invoker')
+        return call_action(
+            'lambda_invoke', {'user': 'invoker'},
+            lambda_function=lambda_function,
+            dataset_id='dataset-1'
+        )
+
+    def test_invocation_is_queued(self, mock_enqueue_job):
+        invocation = self._invoke()
+        assert invocation['executor'] == 'jobs'
+        assert invocation['status'] == 'queued'
+        args = mock_enqueue_job.call_args[0]
+        assert args[0] is executors.run_local_invocation
+        assert args[1][2] == invocation['id']
+
+    def test_invocation_is_run_and_logged(self, mock_enqueue_job):
+        invocation = self._invoke()
+        executors.run_local_invocation(*mock_enqueue_job.call_args[0][1])
+        response = call_action(
+            'lambda_logs', {'user': 'invoker'},
+            invocation_id=invocation['id']
+        )
+        records = response['records']
+        assert [r['level'] for r in records] == ['START', 'INFO', None, 'END', 'REPORT']
+        assert records[1]['message'] == 'Aggregating dataset-1'
+        assert records[2]['message'] == 'printed'
+        assert {r['request_id'] for r in records} == {invocation['id']}
+        assert response['invocation']['status'] == 'completed'
+
+    def test_logs_from_token(self, mock_enqueue_job):
+        invocation = self._invoke()
+        executors.run_local_invocation(*mock_enqueue_job.call_args[0][1])
+        records, token = executors.local_log_records(invocation['id'])
+        assert executors.local_log_records(invocation['id'], token) == ([], token)
+
+    def test_failed_invocation(self, mock_enqueue_job):
+        invocation = self._invoke('failing')
+        executors.run_local_invocation(*mock_enqueue_job.call_args[0][1])
+        records, _token = executors.local_log_records(invocation['id'])
+        assert 'ValueError: Bad data' in json.dumps(records)
+        model.Session.expire_all()
+        assert LambdaInvocation.get(invocation['id']).status == 'failed'
+
+    def test_unconfigured_function_is_not_queued(self, mock_enqueue_job):
+        with pytest.raises(toolkit.ObjectNotFound):
+            self._invoke('other')
+        assert not mock_enqueue_job.called
+        assert model.Session.query(LambdaInvocation).one().status == 'failed'
+
+
+@pytest.mark.ckan_config('ckanext.who_romania.lambda_local_functions', LOCAL_FUNCTIONS)
+@mock.patch('ckanext.who_romania.executors._fail_unfinished')
+@mock.patch('ckanext.who_romania.executors.LocalProcessExecutor._get_pool')
+class TestLocalProcessExecutor():
+
+    def teardown_method(self):
+        executors.LocalProcessExecutor._running.clear()
+
+    def test_invocation_is_submitted(self, mock_get_pool, mock_fail_unfinished):
+        future = concurrent.futures.Future()
+        mock_get_pool.return_value.submit.return_value = future
+        executors.LocalProcessExecutor().invoke('function', {'dataset_id': 'dataset-1'}, 'request-1')
+        args = mock_get_pool.return_value.submit.call_args[0]
+        assert args == (
+            executors.run_local_invocation_with_timeout, 'function', {'dataset_id': 'dataset-1'}, 'request-1'
+        )
+        assert 'request-1' in executors.LocalProcessExecutor._running
+        future.set_result(None)
+        assert 'request-1' not in executors.LocalProcessExecutor._running
+        assert not mock_fail_unfinished.called
+
+    def test_crashed_invocation_is_failed(self, mock_get_pool, mock_fail_unfinished):
+        future = concurrent.futures.Future()
+        mock_get_pool.return_value.submit.return_value = future
+        executors.LocalProcessExecutor().invoke('function', {}, 'request-1')
+        future.set_exception(concurrent.futures.process.BrokenProcessPool())
+        mock_fail_unfinished.assert_called_once_with(['request-1'])
+
+    def test_running_invocations_are_failed_on_exit(self, mock_get_pool, mock_fail_unfinished):
+        mock_get_pool.return_value.submit.return_value = concurrent.futures.Future()
+        executors.LocalProcessExecutor().invoke('function', {}, 'request-1')
+        executors.LocalProcessExecutor._shutdown()
+        mock_fail_unfinished.assert_called_once_with(['request-1'])
+        assert not executors.LocalProcessExecutor._running
+
+
+class TestLocalTimeout():
+
+    @pytest.mark.ckan_config('ckanext.who_romania.lambda_local_timeout', 1)
+    @mock.patch('ckanext.who_romania.executors.run_local_invocation', side_effect=lambda *args: time.sleep(3))
+    def test_slow_invocations_are_interrupted(self, mock_run_local_invocation):
+        with pytest.raises(executors.LocalTimeout):
+            executors.run_local_invocation_with_timeout('function', {}, 'request-1')
+
+
+class TestLogRecordWriter():
+
+    @mock.patch('ckanext.who_romania.executors.LOG_FLUSH_INTERVAL', 60)
+    def test_only_the_invocations_thread_is_recorded(self):
+        writer = executors.LogRecordWriter('request-1')
+        logger = logging.getLogger(executors.HANDLER_LOGGER)
+        logger.setLevel(logging.INFO)
+        logger.addHandler(writer)
+        try:
+            log.info("Invocation")
+            other = threading.Thread(target=lambda: log.info("Other thread"))
+            other.start()
+            other.join()
+        finally:
+            logger.removeHandler(writer)
+        assert [line['message'] for line in writer._buffer] == ["Invocation"]
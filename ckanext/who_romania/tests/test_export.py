@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+
+import pytest
+import ckan.plugins.toolkit as toolkit
+from ckan.tests import factories
+from ckanext.who_romania import export
+
+
+def _export(export_format='jsonl', **filters):
+    return ''.join(export.export_lines(export_format, **filters))
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestExport():
+
+    def test_datasets_are_exported_with_resources(self):
+        organization = factories.Organization()
+        dataset = factories.Dataset(
+            owner_org=organization['id'],
+            extras=[{'key': 'month', 'value': '2023-09'}]
+        )
+        resource = factories.Resource(package_id=dataset['id'], sha256='abc', week='2023-09-08')
+        records = [json.loads(line) for line in _export().splitlines()]
+        assert len(records) == 1
+        assert records[0]['organization'] == organization['name']
+        assert records[0]['month'] == '2023-09'
+        assert records[0]['resources'] == [{
+            'id': resource['id'],
+            'name': resource['name'],
+            'url': resource['url'],
+            'format': resource['format'],
+            'size': None,
+            'sha256': 'abc',
+            'family_doctor': None,
+            'week': '2023-09-08',
+            'approval': None,
+        }]
+
+    def test_filters(self):
+        organization = factories.Organization()
+        dataset = factories.Dataset(owner_org=organization['id'])
+        factories.Dataset()
+        factories.Dataset(owner_org=organization['id'], state='deleted')
+        records = [json.loads(line) for line in _export(organization=organization['name']).splitlines()]
+        assert [record['id'] for record in records] == [dataset['id']]
+        assert _export(dataset_type='family-medicine') == ''
+
+    def test_csv_has_a_row_per_resource(self):
+        dataset = factories.Dataset()
+        factories.Resource(package_id=dataset['id'])
+        factories.Resource(package_id=dataset['id'])
+        factories.Dataset()
+        rows = list(csv.DictReader(io.StringIO(_export('csv'))))
+        assert len(rows) == 3
+        assert rows[0]['id'] == rows[1]['id'] == dataset['id']
+        assert rows[2]['resource_id'] == ''
+
+    def test_unknown_format_raises(self):
+        with pytest.raises(ValueError):
+            export.export_lines('xml')
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestExportView():
+
+    def test_sysadmins_can_export(self, app):
+        user = factories.SysadminWithToken()
+        dataset = factories.Dataset()
+        response = app.get(
+            toolkit.url_for('catalogue.export_catalogue', format='csv'),
+            headers={'Authorization': user['token']}
+        )
+        assert response.status_code == 200
+        assert dataset['id'] in response.body
+
+    def test_other_users_cannot_export(self, app):
+        user = factories.UserWithToken()
+        app.get(
+            toolkit.url_for('catalogue.export_catalogue'),
+            headers={'Authorization': user['token']},
+            status=403
+        )
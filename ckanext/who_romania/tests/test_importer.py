@@ -0,0 +1,131 @@
+import mock
+import pytest
+from ckan.tests import factories
+from ckan.tests.helpers import call_action
+from ckanext.who_romania import importer
+
+
+@pytest.fixture
+def reports(tmp_path):
+    for path in ['SERBAN/2023-09-08.csv', 'SERBAN/2023-09-15.csv', 'betcu_2023-10-06.xlsx',
+                 'notes.txt', 'unknown.csv']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text('a,b\n1,2\n')
+    return tmp_path
+
+
+class TestFindReports():
+
+    def test_reports_are_found(self, reports):
+        found = importer.find_reports(str(reports))
+        assert [(report.relative_path, report.family_doctor, report.week) for report in found] == [
+            ('SERBAN/2023-09-08.csv', 'SERBAN', '2023-09-08'),
+            ('SERBAN/2023-09-15.csv', 'SERBAN', '2023-09-15'),
+            ('betcu_2023-10-06.xlsx', 'BETCU', '2023-10-06'),
+        ]
+
+    def test_reports_are_grouped_by_month(self, reports):
+        months = importer.group_by_month(importer.find_reports(str(reports)))
+        assert list(months) == ['2023-09', '2023-10']
+        assert len(months['2023-09']) == 2
+
+
+class TestCheckpoint():
+
+    def test_round_trip(self, tmp_path):
+        path = str(tmp_path / 'checkpoint.json')
+        checkpoint = importer.Checkpoint(path)
+        checkpoint.datasets['2023-09'] = 'dataset-id'
+        checkpoint.imported['SERBAN/2023-09-08.csv'] = 'abc'
+        checkpoint.save()
+        resumed = importer.Checkpoint(path)
+        assert resumed.datasets == {'2023-09': 'dataset-id'}
+        assert resumed.imported == {'SERBAN/2023-09-08.csv': 'abc'}
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+@mock.patch('ckanext.who_romania.importer.who_romania_jobs.enqueue_upload_processing')
+@mock.patch('ckanext.who_romania.importer.who_romania_upload._get_upload_authz_token', return_value='token')
+@mock.patch('ckanext.who_romania.importer.who_romania_upload.upload_blob')
+class TestImportReports():
+
+    def _import(self, reports, organization, dataset, **kwargs):
+        with mock.patch('ckanext.who_romania.importer._month_dataset', return_value=dataset):
+            return importer.import_reports(
+                {'user': factories.Sysadmin()['name']}, str(reports), organization['id'], **kwargs
+            )
+
+    def test_reports_are_added_in_batches(self, mock_upload, mock_token, mock_enqueue, reports):
+        mock_upload.side_effect = lambda context, dataset, file_obj, filename: {
+            'url': filename, 'url_type': 'upload', 'sha256': filename, 'size': 8
+        }
+        organization = factories.Organization()
+        dataset = factories.Dataset(owner_org=organization['id'])
+        with mock.patch('ckanext.who_romania.importer.toolkit.get_action',
+                        wraps=importer.toolkit.get_action) as mock_get_action:
+            assert self._import(reports, organization, dataset, batch_size=2) == 3
+        assert [args[0] for args, _kwargs in mock_get_action.call_args_list].count('package_revise') == 2
+        resources = call_action('package_show', id=dataset['id'])['resources']
+        assert {(resource['family_doctor'], resource['week']) for resource in resources} == {
+            ('SERBAN', '2023-09-08'), ('SERBAN', '2023-09-15'), ('BETCU', '2023-10-06')
+        }
+        assert mock_upload.call_args[0][0] == {'giftless_token': 'token'}
+        assert mock_enqueue.call_count == 3
+
+    def test_token_is_fetched_per_batch(self, mock_upload, mock_token, mock_enqueue, reports):
+        mock_upload.side_effect = lambda context, dataset, file_obj, filename: {
+            'url': filename, 'url_type': 'upload', 'sha256': filename, 'size': 8
+        }
+        organization = factories.Organization()
+        dataset = factories.Dataset(owner_org=organization['id'])
+        assert self._import(reports, organization, dataset, batch_size=1) == 3
+        assert mock_token.call_count == 3
+
+    def test_import_resumes_from_checkpoint(self, mock_upload, mock_token, mock_enqueue, reports, tmp_path):
+        mock_upload.return_value = {'url': 'report.csv', 'url_type': 'upload', 'sha256': 'abc', 'size': 8}
+        checkpoint = importer.Checkpoint(str(tmp_path / 'checkpoint.json'))
+        checkpoint.imported['SERBAN/2023-09-08.csv'] = 'abc'
+        checkpoint.save()
+        organization = factories.Organization()
+        dataset = factories.Dataset(owner_org=organization['id'])
+        assert self._import(reports, organization, dataset, checkpoint_path=checkpoint.path) == 2
+        assert len(importer.Checkpoint(checkpoint.path).imported) == 3
+
+    def test_month_datasets_are_found_or_created(self, mock_upload, mock_token, mock_enqueue, reports):
+        mock_upload.side_effect = lambda context, dataset, file_obj, filename: {
+            'url': filename, 'url_type': 'upload', 'sha256': filename, 'size': 8
+        }
+        organization = factories.Organization()
+        context = {'user': factories.Sysadmin()['name']}
+        assert importer.import_reports(context, str(reports), organization['id']) == 3
+        assert context == {'user': context['user']}
+        datasets = call_action(
+            'package_search', fq=f'+owner_org:"{organization["id"]}"', include_private=True
+        )['results']
+        assert sorted(dataset['month'] for dataset in datasets) == ['2023-09', '2023-10']
+        assert {dataset['type'] for dataset in datasets} == {'family-medicine'}
+        assert len({dataset['name'] for dataset in datasets}) == 2
+
+        # Without a checkpoint, the datasets are found and their reports skipped
+        assert importer.import_reports(context, str(reports), organization['id']) == 0
+        datasets = call_action(
+            'package_search', fq=f'+owner_org:"{organization["id"]}"', include_private=True
+        )['results']
+        assert len(datasets) == 2
+        assert sum(len(dataset['resources']) for dataset in datasets) == 3
+
+    def test_reports_already_added_are_skipped(self, mock_upload, mock_token, mock_enqueue, reports, tmp_path):
+        mock_upload.side_effect = lambda context, dataset, file_obj, filename: {
+            'url': filename, 'url_type': 'upload', 'sha256': filename, 'size': 8
+        }
+        organization = factories.Organization()
+        dataset = factories.Dataset(owner_org=organization['id'])
+        # As if interrupted after adding the resource, before saving the checkpoint
+        call_action('resource_create', package_id=dataset['id'], url='2023-09-08.csv',
+                    sha256='abc', family_doctor='SERBAN', week='2023-09-08')
+        checkpoint_path = str(tmp_path / 'checkpoint.json')
+        assert self._import(reports, organization, call_action('package_show', id=dataset['id']),
+                            checkpoint_path=checkpoint_path) == 2
+        resources = call_action('package_show', id=dataset['id'])['resources']
+        assert len(resources) == 3
+        assert importer.Checkpoint(checkpoint_path).imported['SERBAN/2023-09-08.csv'] == 'abc'
@@ -0,0 +1,67 @@
+import mock
+import pytest
+from ckan.tests import factories
+from ckan.tests.helpers import call_action
+from ckanext.who_romania import jobs
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+@mock.patch('ckanext.who_romania.jobs.toolkit.enqueue_job')
+class TestUploadProcessing():
+
+    def test_new_upload_is_processed(self, mock_enqueue_job):
+        resource = factories.Resource(url='report.csv', sha256='abc', size=10)
+        mock_enqueue_job.assert_called_once_with(
+            jobs.process_upload,
+            [resource['id']],
+            title=f"Process upload {resource['id']}"
+        )
+
+    def test_links_are_not_processed(self, mock_enqueue_job):
+        factories.Resource(url='https://example.com/report.csv')
+        assert not mock_enqueue_job.called
+
+    def test_reupload_is_processed(self, mock_enqueue_job):
+        resource = factories.Resource(url='report.csv', sha256='abc', size=10)
+        call_action('resource_patch', id=resource['id'], sha256='def')
+        assert mock_enqueue_job.call_count == 2
+
+    def test_other_updates_are_not_processed(self, mock_enqueue_job):
+        resource = factories.Resource(url='report.csv', sha256='abc', size=10)
+        call_action('resource_patch', id=resource['id'], description='Updated')
+        assert mock_enqueue_job.call_count == 1
+
+    @mock.patch('ckanext.who_romania.jobs.ingest.load_weekly_report')
+    def test_weekly_reports_are_loaded(self, mock_load, mock_enqueue_job):
+        resource = factories.Resource(
+            url='report.csv', sha256='abc', size=10,
+            family_doctor='SERBAN', week='2023-09-24'
+        )
+        with mock.patch('ckanext.who_romania.jobs.plugins.plugin_loaded', return_value=True):
+            jobs.process_upload(resource['id'])
+        assert mock_load.call_args[0][1]['id'] == resource['id']
+
+    @mock.patch('ckanext.who_romania.jobs.ingest.load_weekly_report', side_effect=Exception("COPY failed"))
+    def test_ingest_failures_are_logged(self, mock_load, mock_enqueue_job):
+        resource = factories.Resource(
+            url='report.csv', sha256='abc', size=10,
+            family_doctor='SERBAN', week='2023-09-24'
+        )
+        with mock.patch('ckanext.who_romania.jobs.plugins.plugin_loaded', return_value=True), \
+                mock.patch('ckanext.who_romania.jobs.log') as mock_log:
+            jobs.process_upload(resource['id'])
+        assert mock_load.called
+        assert mock_log.exception.called
+
+    @mock.patch('ckanext.who_romania.jobs.ingest.load_weekly_report')
+    @mock.patch('ckanext.who_romania.jobs.validation.validate_resource', return_value=["Missing column"])
+    @mock.patch('ckanext.who_romania.jobs.tabular.template_schema', return_value={'fields': []})
+    def test_invalid_weekly_reports_are_not_loaded(self, mock_schema, mock_validate, mock_load, mock_enqueue_job):
+        resource = factories.Resource(
+            url='report.csv', sha256='abc', size=10,
+            family_doctor='SERBAN', week='2023-09-24'
+        )
+        with mock.patch('ckanext.who_romania.jobs.plugins.plugin_loaded', return_value=True):
+            jobs.process_upload(resource['id'])
+        assert mock_validate.called
+        assert not mock_load.called
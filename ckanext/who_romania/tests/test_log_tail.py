@@ -0,0 +1,70 @@
+import mock
+from ckanext.who_romania import log_tail
+
+
+class TestLogTail():
+
+    def test_wait_for_records_returns_records_after_position(self):
+        tail = log_tail.LogTail('group', 'stream')
+        tail.records = [{'message': str(i)} for i in range(3)]
+        events, position = tail.wait_for_records(1, timeout=0)
+        assert events == [{'message': '1'}, {'message': '2'}]
+        assert position == 3
+
+    def test_wait_for_records_times_out(self):
+        tail = log_tail.LogTail('group', 'stream')
+        assert tail.wait_for_records(0, timeout=0) == ([], 0)
+
+    def test_wait_for_records_after_buffer_trimmed(self):
+        tail = log_tail.LogTail('group', 'stream')
+        tail.records = [{'message': '5'}]
+        tail.offset = 5
+        assert tail.wait_for_records(2, timeout=0) == ([{'message': '5'}], 6)
+
+
+@mock.patch('ckanext.who_romania.log_tail.aws.log_events', return_value=([], 'f/1'))
+@mock.patch('ckanext.who_romania.log_tail.POLL_INTERVAL', 0.01)
+class TestSubscribe():
+
+    def teardown_method(self):
+        log_tail._tails.clear()
+
+    def test_subscribers_share_a_poller(self, mock_log_events):
+        first = log_tail.subscribe('function', 'stream')
+        second = log_tail.subscribe('function', 'stream')
+        assert first is second
+        assert first.subscribers == 2
+        first.unsubscribe()
+        second.unsubscribe()
+
+    def test_streams_have_separate_pollers(self, mock_log_events):
+        first = log_tail.subscribe('function', 'stream-1')
+        second = log_tail.subscribe('function', 'stream-2')
+        assert first is not second
+        first.unsubscribe()
+        second.unsubscribe()
+
+    @mock.patch('ckanext.who_romania.executors.local_log_records', return_value=([], None))
+    def test_local_invocations_have_their_own_pollers(self, mock_local_log_records, mock_log_events):
+        first = log_tail.subscribe_local('request-1')
+        second = log_tail.subscribe('function', 'request-1')
+        assert isinstance(first, log_tail.LocalLogTail)
+        assert first is not second
+        first.unsubscribe()
+        second.unsubscribe()
+
+
+class TestStreamSlots():
+
+    def teardown_method(self):
+        log_tail._open_streams = 0
+
+    def test_streams_are_limited(self):
+        assert log_tail.start_stream(2)
+        assert log_tail.start_stream(2)
+        assert not log_tail.start_stream(2)
+
+    def test_ended_streams_free_their_slot(self):
+        assert log_tail.start_stream(1)
+        log_tail.end_stream()
+        assert log_tail.start_stream(1)
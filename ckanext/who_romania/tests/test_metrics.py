@@ -0,0 +1,86 @@
+import pytest
+import ckan.plugins.toolkit as toolkit
+from ckan.tests import factories
+from ckanext.who_romania import metrics
+
+
+@pytest.fixture
+def enabled():
+    metrics.configure({'ckanext.who_romania.metrics': 'true'})
+    yield
+    metrics.configure({})
+    for histogram in metrics.HISTOGRAMS:
+        histogram.clear()
+
+
+class TestHistogram():
+
+    def test_exposition(self):
+        histogram = metrics.Histogram('test_seconds', 'Test', 'action')
+        histogram.observe('package_show', 'success', 0.003)
+        histogram.observe('package_show', 'success', 20)
+        exposition = histogram.exposition()
+        assert '# TYPE test_seconds histogram' in exposition
+        assert 'test_seconds_bucket{action="package_show",outcome="success",le="0.001"} 0' in exposition
+        assert 'test_seconds_bucket{action="package_show",outcome="success",le="0.005"} 1' in exposition
+        assert 'test_seconds_bucket{action="package_show",outcome="success",le="+Inf"} 2' in exposition
+        assert 'test_seconds_count{action="package_show",outcome="success"} 2' in exposition
+
+
+@pytest.mark.usefixtures('enabled')
+class TestTimed():
+
+    def test_outcomes_are_recorded(self):
+        def action(context, data_dict):
+            if data_dict.get('fail'):
+                raise toolkit.ValidationError({})
+            return data_dict
+
+        timed = metrics.timed_actions({'test_action': action})['test_action']
+        timed({}, {})
+        with pytest.raises(toolkit.ValidationError):
+            timed({}, {'fail': True})
+        exposition = metrics.ACTIONS.exposition()
+        assert 'count{action="test_action",outcome="success"} 1' in exposition
+        assert 'count{action="test_action",outcome="ValidationError"} 1' in exposition
+
+    def test_action_attributes_are_kept(self):
+        action = toolkit.side_effect_free(lambda context, data_dict: None)
+        assert metrics.timed(metrics.ACTIONS, 'test_action', action).side_effect_free
+
+    def test_nothing_is_recorded_when_disabled(self):
+        metrics.configure({})
+        metrics.timed(metrics.HELPERS, 'test_helper', lambda: None)()
+        assert 'test_helper' not in metrics.HELPERS.exposition()
+
+
+@pytest.mark.ckan_config('ckanext.who_romania.metrics', 'true')
+@pytest.mark.ckan_config('ckanext.who_romania.metrics_token', 'secret')
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestMetricsView():
+
+    def test_metrics_are_exposed(self, app):
+        app.get('/api/3/action/user_show_me')
+        response = app.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        assert response.status_code == 200
+        assert 'hook="identify"' in response.body
+
+    def test_token_is_required(self, app):
+        app.get('/metrics', status=403)
+
+
+@pytest.mark.ckan_config('ckanext.who_romania.metrics', 'true')
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestMetricsViewWithoutToken():
+
+    def test_anonymous_users_are_refused(self, app):
+        app.get('/metrics', status=403)
+
+    def test_users_are_refused(self, app):
+        user = factories.UserWithToken()
+        app.get('/metrics', headers={'Authorization': user['token']}, status=403)
+
+    def test_sysadmins_see_metrics(self, app):
+        user = factories.UserWithToken(sysadmin=True)
+        response = app.get('/metrics', headers={'Authorization': user['token']})
+        assert response.status_code == 200
@@ -0,0 +1,199 @@
+import flask
+import mock
+import pytest
+from ckan.tests import factories
+from ckan.tests.helpers import call_action
+import ckan.model as model
+from ckanext.who_romania import metrics, middleware
+from ckanext.who_romania.model import ResourceValidation
+
+CONFIG = {
+    "ckanext.who_romania.content_type_options": "nosniff",
+    "ckanext.who_romania.cache_control": "private",
+    "ckanext.who_romania.content_security_policy": "",
+    "ckanext.who_romania.cache_control_overrides": (
+        "/fonts/=public, max-age=31536000, immutable; /api/=no-store; /api/i18n/=public"
+    ),
+}
+
+
+@pytest.fixture
+def client():
+    app = flask.Flask(__name__)
+
+    @app.route("/<path:path>")
+    def view(path):
+        if path == "logout":
+            return flask.redirect("/user/logged_out_redirect")
+        return "ok"
+
+    return middleware.apply_response_headers(app, CONFIG).test_client()
+
+
+class TestResponseHeaders():
+
+    def test_configured_headers_are_set(self, client):
+        response = client.get("/dataset")
+        assert response.headers["X-Content-Type-Options"] == "nosniff"
+        assert response.headers["Cache-Control"] == "private"
+
+    def test_empty_headers_are_not_set(self, client):
+        assert "Content-Security-Policy" not in client.get("/dataset").headers
+
+    @pytest.mark.parametrize("path, cache_control", [
+        ("/fonts/Inter.var.woff2", "public, max-age=31536000, immutable"),
+        ("/api/3/action/package_show", "no-store"),
+        ("/api/i18n/en", "public"),
+    ])
+    def test_cache_control_overrides(self, client, path, cache_control):
+        assert client.get(path).headers["Cache-Control"] == cache_control
+
+    def test_logout_clears_site_data(self, client):
+        assert client.get("/logout").headers["Clear-Site-Data"] == '"*"'
+
+
+class TestCacheControlOverrides():
+
+    def test_malformed_entries_are_ignored(self):
+        config = {"ckanext.who_romania.cache_control_overrides": "/a/=no-store;; /b/ ;=x"}
+        assert middleware.cache_control_overrides(config) == (("/a/", "no-store"),)
+
+
+class TestConditionalGetLookups():
+
+    @pytest.fixture
+    def calls(self):
+        return []
+
+    @pytest.fixture
+    def conditional_client(self, calls):
+        app = flask.Flask(__name__)
+        app.secret_key = "secret"
+
+        @app.route("/dataset/<id>")
+        def view(id):
+            calls.append("view")
+            return "ok"
+
+        def find_validators(build, dataset_id):
+            calls.append(("lookup", build))
+            return None
+
+        with mock.patch.object(middleware, "_conditional_dataset_id", return_value="dataset-1"), \
+                mock.patch.object(middleware, "_find_validators", side_effect=find_validators):
+            yield middleware.apply_conditional_get(
+                app, {"ckanext.who_romania.etag_build": "abc123"}
+            ).test_client()
+
+    def test_unconditional_requests_look_up_the_dataset_after_rendering(self, conditional_client, calls):
+        conditional_client.get("/dataset/dataset-1")
+        assert calls == ["view", ("lookup", "abc123")]
+
+    def test_conditional_requests_look_up_the_dataset_first(self, conditional_client, calls):
+        conditional_client.get("/dataset/dataset-1", headers={"If-None-Match": '"etag"'})
+        assert calls == [("lookup", "abc123"), "view"]
+
+    def test_build_defaults_to_the_version(self):
+        with mock.patch.object(middleware.importlib.metadata, "version", return_value="1.2.3"):
+            assert middleware._package_version() == "1.2.3"
+
+
+class TestProfiling():
+
+    @pytest.fixture
+    def profiled_client(self):
+        config = {"ckanext.who_romania.profile": "true"}
+        metrics.configure(config)
+        helper = metrics.timed_helpers({"slow_helper": lambda: "ok"})["slow_helper"]
+        app = flask.Flask(__name__)
+
+        @app.route("/dataset")
+        def view():
+            return helper() + helper()
+
+        yield middleware.apply_profiling(app, config).test_client()
+        metrics.configure({})
+
+    def test_server_timing_counts_helper_calls(self, profiled_client):
+        server_timing = profiled_client.get("/dataset").headers["Server-Timing"]
+        assert server_timing.startswith("total;dur=")
+        assert 'helper.slow_helper;desc="2x";dur=' in server_timing
+
+    def test_not_profiled_by_default(self):
+        app = flask.Flask(__name__)
+        app.route("/dataset")(lambda: "ok")
+        client = middleware.apply_profiling(app, {}).test_client()
+        assert "Server-Timing" not in client.get("/dataset").headers
+
+    def test_slowest_calls_come_first(self):
+        timings = middleware.server_timings({
+            ("helper", "fast"): [3, 0.001],
+            ("action", "slow"): [1, 0.5],
+        }, 0.6)
+        assert timings == [
+            "total;dur=600.0",
+            'action.slow;desc="1x";dur=500.0',
+            'helper.fast;desc="3x";dur=1.0',
+        ]
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestConditionalGet():
+
+    def _url(self, dataset):
+        return f"/api/3/action/package_show?id={dataset['id']}"
+
+    def test_etag_is_set(self, app):
+        dataset = factories.Dataset()
+        response = app.get(self._url(dataset))
+        assert response.headers['ETag']
+        assert response.headers['Last-Modified']
+
+    def test_unchanged_dataset_is_not_modified(self, app):
+        dataset = factories.Dataset()
+        etag = app.get(self._url(dataset)).headers['ETag']
+        response = app.get(self._url(dataset), headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+
+    def test_changed_dataset_is_modified(self, app):
+        dataset = factories.Dataset()
+        etag = app.get(self._url(dataset)).headers['ETag']
+        call_action('package_patch', id=dataset['id'], notes='Changed')
+        response = app.get(self._url(dataset), headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_etag_depends_on_user(self, app):
+        dataset = factories.Dataset()
+        user = factories.UserWithToken()
+        etag = app.get(self._url(dataset)).headers['ETag']
+        response = app.get(
+            self._url(dataset),
+            headers={'If-None-Match': etag, 'Authorization': user['token']}
+        )
+        assert response.status_code == 200
+
+    def test_dataset_page(self, app):
+        dataset = factories.Dataset()
+        etag = app.get(f"/dataset/{dataset['name']}").headers['ETag']
+        response = app.get(f"/dataset/{dataset['name']}", headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+    @mock.patch('ckanext.who_romania.jobs.toolkit.enqueue_job')
+    def test_validation_results_modify_dataset_page(self, mock_enqueue_job, app):
+        dataset = factories.Dataset()
+        resource = factories.Resource(package_id=dataset['id'], url='report.csv', sha256='abc', size=10)
+        etag = app.get(f"/dataset/{dataset['name']}").headers['ETag']
+        model.Session.add(ResourceValidation(
+            resource_id=resource['id'], sha256='abc', status=ResourceValidation.FAILURE, errors=['Missing column']
+        ))
+        model.Session.commit()
+        response = app.get(f"/dataset/{dataset['name']}", headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_private_datasets_are_not_answered(self, app):
+        dataset = factories.Dataset(private=True, owner_org=factories.Organization()['id'])
+        response = app.get(self._url(dataset), headers={'If-None-Match': '*'})
+        assert response.status_code == 403
@@ -0,0 +1,65 @@
+import contextlib
+import io
+
+import mock
+import pytest
+from ckanext.who_romania import preview
+
+REPORT = "indicator,consultations\nflu,3\ncovid,2\nrsv,1\n"
+
+
+def _open(report):
+    @contextlib.contextmanager
+    def open_report(context, resource, encoding='utf-8-sig'):
+        yield io.StringIO(report)
+    return mock.patch.object(preview.who_romania_upload, 'open_giftless_resource', open_report)
+
+
+@pytest.mark.ckan_config('ckanext.who_romania.preview_max_xlsx_size', 1000)
+@pytest.mark.usefixtures('ckan_config')
+class TestIsPreviewable():
+
+    @pytest.mark.parametrize('resource, previewable', [
+        ({'sha256': 'abc', 'format': 'CSV'}, True),
+        ({'sha256': 'abc', 'url': 'report.xlsx', 'size': 1000}, True),
+        ({'sha256': 'abc', 'url': 'report.xlsx', 'size': 1001}, False),
+        ({'sha256': 'abc', 'format': 'CSV', 'size': 1001}, True),
+        ({'sha256': 'abc', 'format': 'PDF'}, False),
+        ({'format': 'CSV'}, False),
+    ])
+    def test_is_previewable(self, resource, previewable):
+        assert preview.is_previewable(resource) == previewable
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestPreviewResource():
+
+    @pytest.mark.ckan_config('ckanext.who_romania.preview_rows', 2)
+    def test_first_rows_are_previewed(self):
+        resource = {'id': 'resource-1', 'sha256': 'abc', 'format': 'CSV'}
+        with _open(REPORT):
+            preview.preview_resource({}, resource)
+        stored = preview.get_resource_preview(resource)
+        assert stored['schema'] == {'fields': [
+            {'name': 'indicator', 'type': 'string'},
+            {'name': 'consultations', 'type': 'integer'},
+        ]}
+        assert stored['rows'] == [['flu', '3'], ['covid', '2']]
+        assert stored['truncated']
+
+    def test_short_files_are_not_truncated(self):
+        resource = {'id': 'resource-1', 'sha256': 'abc', 'format': 'CSV'}
+        with _open(REPORT):
+            preview.preview_resource({}, resource)
+        assert not preview.get_resource_preview(resource)['truncated']
+
+    def test_blobs_are_only_previewed_once(self):
+        with _open(REPORT):
+            preview.preview_resource({}, {'id': 'resource-1', 'sha256': 'abc', 'format': 'CSV'})
+        with _open("other\n1\n"):
+            preview.preview_resource({}, {'id': 'resource-2', 'sha256': 'abc', 'format': 'CSV'})
+        assert len(preview.get_resource_preview({'sha256': 'abc'})['rows']) == 3
+
+    def test_no_preview(self):
+        assert preview.get_resource_preview({'sha256': 'abc'}) is None
+        assert preview.get_resource_preview({}) is None
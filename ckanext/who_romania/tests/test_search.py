@@ -0,0 +1,52 @@
+import json
+
+import pytest
+from ckanext.who_romania import search
+
+
+def _pkg_dict(resources=(), **fields):
+    return dict(
+        fields,
+        id='dataset-1',
+        validated_data_dict=json.dumps(dict(fields, resources=list(resources)))
+    )
+
+
+class TestIndexFields():
+
+    def test_month_is_indexed_as_a_date(self):
+        pkg_dict = search.index_fields(_pkg_dict(month='2023-09'))
+        assert pkg_dict['month_date'] == '2023-09-01T00:00:00Z'
+        assert pkg_dict['month'] == '2023-09'
+
+    def test_invalid_month_is_not_indexed(self):
+        assert 'month_date' not in search.index_fields(_pkg_dict(month='September'))
+
+    @pytest.mark.parametrize('approval, indexed', [
+        ('true', 'true'),
+        ('True', 'true'),
+        (True, 'true'),
+        ('false', 'false'),
+        (False, 'false'),
+    ])
+    def test_approval_is_indexed_as_a_boolean(self, approval, indexed):
+        assert search.index_fields(_pkg_dict(approval=approval))['approval'] == indexed
+
+    def test_missing_approval_is_not_indexed(self):
+        assert 'approval' not in search.index_fields(_pkg_dict())
+
+    def test_weeks_and_family_doctors_are_indexed_from_resources(self):
+        pkg_dict = search.index_fields(_pkg_dict(resources=[
+            {'week': '2023-09-15', 'family_doctor': 'SERBAN'},
+            {'week': '2023-09-08', 'family_doctor': 'SERBAN'},
+            {'week': '2023-09-08', 'family_doctor': 'BETCU'},
+            {'week': 'not a week', 'name': 'notes.txt'},
+        ]))
+        assert pkg_dict['vocab_weeks'] == ['2023-09-08', '2023-09-15']
+        assert pkg_dict['vocab_family_doctors'] == ['BETCU', 'SERBAN']
+
+    def test_datasets_without_reports(self):
+        pkg_dict = search.index_fields(_pkg_dict(program_area='General'))
+        assert 'vocab_weeks' not in pkg_dict
+        assert 'vocab_family_doctors' not in pkg_dict
+        assert pkg_dict['program_area'] == 'General'
@@ -0,0 +1,61 @@
+import gzip
+
+import flask
+import pytest
+from ckanext.who_romania import static
+
+SCRIPT = b"function hello() { return 'hello'; }\n" * 100
+
+
+@pytest.fixture
+def assets(tmp_path):
+    (tmp_path / "bundle.js").write_bytes(SCRIPT)
+    (tmp_path / "fonts").mkdir()
+    (tmp_path / "fonts" / "Inter.woff2").write_bytes(b"wOF2")
+    return tmp_path
+
+
+@pytest.fixture
+def client(assets):
+    static.compress_directory(str(assets))
+    app = flask.Flask(__name__)
+
+    @app.route("/<path:path>")
+    def view(path):
+        return "original"
+
+    return static.apply_precompressed(app, [("/webassets", str(assets))]).test_client()
+
+
+class TestCompressDirectory():
+
+    def test_gzip_copies_are_written(self, assets):
+        static.compress_directory(str(assets))
+        assert gzip.decompress((assets / "bundle.js.gz").read_bytes()) == SCRIPT
+
+    def test_compressed_formats_are_skipped(self, assets):
+        static.compress_directory(str(assets))
+        assert not (assets / "fonts" / "Inter.woff2.gz").exists()
+
+    def test_up_to_date_copies_are_not_rewritten(self, assets):
+        static.compress_directory(str(assets))
+        assert static.compress_directory(str(assets)) == 0
+
+
+class TestPrecompressed():
+
+    def test_gzip_copy_is_served(self, client):
+        response = client.get("/webassets/bundle.js", headers={"Accept-Encoding": "gzip, deflate"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.mimetype in ("text/javascript", "application/javascript")
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert gzip.decompress(response.data) == SCRIPT
+
+    def test_original_is_served_without_accept_encoding(self, client):
+        response = client.get("/webassets/bundle.js", headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in response.headers
+        assert response.data == b"original"
+
+    def test_files_without_copies_are_left_alone(self, client):
+        response = client.get("/webassets/fonts/Inter.woff2", headers={"Accept-Encoding": "gzip"})
+        assert response.data == b"original"
@@ -0,0 +1,71 @@
+import io
+
+import pytest
+from ckanext.who_romania import tabular
+
+
+class TestCsvChunks():
+
+    def test_rows_are_read_in_chunks(self):
+        header, chunks = tabular.csv_chunks(io.StringIO(" a ,b\n1,2\n3\n\n4,5,6\n"), chunk_rows=2)
+        assert header == ['a', 'b']
+        assert list(chunks) == [[['1', '2'], ['3', '']], [['4', '5']]]
+
+    def test_empty_file(self):
+        header, chunks = tabular.csv_chunks(io.StringIO(""))
+        assert header == []
+        assert list(chunks) == []
+
+
+class TestInferFieldType():
+
+    @pytest.mark.parametrize('values, field_type', [
+        (['1', '', '-2'], 'integer'),
+        (['1', '2.5'], 'number'),
+        (['true', 'False'], 'boolean'),
+        (['2023-09-24'], 'date'),
+        (['2023-09-24T10:00:00'], 'datetime'),
+        (['1', 'flu'], 'string'),
+        (['', ' '], 'string'),
+    ])
+    def test_field_type(self, values, field_type):
+        assert tabular.infer_field_type(values) == field_type
+
+
+class TestTemplateSchema():
+
+    def test_no_schema_configured(self):
+        assert tabular.template_schema() is None
+
+    def test_schema_is_read(self, tmp_path, ckan_config, monkeypatch):
+        schema_file = tmp_path / 'schema.json'
+        schema_file.write_text('{"fields": [{"name": "consultations", "type": "integer"}]}')
+        monkeypatch.setitem(
+            ckan_config, 'ckanext.who_romania.family_medicine_template_schema', str(schema_file)
+        )
+        fields = tabular.schema_fields(tabular.template_schema())
+        assert fields['consultations']['type'] == 'integer'
+
+
+class TestAggregationColumns():
+
+    def test_numeric_fields_are_summed(self):
+        schema = {
+            'fields': [
+                {'name': 'doctor_code', 'type': 'integer'},
+                {'name': 'indicator', 'type': 'string'},
+                {'name': 'consultations', 'type': 'integer'},
+                {'name': 'cost', 'type': 'number'},
+            ],
+            'primaryKey': ['doctor_code', 'indicator'],
+        }
+        assert tabular.aggregation_columns(schema) == (
+            ['doctor_code', 'indicator'], ['consultations', 'cost']
+        )
+
+    def test_primary_key_may_be_a_single_field(self):
+        schema = {
+            'fields': [{'name': 'doctor_code', 'type': 'integer'}, {'name': 'consultations', 'type': 'integer'}],
+            'primaryKey': 'doctor_code',
+        }
+        assert tabular.aggregation_columns(schema) == (['doctor_code'], ['consultations'])
@@ -0,0 +1,101 @@
+import contextlib
+import io
+
+import mock
+import pytest
+from ckan.tests import factories
+from ckan.tests.helpers import call_action
+from ckanext.who_romania import validation
+
+SCHEMA = {'fields': [
+    {'name': 'indicator', 'type': 'string', 'constraints': {'required': True, 'enum': ['flu', 'covid']}},
+    {'name': 'consultations', 'type': 'integer', 'constraints': {'minimum': 0}},
+    {'name': 'date', 'type': 'date'},
+]}
+
+
+class TestValidateReport():
+
+    def test_valid_report(self):
+        report = io.StringIO("indicator,consultations,date\nflu,3,2023-09-24\ncovid,,\n")
+        assert validation.validate_report(report, SCHEMA) == []
+
+    def test_header(self):
+        report = io.StringIO("indicator,cases\n")
+        assert validation.validate_report(report, SCHEMA) == [
+            "Missing column consultations",
+            "Missing column date",
+            "Unexpected column cases",
+        ]
+
+    def test_values(self):
+        report = io.StringIO("indicator,consultations,date\n,-1,24/09/2023\nrsv,three,\n")
+        assert validation.validate_report(report, SCHEMA) == [
+            "Row 2, column indicator: a value is required",
+            "Row 2, column consultations: -1 is less than 0",
+            "Row 2, column date: '24/09/2023' is not a valid date",
+            "Row 3, column indicator: 'rsv' is not one of flu, covid",
+            "Row 3, column consultations: 'three' is not a valid integer",
+        ]
+
+    def test_enum_values_are_compared_as_the_field_type(self):
+        schema = {'fields': [
+            {'name': 'code', 'type': 'integer', 'constraints': {'enum': [1, 2]}},
+            {'name': 'urgent', 'type': 'boolean', 'constraints': {'enum': [True]}},
+        ]}
+        report = io.StringIO("code,urgent\n01,TRUE\n3,false\n")
+        assert validation.validate_report(report, schema) == [
+            "Row 3, column code: '3' is not one of 1, 2",
+            "Row 3, column urgent: 'false' is not one of True",
+        ]
+
+    def test_fields_without_a_type_are_strings(self):
+        schema = {'fields': [{'name': 'code', 'constraints': {'minimum': 'B', 'maximum': 'D'}}]}
+        report = io.StringIO("code\nC\nA\n")
+        assert validation.validate_report(report, schema) == [
+            "Row 3, column code: A is less than B",
+        ]
+
+    def test_errors_are_capped(self):
+        report = io.StringIO("indicator,consultations,date\n" + "flu,x,\n" * 100)
+        assert len(validation.validate_report(report, SCHEMA)) == validation.MAX_ERRORS
+
+
+def _open(report):
+    @contextlib.contextmanager
+    def open_report(context, resource, encoding='utf-8-sig'):
+        yield io.StringIO(report)
+    return mock.patch.object(validation.who_romania_upload, 'open_giftless_resource', open_report)
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+@mock.patch('ckanext.who_romania.jobs.toolkit.enqueue_job')
+class TestFailedReports():
+
+    @pytest.mark.parametrize('report, failed', [
+        ("indicator,consultations,date\nflu,3,2023-09-24\n", False),
+        ("indicator,consultations,date\nrsv,3,2023-09-24\n", True),
+    ])
+    def test_failed_reports(self, mock_enqueue_job, report, failed):
+        resource = factories.Resource(url='report.csv', sha256='abc', size=10)
+        with _open(report):
+            validation.validate_resource({}, resource, SCHEMA)
+        dataset = call_action('package_show', id=resource['package_id'])
+        assert [r['id'] for r in validation.failed_reports(dataset)] == ([resource['id']] if failed else [])
+
+    def test_results_outlast_resource_edits(self, mock_enqueue_job):
+        resource = factories.Resource(url='report.csv', sha256='abc', size=10)
+        with _open("indicator\n"):
+            validation.validate_resource({}, resource, SCHEMA)
+        resource = call_action('resource_update', id=resource['id'], url='report.csv',
+                               sha256='abc', size=10, description='Updated')
+        assert validation.get_resource_validation(resource)['status'] == validation.FAILURE
+
+    def test_results_for_replaced_blobs_are_ignored(self, mock_enqueue_job):
+        resource = factories.Resource(url='report.csv', sha256='abc', size=10)
+        with _open("indicator\n"):
+            validation.validate_resource({}, resource, SCHEMA)
+        resource = call_action('resource_patch', id=resource['id'], sha256='def')
+        assert validation.get_resource_validation(resource) is None
+        dataset = call_action('package_show', id=resource['package_id'])
+        assert validation.failed_reports(dataset) == []
@@ -1,5 +1,8 @@
+import contextlib
 import datetime
+import io
 import logging
+import requests
 from giftless_client import LfsClient
 from werkzeug.datastructures import FileStorage as FlaskFileStorage
 import ckanext.blob_storage.helpers as blobstorage_helpers
@@ -38,36 +41,50 @@ def _giftless_upload(context, resource, current=None):
             dataset = toolkit.get_action('package_show')(
                 context, {'id': dataset_id}
             )
-            dataset_name = dataset['name']
-            org_name = dataset.get('organization', {}).get('name')
-            authz_token = _get_upload_authz_token(
+            resource.update(upload_blob(
                 context,
-                dataset_name,
-                org_name
-            )
-            lfs_client = LfsClient(
-                lfs_server_url=blobstorage_helpers.server_url(),
-                auth_token=authz_token,
-                transfer_adapters=['basic']
-            )
-            uploaded_file = lfs_client.upload(
-                file_obj=attached_file,
-                organization=org_name,
-                repo=dataset_name
-            )
-            lfs_prefix = blobstorage_helpers.resource_storage_prefix(
-                dataset_name,
-                org_name=org_name
-            )
-
-            resource.update({
-                'url_type': 'upload',
-                'last_modified': datetime.datetime.utcnow(),
-                'sha256': uploaded_file['oid'],
-                'size': uploaded_file['size'],
-                'url': resource.get("filename", attached_file.filename),
-                'lfs_prefix': lfs_prefix
-            })
+                dataset,
+                attached_file,
+                resource.get("filename", attached_file.filename)
+            ))
+
+
+def upload_blob(context, dataset, file_obj, filename):
+    """
+    Uploads a file to giftless, into the dataset's storage, and returns the
+    fields to set on a resource for it.  Only giftless is talked to, so
+    uploads for a dataset may run concurrently once its authorization token
+    is fetched, by passing it in the context as ``giftless_token``.
+    """
+    dataset_name = dataset['name']
+    org_name = dataset.get('organization', {}).get('name')
+    authz_token = context.get('giftless_token') or _get_upload_authz_token(
+        context,
+        dataset_name,
+        org_name
+    )
+    lfs_client = LfsClient(
+        lfs_server_url=blobstorage_helpers.server_url(),
+        auth_token=authz_token,
+        transfer_adapters=['basic']
+    )
+    uploaded_file = lfs_client.upload(
+        file_obj=file_obj,
+        organization=org_name,
+        repo=dataset_name
+    )
+    lfs_prefix = blobstorage_helpers.resource_storage_prefix(
+        dataset_name,
+        org_name=org_name
+    )
+    return {
+        'url_type': 'upload',
+        'last_modified': datetime.datetime.utcnow(),
+        'sha256': uploaded_file['oid'],
+        'size': uploaded_file['size'],
+        'url': filename,
+        'lfs_prefix': lfs_prefix
+    }
 
 
 def _update_resource_last_modified_date(resource, current=None):
@@ -84,8 +101,46 @@ def _update_resource_last_modified_date(resource, current=None):
             return
 
 
-def _get_upload_authz_token(context, dataset_name, org_name):
-    scope = 'obj:{}/{}/*:write'.format(org_name, dataset_name)
+@contextlib.contextmanager
+def open_giftless_resource(context, resource, encoding='utf-8-sig'):
+    """
+    Opens a resource stored in giftless as a text file object, streaming the
+    blob from storage as it is read rather than downloading it in one go.
+    With no encoding, the binary stream is returned instead.
+    """
+    dataset = toolkit.get_action('package_show')(
+        context, {'id': resource['package_id']}
+    )
+    dataset_name = dataset['name']
+    org_name = dataset.get('organization', {}).get('name')
+    authz_token = _get_upload_authz_token(
+        context,
+        dataset_name,
+        org_name,
+        permission='read'
+    )
+    lfs_client = LfsClient(
+        lfs_server_url=blobstorage_helpers.server_url(),
+        auth_token=authz_token,
+        transfer_adapters=['basic']
+    )
+    batch = lfs_client.batch(
+        '{}/{}'.format(org_name, dataset_name),
+        'download',
+        [{'oid': resource['sha256'], 'size': resource['size']}]
+    )
+    download = batch['objects'][0]['actions']['download']
+    with requests.get(download['href'], headers=download.get('header', {}), stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        if encoding is None:
+            yield response.raw
+        else:
+            yield io.TextIOWrapper(response.raw, encoding=encoding, newline='')
+
+
+def _get_upload_authz_token(context, dataset_name, org_name, permission='write'):
+    scope = 'obj:{}/{}/*:{}'.format(org_name, dataset_name, permission)
     authorize = toolkit.get_action('authz_authorize')
 
     if not authorize:
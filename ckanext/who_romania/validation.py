@@ -0,0 +1,109 @@
+import logging
+
+import ckan.model as model
+import ckanext.who_romania.tabular as tabular
+import ckanext.who_romania.upload as who_romania_upload
+from ckanext.who_romania.model import ResourceValidation
+
+
+log = logging.getLogger(__name__)
+
+MAX_ERRORS = 20
+
+SUCCESS = ResourceValidation.SUCCESS
+FAILURE = ResourceValidation.FAILURE
+
+
+def validate_resource(context, resource, schema):
+    """
+    Validates an uploaded CSV report against the reporting template's schema
+    and stores the result against the resource and the sha256 of its blob.
+    """
+    with who_romania_upload.open_giftless_resource(context, resource) as report:
+        errors = validate_report(report, schema)
+    model.Session.merge(ResourceValidation(
+        resource_id=resource['id'],
+        sha256=resource['sha256'],
+        status=FAILURE if errors else SUCCESS,
+        errors=errors
+    ))
+    model.Session.commit()
+    if errors:
+        log.info(f"Report {resource['id']} failed validation with {len(errors)} errors")
+    return errors
+
+
+def validate_report(report, schema):
+    """
+    Checks a CSV file object against a Frictionless Table Schema, reading it
+    a chunk of rows at a time so memory use stays constant.  The header must
+    hold the schema's fields, and each value must be of its field's type
+    and meet its field's constraints.
+
+    Returns a list of error messages, stopping at MAX_ERRORS.
+    """
+    fields = tabular.schema_fields(schema)
+    header, chunks = tabular.csv_chunks(report)
+    errors = [
+        f"Missing column {name}" for name in fields if name not in header
+    ] + [
+        f"Unexpected column {name or '(blank)'}" for name in header if name not in fields
+    ]
+    checks = [(i, fields[name]) for i, name in enumerate(header) if name in fields]
+    row_number = 1
+    for chunk in chunks:
+        for row in chunk:
+            row_number += 1
+            for i, field in checks:
+                error = _check_value(row[i].strip(), field)
+                if error:
+                    errors.append(f"Row {row_number}, column {field['name']}: {error}")
+            if len(errors) >= MAX_ERRORS:
+                return errors[:MAX_ERRORS]
+    return errors
+
+
+def get_resource_validation(resource):
+    """Returns the validation result for a resource's current blob, if there is one"""
+    if not resource.get('sha256'):
+        return None
+    result = ResourceValidation.for_resources([resource]).get(resource['id'])
+    return result.as_dict() if result else None
+
+
+def failed_reports(dataset):
+    """Returns the resources of a dataset whose current blob failed validation"""
+    resources = dataset.get('resources', [])
+    results = ResourceValidation.for_resources(resources)
+    return [
+        resource for resource in resources
+        if resource['id'] in results and results[resource['id']].status == FAILURE
+    ]
+
+
+def _check_value(value, field):
+    constraints = field.get('constraints', {})
+    if not value:
+        return "a value is required" if constraints.get('required') else None
+    field_type = field.get('type', 'string')
+    try:
+        typed = tabular.parse_value(value, field_type)
+    except ValueError:
+        return f"'{value}' is not a valid {field_type}"
+    if 'enum' in constraints and typed not in _enum_values(constraints['enum'], field_type):
+        return f"'{value}' is not one of {', '.join(map(str, constraints['enum']))}"
+    if 'minimum' in constraints and typed < tabular.parse_value(str(constraints['minimum']), field_type):
+        return f"{value} is less than {constraints['minimum']}"
+    if 'maximum' in constraints and typed > tabular.parse_value(str(constraints['maximum']), field_type):
+        return f"{value} is more than {constraints['maximum']}"
+    return None
+
+
+def _enum_values(enum, field_type):
+    values = []
+    for value in enum:
+        try:
+            values.append(tabular.parse_value(str(value), field_type))
+        except ValueError:
+            continue
+    return values